@@ -0,0 +1,66 @@
+"""Show that the per-record cost of deduplication stays flat as the window fills.
+
+Feeds unique keys at a fixed rate through each index, twice the number of keys
+one window holds, so the second half runs with a full window that evicts as
+fast as it inserts. Keys are added in dispatcher-sized batches. Run from the
+repository root:
+
+    python -m benchmarks.bench_dedup --window-keys 200000
+"""
+import argparse
+import time
+from src.dispatcher.dedup import RotatingBloomFilter, TimeWindowIndex
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def run_index(name, index, clock, window_keys, slices, batch_size):
+    """Print ns/record for each slice of the run; returns the list of costs."""
+    total = 2 * window_keys
+    per_slice = total // slices
+    costs = []
+    print(f"{name}")
+    for n in range(slices):
+        keys = [("VEH-%d" % (i % 10000), i) for i in range(n * per_slice, (n + 1) * per_slice)]
+        start = time.perf_counter()
+        for offset in range(0, per_slice, batch_size):
+            clock.now = (n * per_slice + offset) / window_keys  # The window is one second long
+            index.add_many(keys[offset:offset + batch_size])
+        cost = (time.perf_counter() - start) / per_slice * 1e9
+        costs.append(cost)
+        fill = min(1.0, (n + 1) * per_slice / window_keys)
+        print(f"  records {(n + 1) * per_slice:>10,}  window {fill:>5.0%} full  {cost:>8,.0f} ns/record")
+    spread = max(costs) / min(costs)
+    print(f"  slowest/fastest slice: {spread:.2f}x")
+    return costs
+
+def run(window_keys, slices, backends, batch_size):
+    results = {}
+    if "window" in backends:
+        clock = _Clock()
+        index = TimeWindowIndex(window=1.0, max_keys=2 * window_keys, clock=clock)
+        results["window"] = run_index("TimeWindowIndex", index, clock, window_keys, slices, batch_size)
+    if "bloom" in backends:
+        clock = _Clock()
+        index = RotatingBloomFilter(window=1.0, capacity=window_keys, clock=clock)
+        results["bloom"] = run_index(
+            f"RotatingBloomFilter ({index.memory_bytes / 1e6:.1f} MB)", index, clock, window_keys,
+            slices, batch_size)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--window-keys", type=int, default=200000)
+    parser.add_argument("--slices", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=500, help="Records per dispatcher batch")
+    parser.add_argument("--backend", choices=["window", "bloom", "both"], default="both")
+    args = parser.parse_args()
+    backends = ["window", "bloom"] if args.backend == "both" else [args.backend]
+    run(args.window_keys, args.slices, backends, args.batch_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Compare per-record validation throughput before and after compiled validators.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_schema_registry --records 50000
+"""
+import argparse
+import tempfile
+import time
+from jsonschema import validate, ValidationError
+from benchmarks.records import LOCATION_SCHEMA, make_records
+from src.schema_registry.registry import SchemaRegistry
+from src.schema_registry.validators import compile_validator
+
+def measure(fn, records):
+    """Return records/sec for calling fn on every record."""
+    start = time.perf_counter()
+    for record in records:
+        fn(record)
+    return len(records) / (time.perf_counter() - start)
+
+def run(count, invalid_ratio):
+    records = make_records(count, invalid_ratio)
+    schema = LOCATION_SCHEMA["schema"]
+    
+    def baseline(record):
+        try:
+            validate(instance=record, schema=schema)
+        except ValidationError:
+            pass
+            
+    with tempfile.TemporaryDirectory() as schema_dir:
+        registry = SchemaRegistry(schema_dir=schema_dir)
+        registry.register_schema("location_v1", LOCATION_SCHEMA)
+        no_fast_path = compile_validator(schema, fast_path=False)
+        
+        results = {
+            "jsonschema.validate": measure(baseline, records),
+            "compiled": measure(no_fast_path, records),
+            "compiled+fast_path": measure(
+                lambda r: registry.validate_data(r, "location_v1"), records),
+        }
+        
+    base = results["jsonschema.validate"]
+    print(f"{count} records, {invalid_ratio:.0%} invalid")
+    for name, rate in results.items():
+        print(f"  {name:<22} {rate:>12,.0f} records/sec  ({rate / base:.1f}x)")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--invalid-ratio", type=float, default=0.01)
+    args = parser.parse_args()
+    run(args.records, args.invalid_ratio)
+
+if __name__ == "__main__":
+    main()
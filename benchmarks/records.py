@@ -0,0 +1,59 @@
+"""Synthetic location_v1 records for the benchmarks."""
+import random
+import time
+
+LOCATION_SCHEMA = {
+    "schema_id": "location_v1",
+    "version": 1,
+    "type": "json",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "vehicle_id": {"type": "string"},
+            "lat": {"type": "number"},
+            "lng": {"type": "number"},
+            "timestamp": {"type": "string"}
+        },
+        "required": ["vehicle_id", "lat", "lng", "timestamp"]
+    }
+}
+
+LOCATION_AVRO_SCHEMA = {
+    "schema_id": "location_avro_v1",
+    "version": 1,
+    "type": "avro",
+    "schema": {
+        "type": "record",
+        "name": "Location",
+        "fields": [
+            {"name": "vehicle_id", "type": "string"},
+            {"name": "lat", "type": "double"},
+            {"name": "lng", "type": "double"},
+            {"name": "timestamp", "type": "string"}
+        ]
+    }
+}
+
+def make_records(count, invalid_ratio=0.0, seed=None):
+    """Generate location_v1 records, a fraction of them invalid."""
+    rng = random.Random(seed)
+    timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    records = []
+    for _ in range(count):
+        record = {
+            "vehicle_id": f"VEH-{rng.randint(1000, 9999)}",
+            "lat": rng.uniform(37.7, 38.2),
+            "lng": rng.uniform(-122.5, -122.1),
+            "timestamp": timestamp
+        }
+        if rng.random() < invalid_ratio:
+            record["lat"] = "not_a_number"
+        records.append(record)
+    return records
+
+def write_csv(path, records):
+    """Write records as a CSV file with a header row."""
+    with open(path, "w") as f:
+        f.write("vehicle_id,lat,lng,timestamp\n")
+        for r in records:
+            f.write(f"{r['vehicle_id']},{r['lat']},{r['lng']},{r['timestamp']}\n")
@@ -0,0 +1,316 @@
+"""Throughput and latency benchmarks for the ingestion pipeline.
+
+Reports records/sec and p50/p99 latency per call for validation, the
+dispatcher, the output sinks, payload decoding and the CSV adapter. With
+--baseline it exits with status 1 when a benchmark regressed by more than
+--threshold. Run from the repository root:
+
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --baseline bench.json --threshold 0.15
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.records import LOCATION_AVRO_SCHEMA, LOCATION_SCHEMA, make_records, write_csv
+from src.adapters.batch.csv_adapter import CsvAdapter
+from src.dispatcher.core import Dispatcher
+from src.output.sinks import JsonLinesSink, WireFormatSink
+from src.schema_registry.registry import SchemaRegistry
+
+class Timings:
+    """Latency of each timed call plus the number of records it handled."""
+
+    def __init__(self):
+        self.latencies = []
+        self.records = 0
+
+    def time(self, fn, records):
+        start = time.perf_counter()
+        fn()
+        self.latencies.append(time.perf_counter() - start)
+        self.records += records
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        elapsed = sum(latencies)
+        return {
+            "records": self.records,
+            "calls": len(latencies),
+            "records_per_sec": self.records / elapsed if elapsed else 0.0,
+            "p50_ms": _percentile(latencies, 0.50) * 1000,
+            "p99_ms": _percentile(latencies, 0.99) * 1000,
+        }
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+class Workspace:
+    """Temporary schema, input and output directories for one benchmark."""
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix="ingest-bench-")
+        self.registry = SchemaRegistry(schema_dir=os.path.join(self.root, "schemas"))
+        self.registry.register_schema("location_v1", LOCATION_SCHEMA)
+        self.registry.register_schema("location_avro_v1", LOCATION_AVRO_SCHEMA)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def dispatcher(self):
+        return Dispatcher(self.registry, output_dir=self.path("output"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+def bench_validate(records, batch_size):
+    timings = Timings()
+    with Workspace() as ws:
+        for record in records:
+            timings.time(lambda: ws.registry.validate_data(record, "location_v1"), 1)
+    return timings
+
+def bench_validate_batch(records, batch_size):
+    timings = Timings()
+    with Workspace() as ws:
+        for batch in _batches(records, batch_size):
+            timings.time(lambda: ws.registry.validate_batch(batch, "location_v1"), len(batch))
+    return timings
+
+def bench_receive_data(records, batch_size):
+    timings = Timings()
+    with Workspace() as ws:
+        dispatcher = ws.dispatcher()
+        for record in records:
+            timings.time(lambda: dispatcher.receive_data(record, "bench", "location_v1"), 1)
+        dispatcher.close()
+    return timings
+
+def bench_receive_batch(records, batch_size):
+    timings = Timings()
+    with Workspace() as ws:
+        dispatcher = ws.dispatcher()
+        for batch in _batches(records, batch_size):
+            timings.time(lambda: dispatcher.receive_batch(batch, "bench", "location_v1"), len(batch))
+        dispatcher.close()
+    return timings
+
+def bench_jsonl_sink(records, batch_size):
+    timings = Timings()
+    with Workspace() as ws:
+        sink = JsonLinesSink(ws.path("output"), flush_interval=3600)
+        for batch in _batches(records, batch_size):
+            timings.time(lambda: sink.write("bench", batch), len(batch))
+        timings.time(sink.close, 0)
+    return timings
+
+def bench_wire_sink(records, batch_size):
+    timings = Timings()
+    with Workspace() as ws:
+        sink = WireFormatSink(ws.registry, ws.path("output"), flush_interval=3600)
+        for batch in _batches(records, batch_size):
+            timings.time(lambda: sink.write("bench", batch, "location_avro_v1"), len(batch))
+        timings.time(sink.close, 0)
+    return timings
+
+def bench_avro_decode(records, batch_size):
+    from src.schema_registry.wire_format import AvroCodec
+    timings = Timings()
+    with Workspace() as ws:
+        codec = AvroCodec(ws.registry)
+        payloads = codec.encode_batch(records, "location_avro_v1")[0]
+        for batch in _batches(payloads, batch_size):
+            timings.time(lambda: codec.decode_batch(batch, "location_avro_v1"), len(batch))
+    return timings
+
+def bench_json_decode(records, batch_size):
+    timings = Timings()
+    with Workspace() as ws:
+        payloads = [json.dumps(record).encode("utf-8") for record in records]
+        for batch in _batches(payloads, batch_size):
+            timings.time(lambda: ws.registry.validate_batch([json.loads(p) for p in batch], "location_v1"),
+                         len(batch))
+    return timings
+
+def bench_parquet_sink(records, batch_size):
+    from src.output.parquet_writer import ParquetWriter
+    timings = Timings()
+    with Workspace() as ws:
+        writer = ParquetWriter(ws.registry, output_dir=ws.path("parquet"), flush_interval=3600)
+        for batch in _batches(records, batch_size):
+            timings.time(lambda: writer.process_batch(batch, "bench", "location_v1"), len(batch))
+        timings.time(writer.close, 0)
+    return timings
+
+def bench_database(records, batch_size):
+    from src.output.database_writer import DatabaseWriter
+    timings = Timings()
+    with Workspace() as ws:
+        writer = DatabaseWriter(ws.registry, path=ws.path("ingest.db"), flush_interval=3600)
+        for batch in _batches(records, batch_size):
+            timings.time(lambda: writer.process_batch(batch, "bench", "location_v1"), len(batch))
+        timings.time(writer.close, 0)
+    return timings
+
+def bench_geo_aggregator(records, batch_size):
+    from src.output.geo_aggregator import GeoAggregator
+    timings = Timings()
+    aggregator = GeoAggregator(window_seconds=3600)
+    for batch in _batches(records, batch_size):
+        timings.time(lambda: aggregator.process_batch(batch, "bench", "location_v1"), len(batch))
+    timings.time(lambda: aggregator.within(37.9, -122.4, 38.0, -122.3), 0)
+    aggregator.close()
+    return timings
+
+def bench_csv(rows, batch_size, files=3):
+    """Ingest ``files`` CSV files of ``rows`` rows each, timing each file end to end."""
+    timings = Timings()
+    with Workspace() as ws:
+        dispatcher = ws.dispatcher()
+        adapter = CsvAdapter(dispatcher, input_dir=ws.path("input"), batch_size=batch_size)
+        os.remove(os.path.join(adapter.input_dir, "sample_locations.csv"))
+        for n in range(files):
+            write_csv(os.path.join(adapter.input_dir, f"bench_{n}.csv"), make_records(rows, 0.01, seed=n))
+            timings.time(adapter.ingest, rows)
+        adapter.close()
+        dispatcher.close()
+    return timings
+
+def _batches(records, batch_size):
+    return [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+
+def _available(module):
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+RECORD_BENCHMARKS = {
+    "validate_data": bench_validate,
+    "validate_batch": bench_validate_batch,
+    "dispatcher.receive_data": bench_receive_data,
+    "dispatcher.receive_batch": bench_receive_batch,
+    "sink.jsonl": bench_jsonl_sink,
+    "sink.wire": bench_wire_sink,
+    "sink.parquet": bench_parquet_sink,
+    "sink.database": bench_database,
+    "aggregation.geo": bench_geo_aggregator,
+    "decode.json": bench_json_decode,
+    "decode.avro": bench_avro_decode,
+}
+
+def run(count=20000, batch_size=500, csv_rows=(1000, 10000, 100000), invalid_ratio=0.01, only=None):
+    """Run the selected benchmarks and return ``{name: summary}``."""
+    records = make_records(count, invalid_ratio, seed=0)
+    valid = [r for r in records if isinstance(r["lat"], float)]
+    results = {}
+
+    def selected(name):
+        return not only or any(name.startswith(prefix) for prefix in only)
+
+    for name, bench in RECORD_BENCHMARKS.items():
+        if not selected(name):
+            continue
+        if name == "sink.parquet" and not _available("pyarrow") \
+                or name in ("sink.wire", "decode.avro") and not _available("fastavro"):
+            print(f"  {name:<28} skipped (optional dependency not installed)")
+            continue
+        # Sinks and encoded payloads only ever hold validated records
+        results[name] = bench(records if name.startswith(("validate", "dispatcher.")) else valid,
+                              batch_size).summary()
+        _report(name, results[name])
+    for rows in csv_rows:
+        name = f"csv.ingest[{rows}]"
+        if selected(name):
+            results[name] = bench_csv(rows, batch_size).summary()
+            _report(name, results[name])
+    return results
+
+def _report(name, summary):
+    print(f"  {name:<28} {summary['records_per_sec']:>12,.0f} records/sec"
+          f"  p50 {summary['p50_ms']:>9.3f} ms  p99 {summary['p99_ms']:>9.3f} ms")
+
+def metadata(count, batch_size):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "records": count,
+        "batch_size": batch_size,
+    }
+
+def compare(results, baseline, threshold=0.1):
+    """Return a description of every benchmark that regressed against the baseline.
+
+    A benchmark regressed when its throughput dropped, or its p99 latency grew,
+    by more than ``threshold`` (a fraction) relative to the baseline run.
+    Benchmarks missing from either run are ignored.
+    """
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current["records_per_sec"] < previous["records_per_sec"] * (1 - threshold):
+            regressions.append(f"{name}: throughput {previous['records_per_sec']:,.0f} -> "
+                               f"{current['records_per_sec']:,.0f} records/sec")
+        if current["p99_ms"] > previous["p99_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p99 {previous['p99_ms']:.3f} -> {current['p99_ms']:.3f} ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--csv-rows", default="1000,10000,100000",
+                        help="Comma-separated CSV file sizes in rows")
+    parser.add_argument("--invalid-ratio", type=float, default=0.01)
+    parser.add_argument("--only", action="append", help="Run benchmarks whose name starts with this")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results saved with --output")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Allowed relative slowdown before a benchmark counts as regressed")
+    parser.add_argument("--verbose", action="store_true", help="Keep application logging enabled")
+    args = parser.parse_args(argv)
+    if not args.verbose:
+        # Rejected synthetic records would otherwise log errors into the measurements
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    csv_rows = [int(rows) for rows in args.csv_rows.split(",") if rows]
+    print(f"{args.records} records, batches of {args.batch_size}")
+    results = run(args.records, args.batch_size, csv_rows, args.invalid_ratio, args.only)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(args.records, args.batch_size), "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,50 +2,196 @@ import json
 import threading
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor
 from src.adapters.base import IngestionAdapter
 from src.utils.logging import logger
 
 class ApiAdapter(IngestionAdapter):
-    def __init__(self, dispatcher, api_url=None, interval=60, schema_id="location_v1"):
+    """Polls one or more HTTP endpoints for records on a fixed-rate schedule.
+
+    Each endpoint is fetched through a pooled keep-alive session. A JSON list
+    response is a single page of records; an object response holds the records
+    under ``records_key`` and, when paginated, the page count under
+    ``total_pages_key``, in which case the remaining pages are fetched
+    concurrently. ETag and Last-Modified values are remembered per page URL
+    and sent back, so pages the server reports unchanged (304) are skipped.
+    Without any URL the adapter generates mock records for the demo.
+    """
+
+    def __init__(self, dispatcher, api_url=None, interval=60, schema_id="location_v1",
+                 endpoints=None, timeout=30, page_workers=4, page_param="page",
+                 records_key="data", total_pages_key="total_pages", max_pages=1000, session=None):
         super().__init__("api", dispatcher)
-        self.api_url = api_url or "https://mock-api/vehicle-locations"
-        self.interval = interval  # Seconds between API calls
+        self.endpoints = list(endpoints or ([api_url] if api_url else []))
+        self.api_url = api_url or (self.endpoints[0] if self.endpoints else "https://mock-api/vehicle-locations")
+        self.interval = interval  # Seconds between the starts of two polls
         self.schema_id = schema_id
+        self.timeout = timeout  # Seconds per HTTP request
+        self.page_workers = page_workers  # Pages of one endpoint fetched concurrently
+        self.page_param = page_param
+        self.records_key = records_key
+        self.total_pages_key = total_pages_key
+        self.max_pages = max_pages
+        self.session = session
         self.running = False
         self.timer_thread = None
         
+        self._stop = threading.Event()
+        self._validators = {}  # page URL -> (etag, last_modified, total_pages)
+        self._validators_lock = threading.Lock()
+        self._endpoint_pool = None
+        self._page_pool = None
+        self._in_progress = {}  # endpoint -> future of its running poll
+
     def connect(self):
-        """Initialize API connection (no actual connection needed for mock)."""
-        logger.info(f"Initializing API adapter for URL: {self.api_url}")
-        
+        """Create the pooled HTTP session and worker pools."""
+        logger.info(f"Initializing API adapter for URL: {', '.join(self.endpoints) or self.api_url}")
+        if not self.endpoints:
+            return
+        if self.session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            self.session = requests.Session()
+            pool = HTTPAdapter(pool_connections=len(self.endpoints),
+                               pool_maxsize=max(self.page_workers, len(self.endpoints)))
+            self.session.mount("http://", pool)
+            self.session.mount("https://", pool)
+        self._endpoint_pool = ThreadPoolExecutor(max_workers=len(self.endpoints),
+                                                 thread_name_prefix="api-endpoint")
+        self._page_pool = ThreadPoolExecutor(max_workers=self.page_workers,
+                                             thread_name_prefix="api-page")
+
     def ingest(self):
         """Start periodic ingestion from the API."""
         self.running = True
+        if self.endpoints and self._endpoint_pool is None:
+            self.connect()
         
         def fetch_periodically():
-            """Periodically fetch data from the API."""
+            """Start a poll every interval seconds, however long the previous one took."""
+            next_run = time.monotonic()
             while self.running:
                 try:
-                    data = self._fetch_data()
-                    if data:
-                        # Send each record to the dispatcher
-                        for record in data:
-                            self.dispatcher.receive_data(record, self.name, self.schema_id)
+                    self._start_polls()
                 except Exception as e:
                     logger.error(f"Error in API fetch: {str(e)}")
                 
-                time.sleep(self.interval)
-                
-        self.timer_thread = threading.Thread(target=fetch_periodically)
+                next_run += self.interval
+                now = time.monotonic()
+                if next_run < now:
+                    # Fell behind by more than a period: skip the missed polls instead of bursting
+                    missed = int((now - next_run) // self.interval) + 1
+                    logger.warning(f"API poll overran its interval, skipping {missed} poll(s)")
+                    next_run += missed * self.interval
+                if self._stop.wait(next_run - now):
+                    break
+        
+        self.timer_thread = threading.Thread(target=fetch_periodically, name="api-timer")
         self.timer_thread.daemon = True
         self.timer_thread.start()
+
+    def poll(self):
+        """Poll every endpoint once and wait for it; returns the number of records sent."""
+        if not self.endpoints:
+            return self._dispatch(self._fetch_data())
+        if self._endpoint_pool is None:
+            self.connect()
+        futures = [self._endpoint_pool.submit(self._poll_endpoint, url) for url in self.endpoints]
+        return sum(future.result() for future in futures)
+
+    def _start_polls(self):
+        """Start a poll of every endpoint whose previous poll has finished."""
+        if not self.endpoints:
+            self._dispatch(self._fetch_data())
+            return
+        for url in self.endpoints:
+            running = self._in_progress.get(url)
+            if running is not None and not running.done():
+                logger.warning(f"Previous poll of {url} still running, skipping this one")
+                continue
+            self._in_progress[url] = self._endpoint_pool.submit(self._poll_endpoint, url)
+
+    def _poll_endpoint(self, url):
+        """Fetch all pages of one endpoint and dispatch them in page order.
+
+        A page's validators are only remembered once its records have been
+        dispatched, so a page fetched during a failed poll is fetched in full
+        again next time. Returns the number of records dispatched, even if
+        the poll failed part way.
+        """
+        count = 0
+        futures = []
+        try:
+            first, total_pages, validators = self._fetch_page(url, 1)
+            count += self._dispatch(first)
+            self._remember(validators)
+            
+            pages = range(2, min(total_pages, self.max_pages) + 1)
+            futures = [self._page_pool.submit(self._fetch_page, url, page) for page in pages]
+            for future in futures:
+                records, _, validators = future.result()
+                count += self._dispatch(records)
+                self._remember(validators)
+        except Exception as e:
+            for future in futures:
+                future.cancel()
+            logger.error(f"Error polling {url}: {str(e)}")
+        return count
+
+    def _fetch_page(self, url, page):
+        """Fetch one page conditionally; no records if unchanged.
+
+        Returns ``(records, total_pages, validators)``, where ``validators``
+        is to be passed to ``_remember`` once the records are dispatched.
+        """
+        params = {self.page_param: page} if page > 1 else None
+        key = url if page == 1 else f"{url}#{page}"
+        with self._validators_lock:
+            etag, last_modified, total_pages = self._validators.get(key, (None, None, 1))
+        
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
         
+        response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return [], total_pages, None
+        response.raise_for_status()
+        
+        body = response.json()
+        if isinstance(body, dict):
+            records = body.get(self.records_key) or []
+            total_pages = int(body.get(self.total_pages_key) or 1)
+        else:
+            records = body
+            total_pages = 1
+        
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        validators = (key, (etag, last_modified, total_pages)) if etag or last_modified else None
+        return records, total_pages, validators
+
+    def _remember(self, validators):
+        if validators is None:
+            return
+        key, value = validators
+        with self._validators_lock:
+            self._validators[key] = value
+
+    def _dispatch(self, records):
+        if not records:
+            return 0
+        # Send the whole page to the dispatcher as one batch
+        self.dispatcher.receive_batch(records, self.name, self.schema_id)
+        return len(records)
+
     def _fetch_data(self):
         """Mock API data fetch."""
         logger.info(f"Fetching data from API: {self.api_url}")
         
-        # In a real implementation, this would make an HTTP request
-        # For demo, generate mock data
+        # Without a configured endpoint, generate mock data for the demo
         data = []
         
         # Generate 5-10 random vehicle locations
@@ -57,11 +203,17 @@ class ApiAdapter(IngestionAdapter):
                 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
             }
             data.append(record)
-            
-        return data
         
+        return data
+
     def close(self):
-        """Stop the periodic ingestion."""
+        """Stop the periodic ingestion and wait for running polls."""
         self.running = False
+        self._stop.set()
         if self.timer_thread:
-            self.timer_thread.join(timeout=1)
\ No newline at end of file
+            self.timer_thread.join(timeout=1)
+        if self._endpoint_pool:
+            self._endpoint_pool.shutdown(wait=True)
+            self._page_pool.shutdown(wait=True)
+        if self.session is not None:
+            self.session.close()
@@ -1,14 +1,108 @@
 import csv
 import os
+import queue
+import threading
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from src.adapters.base import IngestionAdapter
+from src.adapters.batch.csv_parsing import iter_chunks, parse_text, split_ranges, parse_range, row_schema
+from src.utils.dir_watcher import DirectoryWatcher
 from src.utils.logging import logger
+from src.utils.state_file import read_state, write_state, remove_state
+
+class _FileCheckpoint:
+    """Durable progress through one CSV file, kept in a sidecar file next to it.
+    
+    Progress only advances past rows the dispatcher has finished with, in
+    file order; a pipelined dispatcher finishes batches on its own threads.
+    """
+    
+    def __init__(self, filepath, every_rows):
+        directory, filename = os.path.split(filepath)
+        self.path = os.path.join(directory, f".{filename}.checkpoint")
+        self.every_rows = every_rows
+        self.offset = None
+        self.rows = 0
+        self._unsaved_rows = 0
+        self._pending = deque()  # [rows, offset, unfinished batches] of dispatched parts, in order
+        self._on_complete = None
+        self._lock = threading.Lock()
+        
+        stat = os.stat(filepath)
+        self.identity = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        
+        state = read_state(self.path)
+        if state is None:
+            return
+        if all(state.get(key) == value for key, value in self.identity.items()):
+            self.offset = state['offset']
+            self.rows = state['rows']
+            logger.info(f"Resuming {filepath} at row {self.rows} (byte {self.offset})")
+        else:
+            logger.warning(f"{filepath} changed since its last checkpoint, starting over")
+            
+    def dispatched(self, rows, offset, batches=1):
+        """Register rows up to offset sent as ``batches`` batches; returns their ``on_done``."""
+        part = [rows, offset, batches]
+        with self._lock:
+            self._pending.append(part)
+        if not batches:
+            self._settle()
+        return lambda: self._done(part)
+        
+    def finish(self, on_complete):
+        """Call on_complete once every part dispatched so far is done."""
+        with self._lock:
+            self._on_complete = on_complete
+        self._settle()
+        
+    def _done(self, part):
+        with self._lock:
+            part[2] -= 1
+        self._settle()
+        
+    def _settle(self):
+        with self._lock:
+            while self._pending and self._pending[0][2] <= 0:
+                rows, offset, _ = self._pending.popleft()
+                self.advance(rows, offset)
+            on_complete = None
+            if self._on_complete is not None and not self._pending:
+                on_complete, self._on_complete = self._on_complete, None
+        if on_complete is not None:
+            on_complete()
+            
+    def advance(self, rows, offset):
+        """Record that everything before offset was dispatched, saving every N rows."""
+        self.rows += rows
+        self.offset = offset
+        self._unsaved_rows += rows
+        if self._unsaved_rows >= self.every_rows:
+            self.save()
+            
+    def save(self):
+        write_state(self.path, dict(self.identity, offset=self.offset, rows=self.rows))
+        self._unsaved_rows = 0
+        
+    def clear(self):
+        remove_state(self.path)
 
 class CsvAdapter(IngestionAdapter):
-    def __init__(self, dispatcher, input_dir="input", schema_id="location_v1"):
+    def __init__(self, dispatcher, input_dir="input", schema_id="location_v1", batch_size=1000,
+                 workers=1, chunk_bytes=64 * 1024 * 1024, vectorized=True, checkpoint_rows=10000):
         super().__init__("csv", dispatcher)
         self.input_dir = input_dir
         self.schema_id = schema_id
+        self.batch_size = batch_size  # Rows sent to the dispatcher per call
+        self.workers = workers  # More than one enables multi-process parsing
+        self.chunk_bytes = chunk_bytes  # Files larger than this are split across workers
+        self.vectorized = vectorized  # Check flat schemas column-wise with pandas when installed
+        self.checkpoint_rows = checkpoint_rows  # Rows between durable progress checkpoints
+        
+        self._watcher = None
+        self._discovered = queue.Queue()
+        self._worker = None
         
         # Create input directory if it doesn't exist
         if not os.path.exists(input_dir):
@@ -29,43 +123,159 @@ class CsvAdapter(IngestionAdapter):
             logger.warning(f"Input directory {self.input_dir} does not exist.")
             return
             
+        filepaths = [os.path.join(self.input_dir, filename)
+                     for filename in os.listdir(self.input_dir) if filename.endswith('.csv')]
+        self._process_files(filepaths)
+        
+    def watch(self, poll_interval=1.0, settle_time=2.0, use_inotify=True):
+        """Keep processing CSV files as they appear in the input directory.
+        
+        Files already there are processed first. A file is picked up only once it
+        has been fully written, and is queued to a processing thread, so the
+        watcher never waits for parsing.
+        """
+        self._worker = threading.Thread(target=self._process_discovered, name="csv-watch", daemon=True)
+        self._worker.start()
+        self._watcher = DirectoryWatcher(self.input_dir, self._discovered.put, suffix='.csv',
+                                         poll_interval=poll_interval, settle_time=settle_time,
+                                         use_inotify=use_inotify)
+        self._watcher.start()
+        
+    def _process_discovered(self):
+        """Process queued files, taking everything discovered so far as one batch."""
+        while True:
+            filepaths = [self._discovered.get()]
+            while True:
+                try:
+                    filepaths.append(self._discovered.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in filepaths
+            self._process_files([path for path in filepaths if path is not None])
+            if stop:
+                return
+                
+    def _process_files(self, filepaths):
+        if not filepaths:
+            return
+        if self.workers > 1:
+            self._process_files_parallel(filepaths)
+            return
+            
         # Process each CSV file
-        for filename in os.listdir(self.input_dir):
-            if filename.endswith('.csv'):
-                self._process_file(os.path.join(self.input_dir, filename))
+        for filepath in filepaths:
+            self._process_file(filepath)
+            
+    def _process_files_parallel(self, filepaths):
+        """Parse and validate files in a process pool, one task per byte range.
+        
+        Results are dispatched in file order, so the checkpoint can always advance
+        to the end of the last range the dispatcher finished. A file is moved to
+        processed/ once all of its ranges have been delivered.
+        """
+        try:
+            schema = row_schema(self.dispatcher.schema_registry, self.schema_id)
+        except ValueError as e:
+            logger.error(f"Skipping CSV files: {str(e)}")
+            return
+            
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            # Keep a bounded number of ranges in flight so memory stays flat
+            in_flight = deque()
+            failed = set()
+            for filepath in filepaths:
+                try:
+                    checkpoint = _FileCheckpoint(filepath, self.checkpoint_rows)
+                    fieldnames, ranges = split_ranges(filepath, self.chunk_bytes, checkpoint.offset)
+                except Exception as e:
+                    logger.error(f"Error processing file {filepath}: {str(e)}")
+                    continue
+                    
+                logger.info(f"Processing file: {filepath} ({len(ranges)} ranges, {self.workers} workers)")
+                if not ranges:
+                    self._complete(filepath, checkpoint)
+                for n, (start, end) in enumerate(ranges):
+                    future = pool.submit(parse_range, filepath, start, end, fieldnames, schema,
+                                         self.vectorized)
+                    in_flight.append((future, filepath, checkpoint, end, n == len(ranges) - 1))
+                    if len(in_flight) >= 2 * self.workers:
+                        self._dispatch_range(*in_flight.popleft(), failed)
+                        
+            while in_flight:
+                self._dispatch_range(*in_flight.popleft(), failed)
                 
+    def _dispatch_range(self, future, filepath, checkpoint, end, is_last, failed):
+        """Send one parsed range to the dispatcher in batch_size slices.
+        
+        A file with a failed range stays in the input directory.
+        """
+        if filepath in failed:
+            return
+        try:
+            accepted, rejected = future.result()
+            starts = range(0, max(len(accepted), len(rejected)), self.batch_size)
+            on_done = checkpoint.dispatched(len(accepted) + len(rejected), end, len(starts))
+            for start in starts:
+                self.dispatcher.receive_validated_batch(
+                    accepted[start:start + self.batch_size],
+                    rejected[start:start + self.batch_size],
+                    self.name, self.schema_id, on_done=on_done)
+            if is_last:
+                checkpoint.finish(lambda: self._complete(filepath, checkpoint))
+        except Exception as e:
+            failed.add(filepath)
+            logger.error(f"Error processing file {filepath}: {str(e)}")
+            
     def _process_file(self, filepath):
-        """Process a single CSV file."""
+        """Process a single CSV file, streaming it in batch_size blocks.
+        
+        Progress is checkpointed every checkpoint_rows rows, so a restart resumes
+        after the last checkpoint instead of re-ingesting the whole file. Only
+        rows the dispatcher has finished with count, and the file is moved to
+        processed/ once all of them are.
+        """
         logger.info(f"Processing file: {filepath}")
         
         try:
-            with open(filepath, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    # Convert numeric values (assuming lat/lng are numeric)
-                    if 'lat' in row:
-                        row['lat'] = float(row['lat'])
-                    if 'lng' in row:
-                        row['lng'] = float(row['lng'])
-                        
-                    # Send to dispatcher
-                    self.dispatcher.receive_data(row, self.name, self.schema_id)
-                    
-            # Move processed file to a 'processed' subdirectory
-            processed_dir = os.path.join(self.input_dir, 'processed')
-            if not os.path.exists(processed_dir):
-                os.makedirs(processed_dir)
+            schema = row_schema(self.dispatcher.schema_registry, self.schema_id)
+            checkpoint = _FileCheckpoint(filepath, self.checkpoint_rows)
+            for fieldnames, text, rows, end in iter_chunks(filepath, self.batch_size, checkpoint.offset):
+                accepted, rejected = parse_text(text, fieldnames, schema, self.vectorized)
+                self.dispatcher.receive_validated_batch(accepted, rejected, self.name, self.schema_id,
+                                                        on_done=checkpoint.dispatched(rows, end))
                 
-            processed_path = os.path.join(processed_dir, os.path.basename(filepath))
-            os.rename(filepath, processed_path)
-            logger.info(f"Moved processed file to {processed_path}")
+            checkpoint.finish(lambda: self._complete(filepath, checkpoint))
             
         except Exception as e:
             logger.error(f"Error processing file {filepath}: {str(e)}")
             
+    def _complete(self, filepath, checkpoint):
+        """Move a file whose rows were all delivered out of the way and drop its checkpoint."""
+        try:
+            self._move_to_processed(filepath)
+            checkpoint.clear()
+        except Exception as e:
+            logger.error(f"Error completing file {filepath}: {str(e)}")
+            
+    def _move_to_processed(self, filepath):
+        """Move processed file to a 'processed' subdirectory."""
+        processed_dir = os.path.join(self.input_dir, 'processed')
+        if not os.path.exists(processed_dir):
+            os.makedirs(processed_dir)
+            
+        processed_path = os.path.join(processed_dir, os.path.basename(filepath))
+        os.rename(filepath, processed_path)
+        logger.info(f"Moved processed file to {processed_path}")
+        
     def close(self):
-        """Nothing to close for CSV adapter."""
-        pass
+        """Stop watching and finish processing files that were already discovered."""
+        if self._watcher:
+            self._watcher.stop()
+            self._watcher = None
+        if self._worker:
+            self._discovered.put(None)
+            self._worker.join()
+            self._worker = None
         
     def _create_sample_csv(self):
         """Create a sample CSV file for demonstration."""
@@ -0,0 +1,281 @@
+"""CSV parsing helpers shared by the serial and multi-process CSV paths.
+
+Everything here is a module-level function so it can run in a process pool.
+"""
+import csv
+import io
+import json
+import os
+from src.schema_registry.validators import compile_validator
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:
+    np = pd = None
+
+# Per-process caches keyed by the schema's JSON text
+_validators = {}
+_frame_checks = {}
+
+# Keywords the column-wise check understands; anything else uses the per-row path
+_FRAME_OBJECT_KEYWORDS = {'type', 'properties', 'required', 'title', 'description', '$schema', '$id'}
+_FRAME_PROPERTY_KEYWORDS = {'type', 'minimum', 'maximum', 'format', 'title', 'description', 'default'}
+_EXTRA_COLUMN = '__extra__'
+
+def row_schema(schema_registry, schema_id):
+    """Get the JSON schema CSV rows are converted and validated against."""
+    schema = schema_registry.get_schema(schema_id)
+    if not schema:
+        raise ValueError(f"Schema {schema_id} not found.")
+    return schema.get('schema', {})
+
+def make_row_converter(schema):
+    """Build a function converting CSV string values to the types of a JSON schema.
+
+    Values that fail to convert are left as strings so validation rejects the row.
+    """
+    converters = {}
+    properties = (schema or {}).get('properties', {})
+    for name, prop in properties.items():
+        if prop.get('type') == 'number':
+            converters[name] = float
+        elif prop.get('type') == 'integer':
+            converters[name] = int
+
+    def convert(row):
+        for name, to_type in converters.items():
+            value = row.get(name)
+            if value is None:
+                continue
+            try:
+                row[name] = to_type(value)
+            except ValueError:
+                pass
+        return row
+
+    return convert
+
+def compile_frame_check(schema):
+    """Build a column-wise check of a DataFrame of CSV records for a flat schema.
+
+    Returns ``check(frame) -> (typed, ok)``, where ``typed`` maps numeric fields
+    to typed NumPy arrays and ``ok`` is a boolean mask of rows that certainly
+    pass validation. Rows outside the mask go through the per-row validator, so
+    the check only has to be conservative: empty values are always sent there,
+    because a short row and an empty field look the same in the frame. Returns
+    None when pandas is not installed or the schema is too complex to vectorize.
+    """
+    if pd is None or not isinstance(schema, dict) or schema.get('type') != 'object':
+        return None
+    if set(schema) - _FRAME_OBJECT_KEYWORDS:
+        return None
+
+    required = schema.get('required', [])
+    numeric = {}
+    for name, prop in schema.get('properties', {}).items():
+        if not isinstance(prop, dict) or set(prop) - _FRAME_PROPERTY_KEYWORDS:
+            return None
+        if prop.get('type') not in ('string', 'number', 'integer'):
+            return None
+        if prop['type'] != 'string':
+            numeric[name] = (prop['type'], prop.get('minimum'), prop.get('maximum'))
+
+    def check(frame):
+        ok = np.ones(len(frame), dtype=bool)
+        typed = {}
+        if any(name not in frame.columns for name in required):
+            return typed, ~ok
+
+        for name in frame.columns:
+            column = frame[name]
+            if name == _EXTRA_COLUMN:
+                ok &= column.to_numpy() == ''
+                continue
+            if name not in numeric:
+                ok &= column.to_numpy() != ''
+                continue
+
+            json_type, minimum, maximum = numeric[name]
+            if not pd.api.types.is_numeric_dtype(column):
+                # The typed read failed somewhere in this chunk; convert leniently
+                if json_type == 'integer':
+                    column = column.where(column.str.fullmatch(r'[+-]?\d{1,18}'))
+                column = pd.to_numeric(column, errors='coerce')
+
+            ok &= column.notna().to_numpy()
+            if minimum is not None:
+                ok &= (column >= minimum).to_numpy()
+            if maximum is not None:
+                ok &= (column <= maximum).to_numpy()
+
+            if json_type == 'integer':
+                typed[name] = column.fillna(0).astype('int64').to_numpy()
+            else:
+                typed[name] = column.to_numpy(dtype=float)
+        return typed, ok
+
+    check.dtypes = {name: 'int64' if json_type == 'integer' else 'float64'
+                    for name, (json_type, _, _) in numeric.items()}
+    return check
+
+def iter_chunks(filepath, rows_per_chunk, start_offset=None):
+    """Read a CSV file as consecutive blocks of complete records.
+
+    Yields ``(fieldnames, text, rows, end_offset)`` without building a row per
+    line; ``end_offset`` is the byte offset just past the block, so reading can
+    resume there. Records whose quoted values span lines are kept in one block.
+    """
+    with open(filepath, 'rb') as f:
+        yield from iter_stream_chunks(f, rows_per_chunk, start_offset)
+
+def iter_stream_chunks(f, rows_per_chunk, start_offset=None):
+    """Like iter_chunks, for an open binary stream such as a download in progress.
+
+    Only reads forward, so any stream with readline works; ``start_offset``
+    needs a seekable one.
+    """
+    header = f.readline()
+    fieldnames = next(csv.reader([header.decode('utf-8-sig')]), [])
+    offset = len(header)
+    if start_offset is not None and start_offset > offset:
+        f.seek(start_offset)
+        offset = start_offset
+
+    lines = []
+    rows = 0
+    quotes = 0
+    for line in f:
+        lines.append(line)
+        offset += len(line)
+        quotes += line.count(b'"')
+        if quotes % 2:
+            continue  # Inside a quoted value, the record continues on the next line
+        rows += 1
+        if rows >= rows_per_chunk:
+            yield fieldnames, b''.join(lines).decode('utf-8'), rows, offset
+            lines = []
+            rows = 0
+
+    if lines:
+        yield fieldnames, b''.join(lines).decode('utf-8'), rows, offset
+
+def parse_text(text, fieldnames, schema, vectorized=True):
+    """Parse, convert and validate a block of CSV records (without the header).
+
+    Uses the column-wise check when the schema allows it and the per-row
+    validator otherwise. Returns ``(accepted, rejected)`` where rejected
+    holds ``(row, error)`` pairs.
+    """
+    key = json.dumps(schema, sort_keys=True)
+    validate = _validators.get(key)
+    if validate is None:
+        validate = _validators[key] = compile_validator(schema)
+    convert = make_row_converter(schema)
+
+    check = None
+    if vectorized:
+        if key not in _frame_checks:
+            _frame_checks[key] = compile_frame_check(schema)
+        check = _frame_checks[key]
+    if check is None:
+        return _validate_rows(csv.DictReader(io.StringIO(text), fieldnames=fieldnames),
+                              convert, validate)
+
+    result = _parse_frame(text, fieldnames, check)
+    if result is None:
+        return _validate_rows(csv.DictReader(io.StringIO(text), fieldnames=fieldnames),
+                              convert, validate)
+    accepted, fallback = result
+    more_accepted, rejected = _validate_rows(fallback, convert, validate)
+    accepted.extend(more_accepted)
+    return accepted, rejected
+
+def _parse_frame(text, fieldnames, check):
+    """Read a block with pandas and split it with a column-wise check.
+
+    Returns ``(accepted, fallback)``: dicts built straight from the typed columns
+    for rows that passed, and DictReader-style rows for the per-row validator.
+    Returns None when the block cannot be read as a regular frame.
+    """
+    # The extra column catches rows with one field too many
+    names = list(fieldnames) + [_EXTRA_COLUMN]
+    options = dict(names=names, header=None, index_col=False, keep_default_na=False)
+    try:
+        dtypes = {name: check.dtypes.get(name, str) for name in names}
+        frame = pd.read_csv(io.StringIO(text), dtype=dtypes, **options)
+    except ValueError:
+        try:
+            frame = pd.read_csv(io.StringIO(text), dtype=str, **options)
+        except ValueError:
+            return None
+
+    typed, ok = check(frame)
+
+    # Materialize dicts only for the rows that passed, straight from the columns
+    values = []
+    for name in fieldnames:
+        column = typed[name] if name in typed else frame[name].to_numpy()
+        values.append(column[ok].tolist())
+    accepted = [dict(zip(fieldnames, row)) for row in zip(*values)]
+
+    fallback = []
+    if not ok.all():
+        records = [row for row in csv.reader(io.StringIO(text)) if row]
+        if len(records) != len(frame):
+            return None
+        fallback = [_row_dict(fieldnames, records[i]) for i in np.flatnonzero(~ok)]
+    return accepted, fallback
+
+def _validate_rows(rows, convert, validate):
+    accepted = []
+    rejected = []
+    for row in rows:
+        row = convert(row)
+        is_valid, error = validate(row)
+        if is_valid:
+            accepted.append(row)
+        else:
+            rejected.append((row, error))
+    return accepted, rejected
+
+def _row_dict(fieldnames, values):
+    """Build a row the way csv.DictReader does for short and long rows."""
+    row = dict(zip(fieldnames, values))
+    if len(values) > len(fieldnames):
+        row[None] = values[len(fieldnames):]
+    for name in fieldnames[len(values):]:
+        row[name] = None
+    return row
+
+def split_ranges(filepath, chunk_bytes, start_offset=None):
+    """Split a CSV file into byte ranges that start and end on line boundaries.
+
+    Returns ``(fieldnames, ranges)``; the header line is not part of any range,
+    and neither is anything before ``start_offset``. Quoted values containing
+    newlines are not supported by this split.
+    """
+    with open(filepath, 'rb') as f:
+        header = f.readline()
+        fieldnames = next(csv.reader([header.decode('utf-8-sig')]), [])
+        size = os.fstat(f.fileno()).st_size
+
+        ranges = []
+        start = max(f.tell(), start_offset or 0)
+        while start < size:
+            f.seek(min(start + chunk_bytes, size) - 1)
+            f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return fieldnames, ranges
+
+def parse_range(filepath, start, end, fieldnames, schema, vectorized=True):
+    """Parse and validate one byte range of a CSV file in a worker process.
+
+    Returns ``(accepted, rejected)`` where rejected holds ``(row, error)`` pairs.
+    """
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start).decode('utf-8')
+    return parse_text(data, fieldnames, schema, vectorized)
@@ -1,26 +1,268 @@
-class FtpAdapter:
-    def __init__(self, host, port, username, password, dispatcher):
+import ftplib
+import io
+import json
+import os
+import posixpath
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from src.adapters.base import IngestionAdapter
+from src.adapters.batch.csv_parsing import iter_stream_chunks, parse_text, row_schema
+from src.utils.logging import logger
+from src.utils.state_file import read_state, write_state
+
+class _FtpConnectionPool:
+    """Logged-in FTP connections, reused across files and ingest runs."""
+
+    def __init__(self, host, port, username, password, size, timeout):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
-        self.dispatcher = dispatcher
-        self.ftp = None
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; one that failed during use is closed instead of returned."""
+        self._slots.acquire()
+        try:
+            ftp = self._take_idle() or self._connect()
+            try:
+                yield ftp
+            except Exception:
+                self._discard(ftp)
+                raise
+            self._idle.put(ftp)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                ftp = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                ftp.quit()
+            except Exception:
+                self._discard(ftp)
+
+    def _take_idle(self):
+        """Return an idle connection that still answers, dropping ones the server closed."""
+        while True:
+            try:
+                ftp = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            try:
+                ftp.voidcmd('NOOP')
+                return ftp
+            except Exception:
+                self._discard(ftp)
+
+    def _connect(self):
+        ftp = ftplib.FTP(timeout=self.timeout)
+        ftp.connect(self.host, self.port)
+        ftp.login(self.username, self.password)
+        logger.info(f"Logged in to FTP server {self.host}:{self.port}")
+        return ftp
+
+    @staticmethod
+    def _discard(ftp):
+        try:
+            ftp.close()
+        except Exception:
+            pass
+
+class FtpAdapter(IngestionAdapter):
+    """Ingests CSV and JSON files from a directory on an FTP server.
+
+    Files are downloaded in parallel over a pool of logged-in connections and
+    parsed while they stream in; nothing is copied to a temporary file. Size
+    and modification time of every ingested file are kept in a listing cache,
+    so later runs skip files that have not changed. A file that fails midway
+    is not recorded and is ingested again from the start on the next run.
+    """
+
+    def __init__(self, dispatcher, host, port=21, username="anonymous", password="",
+                 directory="/", schema_id="location_v1", connections=4, batch_size=1000,
+                 listing_cache="state/ftp_listing.json", timeout=30, vectorized=True):
+        super().__init__("ftp", dispatcher)
+        self.host = host
+        self.port = port
+        self.directory = directory
+        self.schema_id = schema_id
+        self.connections = connections  # Files downloaded in parallel
+        self.batch_size = batch_size  # Records sent to the dispatcher per call
+        self.listing_cache = listing_cache  # JSON file of already ingested files
+        self.vectorized = vectorized
+        self.pool = _FtpConnectionPool(host, port, username, password, connections, timeout)
+
+        self._cache_lock = threading.Lock()
+        self._ingested = None  # remote path -> {'size', 'modify'}
 
     def connect(self):
-        import ftplib
-        self.ftp = ftplib.FTP()
-        self.ftp.connect(self.host, self.port)
-        self.ftp.login(self.username, self.password)
-
-    def download_file(self, remote_file_path):
-        local_file_path = f"/tmp/{remote_file_path.split('/')[-1]}"
-        with open(local_file_path, 'wb') as local_file:
-            self.ftp.retrbinary(f'RETR {remote_file_path}', local_file.write)
-        return local_file_path
-
-    def ingest(self, remote_file_path):
-        self.connect()
-        local_file_path = self.download_file(remote_file_path)
-        self.dispatcher.route_data(local_file_path)
-        self.ftp.quit()
\ No newline at end of file
+        """Log in one connection up front so bad credentials surface early."""
+        with self.pool.connection():
+            pass
+
+    def ingest(self):
+        """Ingest every new or changed file in the remote directory."""
+        if self._ingested is None:
+            self._ingested = read_state(self.listing_cache) or {}
+
+        try:
+            with self.pool.connection() as ftp:
+                listing = self._list(ftp)
+        except Exception as e:
+            logger.error(f"Error listing FTP directory {self.directory}: {str(e)}")
+            return
+
+        pending = [(path, facts) for path, facts in listing
+                   if self._ingested.get(path) != facts and self._parser_for(path)]
+        logger.info(f"Found {len(pending)} new FTP files out of {len(listing)} in {self.directory}")
+        if not pending:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix="ftp") as pool:
+            for path, facts in pending:
+                pool.submit(self._ingest_file, path, facts)
+
+    def _list(self, ftp):
+        """Return ``[(path, {'size', 'modify'})]`` for the regular files of the directory."""
+        try:
+            entries = [(name, facts) for name, facts in ftp.mlsd(self.directory, ['type', 'size', 'modify'])
+                       if facts.get('type') == 'file']
+            return [(posixpath.join(self.directory, name),
+                     {'size': int(facts.get('size', -1)), 'modify': facts.get('modify')})
+                    for name, facts in entries]
+        except ftplib.error_perm:
+            pass
+
+        # Server without MLSD: fall back to NLST plus SIZE and MDTM per file
+        listing = []
+        for name in ftp.nlst(self.directory):
+            path = posixpath.join(self.directory, posixpath.basename(name))
+            try:
+                size = ftp.size(path)
+                modify = ftp.voidcmd(f"MDTM {path}").split()[-1]
+            except ftplib.error_perm:
+                continue  # Not a regular file
+            listing.append((path, {'size': size, 'modify': modify}))
+        return listing
+
+    def _parser_for(self, path):
+        if path.endswith('.csv'):
+            return self._parse_csv
+        if path.endswith(('.jsonl', '.ndjson')):
+            return self._parse_json_lines
+        if path.endswith('.json'):
+            return self._parse_json
+        return None
+
+    def _ingest_file(self, path, facts):
+        """Stream one remote file through its parser and record it in the listing cache."""
+        logger.info(f"Downloading {path} ({facts['size']} bytes)")
+        parse = self._parser_for(path)
+        try:
+            with self.pool.connection() as ftp:
+                ftp.voidcmd('TYPE I')
+                with ftp.transfercmd(f"RETR {path}") as sock, sock.makefile('rb') as stream:
+                    parse(stream)
+                ftp.voidresp()
+        except Exception as e:
+            logger.error(f"Error ingesting FTP file {path}: {str(e)}")
+            return
+
+        with self._cache_lock:
+            self._ingested[path] = facts
+            directory = os.path.dirname(self.listing_cache)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            write_state(self.listing_cache, self._ingested)
+        logger.info(f"Ingested FTP file {path}")
+
+    def _parse_csv(self, stream):
+        schema = row_schema(self.dispatcher.schema_registry, self.schema_id)
+        for fieldnames, text, _, _ in iter_stream_chunks(stream, self.batch_size):
+            accepted, rejected = parse_text(text, fieldnames, schema, self.vectorized)
+            self.dispatcher.receive_validated_batch(accepted, rejected, self.name, self.schema_id)
+
+    def _parse_json_lines(self, stream):
+        batch = []
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                batch.append(json.loads(line))
+            except ValueError:
+                batch.append(line.decode('utf-8', errors='replace'))  # Rejected by validation
+            if len(batch) >= self.batch_size:
+                self.dispatcher.receive_batch(batch, self.name, self.schema_id)
+                batch = []
+        if batch:
+            self.dispatcher.receive_batch(batch, self.name, self.schema_id)
+
+    def _parse_json(self, stream):
+        batch = []
+        for record in iter_json_records(stream):
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.dispatcher.receive_batch(batch, self.name, self.schema_id)
+                batch = []
+        if batch:
+            self.dispatcher.receive_batch(batch, self.name, self.schema_id)
+
+    def close(self):
+        """Log out of all pooled connections."""
+        self.pool.close()
+
+def iter_json_records(stream, chunk_size=64 * 1024):
+    """Yield the elements of a JSON array (or a single JSON value) from a binary stream.
+
+    Elements are decoded as soon as they have fully arrived, so only about a
+    chunk of the file is held in memory at a time.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8')
+    decoder = json.JSONDecoder()
+    buffer = text.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        # A single record; it has to be read whole anyway
+        yield json.loads(buffer + text.read())
+        return
+    position = 1
+    eof = False
+    expect_value = True  # After '[' or ',' a value comes next; after a value, ',' or ']'
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        end = None
+        if position < len(buffer):
+            if buffer[position] == ']':
+                return
+            if not expect_value:
+                if buffer[position] != ',':
+                    raise ValueError(f"Expected ',' or ']' in JSON array, found {buffer[position]!r}")
+                position += 1
+                expect_value = True
+                continue
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise
+            # A value running up to the end of the buffer may continue in the next chunk
+            if end is not None and (end < len(buffer) or eof):
+                yield value
+                position = end
+                expect_value = False
+                continue
+        if eof:
+            raise ValueError("Unexpected end of JSON array")
+        chunk = text.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
@@ -0,0 +1,91 @@
+import threading
+import time
+
+class InMemoryBroker:
+    """In-process stand-in for a Kafka cluster, for tests and local runs.
+
+    Topics are lists of partitions, each an append-only list of values.
+    Committed offsets are kept per consumer group, so a new consumer of the
+    same group resumes after the last commit, like it would against Kafka.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._topics = {}     # topic -> [[value, ...] per partition]
+        self._committed = {}  # (group_id, topic, partition) -> next offset to read
+        self._round_robin = 0
+
+    def create_topic(self, topic, partitions=1):
+        with self._condition:
+            self._topics.setdefault(topic, [[] for _ in range(partitions)])
+
+    def produce(self, topic, value, partition=None):
+        """Append a value to a partition (round-robin when not given); returns its offset."""
+        with self._condition:
+            partitions = self._topics.setdefault(topic, [[]])
+            if partition is None:
+                partition = self._round_robin % len(partitions)
+                self._round_robin += 1
+            partitions[partition].append(value)
+            self._condition.notify_all()
+            return len(partitions[partition]) - 1
+
+    def committed(self, group_id, topic, partition):
+        with self._condition:
+            return self._committed.get((group_id, topic, partition), 0)
+
+    def consumer(self, topic, group_id):
+        """Create a consumer assigned to every partition of the topic."""
+        self.create_topic(topic)
+        return InMemoryConsumer(self, topic, group_id)
+
+class InMemoryConsumer:
+    """Consumer of an InMemoryBroker with the interface KafkaAdapter expects."""
+
+    def __init__(self, broker, topic, group_id):
+        self.broker = broker
+        self.topic = topic
+        self.group_id = group_id
+        self.running = True
+        with broker._condition:
+            partitions = len(broker._topics[topic])
+            self._positions = [broker._committed.get((group_id, topic, p), 0)
+                               for p in range(partitions)]
+
+    def poll(self, max_records=500, timeout=1.0):
+        """Return ``{partition: (values, next_offset)}`` with up to max_records values.
+
+        Waits up to timeout seconds for the first value to arrive.
+        """
+        deadline = time.time() + timeout
+        with self.broker._condition:
+            while self.running:
+                batches = self._take(max_records)
+                if batches or time.time() >= deadline:
+                    return batches
+                self.broker._condition.wait(deadline - time.time())
+            return {}
+
+    def _take(self, max_records):
+        partitions = self.broker._topics[self.topic]
+        batches = {}
+        for partition, position in enumerate(self._positions):
+            if max_records <= 0:
+                break
+            values = partitions[partition][position:position + max_records]
+            if values:
+                self._positions[partition] = position + len(values)
+                batches[partition] = (values, position + len(values))
+                max_records -= len(values)
+        return batches
+
+    def commit(self, offsets):
+        """Commit ``{partition: next_offset}`` for the consumer group."""
+        with self.broker._condition:
+            for partition, offset in offsets.items():
+                self.broker._committed[(self.group_id, self.topic, partition)] = offset
+
+    def close(self):
+        self.running = False
+        with self.broker._condition:
+            self.broker._condition.notify_all()
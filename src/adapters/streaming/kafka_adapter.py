@@ -1,73 +1,271 @@
+import base64
+import collections
 import json
+import queue
 import threading
+import time
 from src.adapters.base import IngestionAdapter
+from src.schema_registry.wire_format import AvroCodec
 from src.utils.logging import logger
 
-# Mock Kafka consumer class for demonstration
-class MockKafkaConsumer:
-    def __init__(self, topic):
+# Sentinel telling a partition worker to exit once its queued batches are handled
+_STOP = object()
+
+class KafkaPythonConsumer:
+    """kafka-python consumer with the poll/commit interface KafkaAdapter expects.
+
+    Auto-commit is disabled; offsets are committed only when the adapter says
+    the records before them were accepted by the dispatcher.
+    """
+
+    def __init__(self, topic, group_id, bootstrap_servers, on_revoke=None, value_format="json",
+                 **config):
+        try:
+            import kafka
+        except ImportError:
+            raise ImportError("KafkaAdapter requires kafka-python: pip install kafka-python")
+        self._kafka = kafka
         self.topic = topic
-        self.running = True
-        
-    def consume(self, callback):
-        """Simulate consuming messages."""
-        import time
-        import random
-        
-        # Sample location data generation
-        while self.running:
-            # Generate mock vehicle location data
-            data = {
-                "vehicle_id": f"VEH-{random.randint(1000, 9999)}",
-                "lat": random.uniform(37.7, 38.2),
-                "lng": random.uniform(-122.5, -122.1),
-                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-            }
-            
-            callback(data)
-            time.sleep(random.uniform(0.5, 2.0))  # Random delay between messages
-            
+        self.value_format = value_format  # 'json' decodes values, anything else passes bytes on
+        self._consumer = kafka.KafkaConsumer(
+            bootstrap_servers=bootstrap_servers,
+            group_id=group_id,
+            enable_auto_commit=False,
+            **config
+        )
+
+        class _RebalanceListener(kafka.ConsumerRebalanceListener):
+            def on_partitions_revoked(self, revoked):
+                if on_revoke:
+                    on_revoke([tp.partition for tp in revoked])
+
+            def on_partitions_assigned(self, assigned):
+                pass
+
+        self._consumer.subscribe([topic], listener=_RebalanceListener())
+
+    def poll(self, max_records=500, timeout=1.0):
+        """Return ``{partition: (values, next_offset)}`` with up to max_records values."""
+        polled = self._consumer.poll(timeout_ms=int(timeout * 1000), max_records=max_records)
+        if self.value_format != "json":
+            return {tp.partition: ([r.value for r in records], records[-1].offset + 1)
+                    for tp, records in polled.items() if records}
+        return {tp.partition: ([self._decode(r.value) for r in records], records[-1].offset + 1)
+                for tp, records in polled.items() if records}
+
+    def commit(self, offsets):
+        """Commit ``{partition: next_offset}`` for the consumer group."""
+        self._consumer.commit({
+            self._kafka.TopicPartition(self.topic, partition): self._kafka.OffsetAndMetadata(offset, None)
+            for partition, offset in offsets.items()
+        })
+
     def close(self):
-        """Stop consuming messages."""
-        self.running = False
+        self._consumer.close(autocommit=False)
+
+    @staticmethod
+    def _decode(value):
+        # Values that are not JSON are passed on as text and rejected by validation
+        text = value.decode('utf-8', errors='replace') if isinstance(value, bytes) else value
+        try:
+            return json.loads(text)
+        except (TypeError, ValueError):
+            return text
+
+class _PartitionWorker:
+    """Dispatches one partition's batches in order from its own queue and thread."""
+
+    def __init__(self, adapter, partition, queue_size):
+        self.adapter = adapter
+        self.partition = partition
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.committable = None  # Offset after the last batch the dispatcher finished
+        self.failed = False
+        self.stop = threading.Event()  # Set to give up retrying, e.g. on a stuck revocation
+        self._pending = collections.deque()  # [next_offset, done] of dispatched batches, in order
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(
+            target=self._run, name=f"kafka-partition-{partition}", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            values, next_offset = item
+            # After a batch is given up on, later offsets must not be committed past it
+            if not self.failed:
+                batch = [next_offset, False]
+                with self._lock:
+                    self._pending.append(batch)
+                if not self.adapter._dispatch(values, lambda batch=batch: self._done(batch), self.stop):
+                    self.failed = True
+
+    def _done(self, batch):
+        """Advance the committable offset past every batch finished so far, in order.
+
+        A pipelined dispatcher finishes batches on its own threads, and not
+        necessarily in the order they were dispatched.
+        """
+        with self._lock:
+            batch[1] = True
+            while self._pending and self._pending[0][1]:
+                self.committable = self._pending.popleft()[0]
 
 class KafkaAdapter(IngestionAdapter):
-    def __init__(self, dispatcher, topic="vehicle_locations", schema_id="location_v1"):
+    """Consumes a Kafka topic in batches with at-least-once delivery.
+
+    One thread polls the consumer and hands each partition's records to that
+    partition's worker, so partitions are dispatched in parallel while each
+    stays in order. Offsets are committed from the polling thread, and only up
+    to the last batch the dispatcher has finished with (for a pipelined
+    dispatcher: delivered to its consumers, not just queued); anything not
+    finished when the adapter stops is delivered again after a restart.
+
+    With ``value_format="avro"`` message values are wire-format payloads
+    (magic byte, schema wire id, Avro body). They are decoded a batch at a
+    time and handed to the dispatcher as already validated; payloads that do
+    not decode against ``schema_id`` are rejected.
+    """
+
+    def __init__(self, dispatcher, topic="vehicle_locations", schema_id="location_v1",
+                 max_poll_records=500, poll_timeout=1.0, group_id="ingestion",
+                 bootstrap_servers="localhost:9092", consumer_config=None,
+                 partition_queue_size=4, retry_backoff=1.0, consumer=None, value_format="json",
+                 revoke_timeout=10.0):
         super().__init__("kafka", dispatcher)
         self.topic = topic
         self.schema_id = schema_id
-        self.consumer = None
+        self.max_poll_records = max_poll_records
+        self.poll_timeout = poll_timeout  # Seconds to wait for a batch to fill
+        self.group_id = group_id
+        self.bootstrap_servers = bootstrap_servers
+        self.consumer_config = consumer_config or {}  # Passed to KafkaConsumer, e.g. fetch sizes
+        self.partition_queue_size = partition_queue_size  # Batches waiting per partition
+        self.retry_backoff = retry_backoff  # Seconds between attempts to dispatch a batch
+        self.consumer = consumer  # Any object with poll/commit/close, e.g. InMemoryConsumer
+        self.value_format = value_format  # 'json' or 'avro'
+        self.revoke_timeout = revoke_timeout  # Seconds a revoked partition gets to finish its batches
+        self.codec = AvroCodec(dispatcher.schema_registry) if value_format == "avro" else None
         self.consumer_thread = None
-        
+
+        self._workers = {}    # partition -> _PartitionWorker
+        self._committed = {}  # partition -> last committed offset
+        self._stopping = threading.Event()
+
     def connect(self):
         """Connect to Kafka."""
         logger.info(f"Connecting to Kafka topic: {self.topic}")
-        self.consumer = MockKafkaConsumer(self.topic)
-        
+        self.consumer = KafkaPythonConsumer(
+            self.topic, self.group_id, self.bootstrap_servers,
+            on_revoke=self._on_partitions_revoked,
+            value_format=self.value_format,
+            max_poll_records=self.max_poll_records,
+            **self.consumer_config
+        )
+
     def ingest(self):
         """Start ingesting data from Kafka."""
         logger.info("Starting Kafka ingestion")
-        
+
         if not self.consumer:
             self.connect()
-            
-        def consume_messages():
-            """Consumer thread function."""
-            self.consumer.consume(self._process_message)
-            
-        self.consumer_thread = threading.Thread(target=consume_messages)
-        self.consumer_thread.daemon = True
+
+        self.consumer_thread = threading.Thread(target=self._consume, name="kafka-poll", daemon=True)
         self.consumer_thread.start()
-        
-    def _process_message(self, message):
-        """Process an incoming Kafka message."""
+
+    def _consume(self):
+        """Poll loop: fan batches out to partition workers and commit what they finished."""
+        while not self._stopping.is_set():
+            try:
+                batches = self.consumer.poll(self.max_poll_records, self.poll_timeout)
+                for partition, batch in batches.items():
+                    self._worker(partition).queue.put(batch)
+                self._commit()
+            except Exception as e:
+                logger.error(f"Error consuming from Kafka: {str(e)}")
+                self._stopping.wait(self.retry_backoff)
+
+        # Let the workers finish what was already polled, then commit it
+        for worker in self._workers.values():
+            worker.queue.put(_STOP)
+        for worker in self._workers.values():
+            worker.thread.join()
         try:
-            # Send the message to the dispatcher
-            self.dispatcher.receive_data(message, self.name, self.schema_id)
+            self._commit()
         except Exception as e:
-            logger.error(f"Error processing Kafka message: {str(e)}")
-        
+            logger.error(f"Error committing Kafka offsets: {str(e)}")
+
+    def _worker(self, partition):
+        worker = self._workers.get(partition)
+        if worker is None:
+            worker = self._workers[partition] = _PartitionWorker(
+                self, partition, self.partition_queue_size)
+        return worker
+
+    def _dispatch(self, messages, on_done=None, stop=None):
+        """Send a batch to the dispatcher, retrying until it is accepted or the adapter (or ``stop``) stops.
+
+        ``on_done`` is passed on to the dispatcher, which calls it once it has
+        finished with the batch.
+        """
+        if self.codec is not None:
+            records, rejected = self.codec.decode_batch(messages, self.schema_id)
+            # Keep undecodable payloads readable in the JSON rejected stream
+            rejected = [(base64.b64encode(payload).decode('ascii')
+                         if isinstance(payload, (bytes, bytearray)) else payload, error)
+                        for payload, error in rejected]
+        while True:
+            try:
+                if self.codec is not None:
+                    self.dispatcher.receive_validated_batch(records, rejected, self.name, self.schema_id,
+                                                            on_done=on_done)
+                else:
+                    self.dispatcher.receive_batch(messages, self.name, self.schema_id, on_done=on_done)
+                return True
+            except Exception as e:
+                logger.error(f"Error processing Kafka messages: {str(e)}")
+                if self._stopping.wait(self.retry_backoff) or stop is not None and stop.is_set():
+                    return False
+
+    def _commit(self):
+        """Commit offsets that advanced since the last commit. Runs on the polling thread."""
+        offsets = {partition: worker.committable for partition, worker in self._workers.items()
+                   if worker.committable is not None
+                   and worker.committable != self._committed.get(partition)}
+        if offsets:
+            self.consumer.commit(offsets)
+            self._committed.update(offsets)
+
+    def _on_partitions_revoked(self, partitions):
+        """Finish and commit revoked partitions before another consumer takes them over.
+
+        A worker still retrying a batch after ``revoke_timeout`` is told to
+        give up, and only what it finished is committed.
+        """
+        revoked = [self._workers.pop(p) for p in partitions if p in self._workers]
+        for worker in revoked:
+            worker.queue.put(_STOP)
+        offsets = {}
+        deadline = time.monotonic() + self.revoke_timeout
+        for worker in revoked:
+            worker.thread.join(max(0.0, deadline - time.monotonic()))
+            if worker.thread.is_alive():
+                logger.warning(f"Partition {worker.partition} did not finish within "
+                               f"{self.revoke_timeout}s of being revoked, giving up on its batches")
+                worker.stop.set()
+            if worker.committable is not None:
+                offsets[worker.partition] = worker.committable
+            self._committed.pop(worker.partition, None)
+        if offsets:
+            self.consumer.commit(offsets)
+
     def close(self):
-        """Close the Kafka consumer."""
+        """Stop polling, dispatch what was already polled, commit and close the consumer."""
+        self._stopping.set()
+        if self.consumer_thread:
+            self.consumer_thread.join()
+            self.consumer_thread = None
         if self.consumer:
-            self.consumer.close()
\ No newline at end of file
+            self.consumer.close()
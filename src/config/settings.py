@@ -2,29 +2,151 @@
 
 MESSAGE_QUEUE = {
     'type': 'Kafka',  # Options: 'Kafka', 'RabbitMQ', 'Pulsar'
+    'backend': 'kafka',  # Options: 'kafka' (kafka-python), 'memory' (in-process broker)
     'bootstrap_servers': 'localhost:9092',  # Change as needed
-    'topic': 'data_ingestion'
+    'topic': 'data_ingestion',
+    'schema_id': 'location_v1',  # Use an Avro schema such as 'location_avro_v1' with value_format 'avro'
+    'value_format': 'json',  # Options: 'json', 'avro' (magic byte + schema wire id + Avro body)
+    'group_id': 'ingestion',
+    'max_poll_records': 500,  # Records returned by one poll
+    'poll_timeout': 1.0,  # Seconds a poll waits for records
+    'fetch_min_bytes': 1,  # Broker waits for this much data before answering a fetch...
+    'fetch_max_wait_ms': 500,  # ...or until this much time has passed
+    'max_partition_fetch_bytes': 1024 * 1024,  # Per-partition limit of one fetch
+    'partition_queue_size': 4  # Polled batches waiting per partition worker
 }
 
 SCHEMA_REGISTRY = {
+    'backend': 'local',  # Options: 'local' (schemas/ directory), 'remote' (Confluent-compatible registry at url)
     'url': 'http://localhost:8081',  # Change as needed
-    'default_schema': 'location_v1'
+    'cache_ttl': 300.0,  # Seconds before the latest version of a remote schema is looked up again
+    'negative_ttl': 30.0,  # Seconds a schema the registry does not know is remembered as missing
+    'timeout': 5.0,  # Seconds per request to the remote registry
+    'error_backoff': 5.0,  # Seconds a schema that could not be fetched (registry down) counts as missing
+    'default_schema': 'location_v1',
+    'compatibility': 'backward',  # Check for new schema versions: 'none', 'backward', 'forward', 'full'
+    'watch': True,  # Reload schemas/ when files in it change
+    'poll_interval': 1.0  # Seconds between scans when inotify is unavailable
 }
 
 BATCH_SETTINGS = {
     'api': {
         'base_url': 'https://api.example.com/data',  # Change as needed
-        'timeout': 30  # seconds
+        'timeout': 30,  # seconds
+        'endpoints': [],  # URLs polled over HTTP; empty generates mock records
+        'interval': 30,  # Seconds between the starts of two polls
+        'page_workers': 4  # Pages of one endpoint fetched concurrently
+    },
+    'csv': {
+        'input_dir': 'input',
+        'batch_size': 1000,  # Rows sent to the dispatcher per call
+        'workers': 1,  # Parser processes; more than one enables parallel parsing
+        'chunk_bytes': 64 * 1024 * 1024,  # Byte range handed to one worker
+        'vectorized': True,  # Check flat schemas column-wise with pandas
+        'checkpoint_rows': 10000,  # Rows between resumable progress checkpoints
+        'watch': True,  # Keep picking up new files instead of a single pass at startup
+        'poll_interval': 1.0,  # Seconds between scans when inotify is unavailable
+        'settle_time': 2.0  # Seconds a polled file must be unmodified before it is read
     },
     'ftp': {
         'host': 'ftp.example.com',  # Change as needed
         'username': 'user',  # Change as needed
         'password': 'pass',  # Change as needed
-        'directory': '/data'  # Change as needed
+        'directory': '/data',  # Change as needed
+        'enabled': False,  # Ingest the FTP directory in main()
+        'port': 21,
+        'connections': 4,  # Logged-in connections, i.e. parallel downloads
+        'batch_size': 1000,  # Records sent to the dispatcher per call
+        'listing_cache': 'state/ftp_listing.json'  # Files already ingested (size and mtime)
+    }
+}
+
+DISPATCHER = {
+    'mode': 'sync',  # Options: 'sync' (validate and route on the adapter thread), 'pipelined'
+    'queue_size': 1000,  # Pipelined mode: batches waiting for validation
+    'validation_workers': 2,  # Pipelined mode: threads validating and routing batches, each for its own sources
+    'consumer_queue_size': 100  # Pipelined mode: batches waiting per consumer
+}
+
+ADMISSION = {
+    'enabled': False,  # Rate-limit sources and share dispatcher capacity between them
+    'capacity': 8,  # Batches the dispatcher works on at once, across all sources
+    # Per source: rate (records/s, None for no limit), burst, max_concurrent (batches), weight
+    # (share of capacity), overload ('block', 'spill' to output/spill_<source>, 'drop'), max_wait (s)
+    'sources': {
+        'kafka': {'weight': 4, 'max_concurrent': 4, 'overload': 'block'},
+        'api': {'weight': 2, 'max_concurrent': 2, 'overload': 'block'},
+        'csv': {'weight': 1, 'rate': 50000, 'burst': 100000, 'max_concurrent': 2, 'overload': 'block'},
+        'ftp': {'weight': 1, 'rate': 50000, 'burst': 100000, 'max_concurrent': 2, 'overload': 'spill',
+                'max_wait': 5.0}
+    },
+    'default': {'weight': 1, 'overload': 'block'}
+}
+
+DEAD_LETTERS = {
+    'enabled': False,  # Keep rejected, spilled and undeliverable records in segment queues
+    'dir': 'state/dead_letters',  # Replay with: python -m src.replay --queue rejected
+    'segment_bytes': 64 * 1024 * 1024,  # Roll a queue segment once it reaches this size
+    'retry_delay': 1.0,  # Seconds before retrying a failed delivery; doubles with every retry
+    'max_retries': 5  # Retries before a batch moves to the failed queue
+}
+
+DEDUP = {
+    'enabled': False,  # Drop records whose key was already dispatched within the window
+    'backend': 'window',  # Options: 'window' (exact hash set), 'bloom' (rotating Bloom filters)
+    'window_seconds': 300,
+    'max_keys': 1000000,  # Window backend: keys held before the oldest are evicted early
+    'capacity': 10000000,  # Bloom backend: keys expected per window
+    'error_rate': 0.001,  # Bloom backend: chance of dropping a record that was not a duplicate
+    'keys': {
+        'location_v1': ['vehicle_id', 'timestamp']
     }
 }
 
+OUTPUT = {
+    'dir': 'output',
+    'format': 'jsonl',  # Options: 'jsonl', 'wire' (binary Avro for records with an Avro schema)
+    'segment_bytes': 64 * 1024 * 1024,  # Roll a segment file once it reaches this size
+    'segment_seconds': 300,  # ...or once it has been open this long
+    'flush_records': 1000,  # Flush a stream's buffer after this many records
+    'flush_interval': 1.0  # ...or at least this often (seconds)
+}
+
+PARQUET = {
+    'enabled': False,  # Register the Parquet writer consumer in main()
+    'dir': 'output/parquet',
+    'row_group_size': 100000,  # Rows per row group
+    'flush_interval': 60,  # Write a partial row group after this many seconds
+    'file_row_groups': 10,  # Row groups per file before starting a new one
+    'dictionary_fields': ['vehicle_id']  # String columns stored dictionary-encoded
+}
+
+DATABASE = {
+    'enabled': False,  # Register the SQLite database writer consumer in main()
+    'path': 'output/ingest.db',
+    'batch_size': 10000,  # Rows per transaction
+    'flush_interval': 1.0,  # Commit a partial transaction after this many seconds
+    'latest_key': 'vehicle_id',  # Keep the newest row per key in <table>_latest; None to disable
+    'latest_order': 'timestamp'  # Field deciding which row is newest
+}
+
+GEO_AGGREGATION = {
+    'enabled': False,  # Keep live vehicle positions and write rollups to output/geo_cells, geo_distance
+    'schemas': ['location_v1'],  # Schemas of the records it aggregates
+    'cell_degrees': 0.01,  # Grid cell size for bounding box queries and per-cell counts
+    'window_seconds': 60,  # Tumbling window of the rollups
+    'position_ttl': 3600  # Seconds without records before a vehicle's position is dropped; None keeps it
+}
+
+METRICS = {
+    'enabled': True,  # Serve Prometheus metrics from main()
+    'host': '127.0.0.1',
+    'port': 9100  # Scrape http://host:port/metrics
+}
+
 LOGGING = {
     'level': 'INFO',  # Options: 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'
-    'log_file': 'ingestion.log'  # Change as needed
+    'log_file': 'ingestion.log',  # Change as needed
+    'format': 'text',  # Options: 'text', 'json' (one JSON object per line)
+    'async': True  # Format and write log records on a background thread
 }
\ No newline at end of file
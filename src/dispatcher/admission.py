@@ -0,0 +1,198 @@
+"""Per-source rate limits, concurrency caps and fair sharing of dispatcher capacity.
+
+Every batch an adapter hands to the dispatcher first has to be admitted:
+its source's token bucket must hold enough tokens (one per record) and a
+processing slot must be free, both for the source (``max_concurrent``) and
+for the dispatcher as a whole (``capacity``). When several sources wait for
+a slot, it goes to the one with the smallest weighted share of records
+admitted so far, so a bulk load cannot starve a stream with a higher
+weight. A batch that cannot be admitted within ``max_wait`` seconds is
+shed according to its source's overload policy:
+
+``block``
+    wait as long as it takes, pushing back on the adapter (``max_wait`` is ignored);
+``spill``
+    write the records to disk for a later replay;
+``drop``
+    discard the records and count them as shed.
+"""
+import threading
+import time
+from src.utils.metrics import metrics
+
+OVERLOAD_POLICIES = ('block', 'spill', 'drop')
+
+_WAIT_SECONDS = metrics.histogram('ingest_admission_wait_seconds',
+                                  'Time a batch waited to be admitted.', ('source',))
+
+class TokenBucket:
+    """Allows ``rate`` tokens per second on average, in bursts of up to ``burst``.
+
+    A request larger than the bucket still gets through once enough tokens
+    have accrued for it, by taking the bucket into debt.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, count, max_wait=None):
+        """Take ``count`` tokens and return the seconds to wait before using them.
+
+        Returns None, taking nothing, if that wait would exceed ``max_wait``.
+        """
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= count else (count - self._tokens) / self.rate
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= count
+            return wait
+
+    def refund(self, count):
+        """Give back tokens reserved for a request that was not carried out."""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + count)
+
+class SourceLimits:
+    """Admission settings of one source."""
+
+    __slots__ = ('rate', 'burst', 'max_concurrent', 'weight', 'overload', 'max_wait')
+
+    def __init__(self, rate=None, burst=None, max_concurrent=None, weight=1.0, overload='block',
+                 max_wait=1.0):
+        if overload not in OVERLOAD_POLICIES:
+            raise ValueError(f"Unknown overload policy {overload!r}; expected one of {OVERLOAD_POLICIES}")
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        self.rate = rate  # Records per second, or None for no limit
+        self.burst = burst  # Records above the rate allowed at once (default: one second's worth)
+        self.max_concurrent = max_concurrent  # Batches in the dispatcher at once, or None
+        self.weight = weight  # Share of dispatcher capacity relative to other sources
+        self.overload = overload
+        self.max_wait = max_wait  # Seconds to wait before shedding, unless the policy is block
+
+class _Source:
+    def __init__(self, limits):
+        self.limits = limits
+        self.bucket = TokenBucket(limits.rate, limits.burst) if limits.rate else None
+        self.in_flight = 0
+        self.finish = 0.0  # Virtual time at which its admitted records are served
+
+class AdmissionController:
+    """Admits batches per source, see the module docstring.
+
+    ``sources`` maps source names to ``SourceLimits`` or dicts of their
+    arguments; other sources use ``default``. ``capacity`` is the number of
+    batches the dispatcher works on at once, or None for no global cap.
+    """
+
+    def __init__(self, sources=None, default=None, capacity=None):
+        self.capacity = capacity
+        self.default = _limits(default)
+        self._limits = {name: _limits(limits) for name, limits in (sources or {}).items()}
+        self._sources = {}
+        self._in_flight = 0
+        self._virtual_time = 0.0
+        self._waiting = []  # [finish tag, sequence, source], in arrival order
+        self._sequence = 0
+        self._cond = threading.Condition()
+
+        metrics.gauge('ingest_admission_in_flight', 'Admitted batches being processed.', ('source',),
+                      callback=self.in_flight)
+
+    def limits(self, source_name):
+        return self._limits.get(source_name, self.default)
+
+    def admit(self, source_name, count):
+        """Wait until a batch of ``count`` records may be processed.
+
+        Returns True once admitted, after which ``release`` must be called
+        when the batch is done; returns False if it should be shed instead.
+        """
+        source = self._source(source_name)
+        limits = source.limits
+        max_wait = None if limits.overload == 'block' else limits.max_wait
+        started = time.monotonic()
+
+        if source.bucket is not None:
+            wait = source.bucket.reserve(count, max_wait)
+            if wait is None:
+                return False
+            if wait:
+                time.sleep(wait)
+
+        with self._cond:
+            # Finish tag as in weighted fair queuing: larger batches and lower weights wait longer
+            tag = max(source.finish, self._virtual_time) + count / limits.weight
+            self._sequence += 1
+            waiter = [tag, self._sequence, source]
+            self._waiting.append(waiter)
+            deadline = None if max_wait is None else started + max_wait
+            try:
+                while not self._may_start(waiter):
+                    timeout = None if deadline is None else deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        # Shed records do not count against the source's rate
+                        if source.bucket is not None:
+                            source.bucket.refund(count)
+                        return False
+                    self._cond.wait(timeout)
+            finally:
+                self._waiting.remove(waiter)
+                # Someone else may be next now, whether or not this one got in
+                self._cond.notify_all()
+            source.finish = tag
+            self._virtual_time = max(self._virtual_time, tag - count / limits.weight)
+            source.in_flight += 1
+            self._in_flight += 1
+        _WAIT_SECONDS.observe(time.monotonic() - started, (source_name,))
+        return True
+
+    def release(self, source_name):
+        """Free the slot of an admitted batch."""
+        source = self._sources[source_name]
+        with self._cond:
+            source.in_flight -= 1
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def in_flight(self):
+        """Batches being processed per source, for monitoring."""
+        return {name: source.in_flight for name, source in self._sources.items()}
+
+    def _source(self, source_name):
+        source = self._sources.get(source_name)
+        if source is None:
+            with self._cond:
+                source = self._sources.setdefault(source_name, _Source(self.limits(source_name)))
+        return source
+
+    def _may_start(self, waiter):
+        """Whether a waiter can take a slot now. Caller holds the condition."""
+        if self.capacity is not None and self._in_flight >= self.capacity:
+            return False
+        if not _has_slot(waiter[2]):
+            return False
+        # Waiters of sources that could start are served smallest finish tag first
+        return min((w for w in self._waiting if _has_slot(w[2])), key=_tag) is waiter
+
+def _has_slot(source):
+    limit = source.limits.max_concurrent
+    return limit is None or source.in_flight < limit
+
+def _tag(waiter):
+    return waiter[0], waiter[1]
+
+def _limits(limits):
+    if limits is None:
+        return SourceLimits()
+    if isinstance(limits, SourceLimits):
+        return limits
+    return SourceLimits(**limits)
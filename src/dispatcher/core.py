@@ -1,75 +1,297 @@
 import time
-import json
 import os
-from src.utils.logging import logger
+from src.dispatcher.routing import RoutingTable
+from src.output.sinks import JsonLinesSink
+from src.utils.logging import logger, RateLimitedLogger
+from src.utils.metrics import metrics
+
+_RECEIVED = metrics.counter('ingest_records_received_total',
+                            'Records received from adapters.', ('source', 'schema'))
+_ACCEPTED = metrics.counter('ingest_records_accepted_total',
+                            'Records that passed validation.', ('source', 'schema'))
+_REJECTED = metrics.counter('ingest_records_rejected_total',
+                            'Records that failed validation.', ('source', 'schema'))
+_DUPLICATES = metrics.counter('ingest_records_duplicate_total',
+                              'Accepted records dropped as duplicates.', ('source', 'schema'))
+_VALIDATION_SECONDS = metrics.histogram('ingest_validation_seconds',
+                                        'Time to validate one batch.', ('schema',))
+_CONSUMER_SECONDS = metrics.histogram('ingest_consumer_seconds',
+                                      'Time a consumer took to process one batch.', ('consumer',))
+_CONSUMER_ERRORS = metrics.counter('ingest_consumer_errors_total',
+                                   'Errors raised by consumers.', ('consumer',))
+_SHED = metrics.counter('ingest_records_shed_total',
+                        'Records not admitted because their source was over its limits.', ('source', 'policy'))
+
+# Per-record and per-batch events are logged lazily at DEBUG; recurring errors are throttled
+_throttled = RateLimitedLogger(logger, interval=10.0)
 
 class Dispatcher:
-    def __init__(self, schema_registry, output_dir='output'):
+    def __init__(self, schema_registry, output_dir='output', output_sink=None, deduplicator=None,
+                 admission=None, dead_letters=None):
         self.schema_registry = schema_registry
         self.output_dir = output_dir
         self.consumers = []
+        self.routes = RoutingTable()
+        self.deduplicator = deduplicator  # Optional Deduplicator dropping recently seen records
+        self.admission = admission  # Optional AdmissionController limiting each source
+        # Optional DeadLetterStore keeping rejected, spilled and undeliverable records
+        self.dead_letters = dead_letters
         
         # Create output directory if it doesn't exist
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
             
-    def register_consumer(self, consumer):
-        """Register a consumer to receive processed data."""
+        # Fallback storage for records without consumers and for rejected records
+        self.output_sink = output_sink or JsonLinesSink(output_dir)
+        
+        if dead_letters is not None:
+            dead_letters.start_retries(self.redeliver)
+        
+    def register_consumer(self, consumer, sources=None, schemas=None, where=None):
+        """Register a consumer to receive processed data.
+        
+        By default the consumer gets every record. ``sources`` and ``schemas``
+        limit it to records from those sources and schemas, and ``where`` to
+        records whose fields match the conditions (see ``src.dispatcher.routing``).
+        Returns the consumer's route.
+        """
+        route = self.routes.add(consumer, sources, schemas, where)
         self.consumers.append(consumer)
+        return route
+        
+    def receive_data(self, data, source_name, schema_id, version=None):
+        """Process incoming data from an adapter.
         
-    def receive_data(self, data, source_name, schema_id):
-        """Process incoming data from an adapter."""
-        logger.info(f"Received data from {source_name}")
+        ``version`` is the schema version the record was written with; records
+        of an older version are validated against it and upcast to the current one.
+        """
+        if self.admission is None:
+            return self._receive_data(data, source_name, schema_id, version)
+        return self._admitted(self._receive_data, [data], (data, source_name, schema_id, version),
+                              source_name, schema_id, False)
+        
+    def _receive_data(self, data, source_name, schema_id, version=None):
+        logger.debug("Received data from %s", source_name)
         
         # Validate data against schema
-        is_valid, error = self.schema_registry.validate_data(data, schema_id)
+        started = time.perf_counter()
+        is_valid, error = self.schema_registry.validate_data(data, schema_id, version)
+        _VALIDATION_SECONDS.observe(time.perf_counter() - started, (schema_id,))
+        _RECEIVED.inc((source_name, schema_id))
         
         if not is_valid:
-            logger.error(f"Validation error for data from {source_name}: {error}")
-            self._write_to_rejected(data, source_name, error)
+            _REJECTED.inc((source_name, schema_id))
+            _throttled.error("Validation error for data from %s: %s", source_name, error)
+            self._write_to_rejected(data, source_name, error, schema_id)
             return False
             
+        _ACCEPTED.inc((source_name, schema_id))
+        if version is not None:
+            data = self.schema_registry.project_batch([data], schema_id, version)[0]
+        if self.deduplicator and not self.deduplicator.filter([data], schema_id):
+            _DUPLICATES.inc((source_name, schema_id))
+            logger.debug("Dropped duplicate record from %s", source_name)
+            return True
+            
         # Process and route valid data
-        return self.route_data(data, source_name)
+        return self.route_data(data, source_name, schema_id)
+        
+    def receive_batch(self, records, source_name, schema_id, version=None, on_done=None):
+        """Process a batch of incoming records from an adapter.
+        
+        Records written with an older ``version`` of the schema are validated
+        against that version and upcast to the current one. Returns the number
+        of records that passed validation. ``on_done`` is called without
+        arguments once the batch has been delivered to its consumers or shed,
+        e.g. to commit a source offset; here that is before returning.
+        """
+        if self.admission is None:
+            accepted = self._receive_batch(records, source_name, schema_id, version)
+        else:
+            accepted = self._admitted(self._receive_batch, records, (records, source_name, schema_id, version),
+                                      source_name, schema_id, 0)
+        if on_done is not None:
+            on_done()
+        return accepted
+        
+    def _receive_batch(self, records, source_name, schema_id, version=None):
+        logger.debug("Received batch of %d records from %s", len(records), source_name)
         
-    def route_data(self, data, source_name):
+        started = time.perf_counter()
+        accepted, rejected = self.schema_registry.validate_batch(records, schema_id, version)
+        if version is not None and accepted:
+            accepted = self.schema_registry.project_batch(accepted, schema_id, version)
+        _VALIDATION_SECONDS.observe(time.perf_counter() - started, (schema_id,))
+        return self._dispatch_validated(accepted, rejected, source_name, schema_id)
+        
+    def receive_validated_batch(self, accepted, rejected, source_name, schema_id, on_done=None):
+        """Process a batch that an adapter already validated (e.g. in worker processes).
+        
+        ``rejected`` holds ``(record, error)`` pairs. Returns the number of
+        accepted records. ``on_done`` is as for ``receive_batch``.
+        """
+        logger.debug("Received validated batch of %d records from %s",
+                     len(accepted) + len(rejected), source_name)
+        if self.admission is None:
+            count = self._dispatch_validated(accepted, rejected, source_name, schema_id)
+        else:
+            if rejected:
+                # Rejected records only go to the rejected stream; only accepted ones are admitted
+                self._dispatch_validated([], rejected, source_name, schema_id)
+            count = self._admitted(self._dispatch_validated, accepted, (accepted, [], source_name, schema_id),
+                                   source_name, schema_id, 0)
+        if on_done is not None:
+            on_done()
+        return count
+        
+    def _admitted(self, process, records, args, source_name, schema_id, shed_result):
+        """Run ``process(*args)`` once the batch is admitted, or shed the records."""
+        if not self.admission.admit(source_name, len(records)):
+            self._shed(records, source_name, schema_id)
+            return shed_result
+        try:
+            return process(*args)
+        finally:
+            self.admission.release(source_name)
+            
+    def _shed(self, records, source_name, schema_id):
+        """Apply the source's overload policy to records that were not admitted."""
+        policy = self.admission.limits(source_name).overload
+        _SHED.inc((source_name, policy), len(records))
+        _throttled.warning("Source %s is over its limits, %s %d records", source_name,
+                           'spilling' if policy == 'spill' else 'dropping', len(records))
+        if policy == 'spill' and self.dead_letters is not None:
+            self.dead_letters.spill(records, source_name, schema_id)
+        elif policy == 'spill':
+            timestamp = int(time.time())
+            self.output_sink.write(f"spill_{source_name}", [{
+                'data': data,
+                'schema_id': schema_id,
+                'timestamp': timestamp
+            } for data in records])
+        
+    def _dispatch_validated(self, accepted, rejected, source_name, schema_id):
+        """Store rejected records, drop duplicates and route the remaining accepted ones."""
+        labels = (source_name, schema_id)
+        _RECEIVED.inc(labels, len(accepted) + len(rejected))
+        _ACCEPTED.inc(labels, len(accepted))
+        if rejected:
+            _REJECTED.inc(labels, len(rejected))
+            _throttled.error("Validation failed for %d of %d records from %s: %s", len(rejected),
+                             len(accepted) + len(rejected), source_name, rejected[0][1])
+            self._write_batch_to_rejected(rejected, source_name, schema_id)
+            
+        unique = accepted
+        if accepted and self.deduplicator:
+            unique = self.deduplicator.filter(accepted, schema_id)
+            if len(unique) < len(accepted):
+                _DUPLICATES.inc(labels, len(accepted) - len(unique))
+                logger.debug("Dropped %d duplicate records from %s", len(accepted) - len(unique), source_name)
+                
+        if unique:
+            self.route_batch(unique, source_name, schema_id)
+        return len(accepted)
+        
+    def route_data(self, data, source_name, schema_id=None):
         """Route validated data to registered consumers."""
-        logger.info(f"Routing data from {source_name} to {len(self.consumers)} consumers")
+        return self.route_batch([data], source_name, schema_id)
         
-        # Default behavior: write to file if no consumers
-        if not self.consumers:
-            self._write_to_file(data, source_name)
-            return True
+    def route_batch(self, records, source_name, schema_id=None):
+        """Route a batch of validated records to registered consumers.
+        
+        Each consumer gets the records its route matches. Consumers that define
+        ``process_batch(records, source_name, schema_id)`` get them in one call;
+        the others get ``process`` per record. Records no route matches (all
+        of them, without consumers) are written to the output sink.
+        """
+        deliveries, unmatched = self.routes.route(records, source_name, schema_id)
+        logger.debug("Routing %d records from %s to %d consumers",
+                     len(records), source_name, len(deliveries))
+        
+        for route, selected in deliveries:
+            self._deliver(route.consumer, selected, source_name, schema_id)
             
-        # Send to all registered consumers
-        for consumer in self.consumers:
+        # Default behavior: write to file what no consumer takes
+        if unmatched:
+            self._write_batch_to_file(unmatched, source_name, schema_id)
+        return True
+        
+    def _deliver(self, consumer, records, source_name, schema_id):
+        """Hand a batch to one consumer, isolating the others from its errors.
+        
+        Records the consumer fails on go to the dead-letter store for retries, if there is one.
+        """
+        name = consumer.__class__.__name__
+        started = time.perf_counter()
+        failed, error = self._attempt(consumer, records, source_name, schema_id)
+        _CONSUMER_SECONDS.observe(time.perf_counter() - started, (name,))
+        if failed:
+            # One error per failed batch, or per failed record for per-record consumers
+            _CONSUMER_ERRORS.inc((name,), 1 if hasattr(consumer, 'process_batch') else len(failed))
+            _throttled.error("Error in consumer %s: %s", name, error)
+            if self.dead_letters is not None:
+                self.dead_letters.undeliverable(failed, name, source_name, schema_id, error)
+                
+    def _attempt(self, consumer, records, source_name, schema_id):
+        """Deliver records to a consumer; returns ``(failed records, last error)``."""
+        process_batch = getattr(consumer, 'process_batch', None)
+        if process_batch is not None:
+            try:
+                process_batch(records, source_name, schema_id)
+            except Exception as e:
+                return records, str(e)
+            return [], None
+        failed = []
+        error = None
+        for record in records:
             try:
-                consumer.process(data)
+                consumer.process(record)
             except Exception as e:
-                logger.error(f"Error in consumer {consumer.__class__.__name__}: {str(e)}")
+                failed.append(record)
+                error = str(e)
+        return failed, error
+        
+    def redeliver(self, consumer_name, records, source_name, schema_id):
+        """Deliver records again to the registered consumer with the given class name.
+        
+        Used for retries and replays from the dead-letter store. Returns
+        ``(failed records, last error)``.
+        """
+        for consumer in self.consumers:
+            if consumer.__class__.__name__ == consumer_name:
+                return self._attempt(consumer, records, source_name, schema_id)
+        return records, f"No consumer named {consumer_name}"
                 
-        return True
+    def close(self):
+        """Close registered consumers and flush pending output."""
+        for consumer in self.consumers:
+            close = getattr(consumer, 'close', None)
+            if close is None:
+                continue
+            try:
+                close()
+            except Exception as e:
+                logger.error(f"Error closing consumer {consumer.__class__.__name__}: {str(e)}")
+        self.output_sink.close()
+        if self.dead_letters is not None:
+            self.dead_letters.close()
         
-    def _write_to_file(self, data, source_name):
-        """Write data to JSON file."""
-        timestamp = int(time.time())
-        filename = f"{self.output_dir}/{source_name}_{timestamp}.json"
+    def _write_to_rejected(self, data, source_name, error, schema_id=None):
+        """Write rejected data to the rejected stream of its source."""
+        self._write_batch_to_rejected([(data, error)], source_name, schema_id)
         
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=2)
-            
-        logger.info(f"Data written to {filename}")
+    def _write_batch_to_file(self, records, source_name, schema_id=None):
+        """Write a batch of records to the output sink."""
+        self.output_sink.write(source_name, records, schema_id)
         
-    def _write_to_rejected(self, data, source_name, error):
-        """Write rejected data to a separate file."""
+    def _write_batch_to_rejected(self, rejected, source_name, schema_id=None):
+        """Write a batch of rejected records to the dead-letter store, or else the output sink."""
+        if self.dead_letters is not None:
+            self.dead_letters.reject(rejected, source_name, schema_id)
+            return
         timestamp = int(time.time())
-        filename = f"{self.output_dir}/rejected_{source_name}_{timestamp}.json"
-        
-        with open(filename, 'w') as f:
-            json.dump({
-                'data': data,
-                'error': error,
-                'timestamp': timestamp
-            }, f, indent=2)
-            
-        logger.info(f"Rejected data written to {filename}")
\ No newline at end of file
+        self.output_sink.write(f"rejected_{source_name}", [{
+            'data': data,
+            'error': error,
+            'timestamp': timestamp
+        } for data, error in rejected])
@@ -0,0 +1,173 @@
+"""Dead-letter store and overflow buffer of the dispatcher.
+
+Records the dispatcher cannot hand on are kept in segment queues under one
+directory, one JSON entry per batch:
+
+``rejected``
+    records that failed validation, with their errors;
+``spill``
+    records shed by admission control under the ``spill`` policy;
+``retry-<n>``
+    batches a consumer failed to process, waiting for their n-th retry;
+``failed``
+    batches still failing after the last retry.
+
+Retries back off exponentially: every retry level is a queue of its own
+with a fixed delay (``retry_delay * 2 ** n``), so each queue is due in the
+order it was written and the retry thread only ever looks at its heads.
+Rejected, spilled and failed batches are replayed by ``src.replay``, which
+only reads the store and keeps its place in a ``replay-<queue>`` cursor;
+the retry thread of the running store deletes the segments a replay has
+moved past.
+"""
+import json
+import os
+import threading
+import time
+from src.utils.logging import logger
+from src.utils.metrics import metrics
+from src.utils.segment_queue import SegmentQueue
+
+_STORED = metrics.counter('dead_letter_records_total',
+                          'Records written to the dead-letter store.', ('queue',))
+_RETRIED = metrics.counter('dead_letter_retries_total',
+                           'Retried deliveries, by outcome.', ('consumer', 'outcome'))
+
+REPLAYABLE_QUEUES = ('rejected', 'spill', 'failed')
+
+class DeadLetterStore:
+    """Keeps rejected, spilled and undeliverable records on disk and retries deliveries."""
+
+    def __init__(self, directory='state/dead_letters', segment_bytes=64 * 1024 * 1024,
+                 retry_delay=1.0, max_retries=5, fsync=False, readonly=False):
+        self.directory = directory
+        self.retry_delay = retry_delay  # Seconds before the first retry; doubles with every retry
+        self.max_retries = max_retries
+        self._options = dict(segment_bytes=segment_bytes, fsync=fsync, readonly=readonly)
+        self._queues = {}
+        self._queues_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._retry_thread = None
+
+    def queue(self, name):
+        """The segment queue with the given name, opened on first use."""
+        queue = self._queues.get(name)
+        if queue is None:
+            with self._queues_lock:
+                queue = self._queues.get(name)
+                if queue is None:
+                    queue = self._queues[name] = SegmentQueue(os.path.join(self.directory, name),
+                                                              **self._options)
+        return queue
+
+    def reject(self, rejected, source_name, schema_id):
+        """Store ``(record, error)`` pairs that failed validation."""
+        self._put('rejected', {
+            'source': source_name,
+            'schema_id': schema_id,
+            'records': [data for data, _ in rejected],
+            'errors': [error for _, error in rejected],
+            'timestamp': time.time()
+        }, len(rejected))
+
+    def spill(self, records, source_name, schema_id):
+        """Store validated or unvalidated records that were not admitted."""
+        self._put('spill', {
+            'source': source_name,
+            'schema_id': schema_id,
+            'records': records,
+            'timestamp': time.time()
+        }, len(records))
+
+    def undeliverable(self, records, consumer_name, source_name, schema_id, error, attempt=0):
+        """Store records a consumer failed to process, for retry number ``attempt``."""
+        queue = f'retry-{attempt}' if attempt < self.max_retries else 'failed'
+        self._put(queue, {
+            'source': source_name,
+            'schema_id': schema_id,
+            'consumer': consumer_name,
+            'records': records,
+            'error': error,
+            'attempt': attempt,
+            'timestamp': time.time()
+        }, len(records))
+
+    def entries(self, name, offset=None, end=None):
+        """Yield ``(offset, entry)`` pairs of a queue."""
+        for offset, payload in self.queue(name).scan(offset, end):
+            yield offset, json.loads(payload)
+
+    def start_retries(self, deliver):
+        """Retry undeliverable batches in the background.
+
+        ``deliver(consumer_name, records, source_name, schema_id)`` returns
+        ``(failed_records, error)``; failed records move on to the next retry.
+        """
+        self._retry_thread = threading.Thread(target=self._retry_loop, args=(deliver,),
+                                              name="dead-letter-retry", daemon=True)
+        self._retry_thread.start()
+
+    def retry_due(self, deliver, now=None):
+        """Retry every batch that is due; returns the seconds until the next one is (or None)."""
+        now = time.time() if now is None else now
+        next_due = None
+        for attempt in range(self.max_retries):
+            name = f'retry-{attempt}'
+            if not os.path.exists(os.path.join(self.directory, name)):
+                continue
+            queue = self.queue(name)
+            delay = self.retry_delay * 2 ** attempt
+            cursor = queue.committed('retry')
+            for offset, entry in self.entries(name, cursor):
+                due = entry['timestamp'] + delay
+                if due > now:
+                    next_due = min(next_due or due - now, due - now)
+                    break
+                failed, error = deliver(entry['consumer'], entry['records'], entry['source'],
+                                        entry['schema_id'])
+                _RETRIED.inc((entry['consumer'], 'failed' if failed else 'delivered'))
+                if failed:
+                    self.undeliverable(failed, entry['consumer'], entry['source'], entry['schema_id'],
+                                       error, attempt + 1)
+                cursor = offset + 1
+                queue.commit('retry', cursor)
+            queue.truncate_before(cursor)
+        return next_due
+
+    def truncate_replayed(self):
+        """Delete segments of the replayable queues that a replay has moved past."""
+        for name in REPLAYABLE_QUEUES:
+            if not os.path.exists(os.path.join(self.directory, name)):
+                continue
+            queue = self.queue(name)
+            queue.truncate_before(queue.committed(f'replay-{name}'))
+
+    def flush(self):
+        for queue in list(self._queues.values()):
+            queue.flush()
+
+    def close(self):
+        """Stop retrying and close every queue."""
+        self._stop.set()
+        if self._retry_thread is not None:
+            self._retry_thread.join()
+        with self._queues_lock:
+            for queue in self._queues.values():
+                queue.close()
+            self._queues.clear()
+
+    def _put(self, name, entry, count):
+        queue = self.queue(name)
+        queue.append([json.dumps(entry).encode('utf-8')])
+        queue.flush()
+        _STORED.inc((name,), count)
+
+    def _retry_loop(self, deliver):
+        while not self._stop.is_set():
+            try:
+                wait = self.retry_due(deliver)
+                self.truncate_replayed()
+            except Exception as e:
+                logger.error(f"Error retrying dead letters: {str(e)}")
+                wait = self.retry_delay
+            self._stop.wait(min(wait or 1.0, 1.0))
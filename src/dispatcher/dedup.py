@@ -0,0 +1,197 @@
+import math
+import threading
+import time
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class TimeWindowIndex:
+    """Exact set of the keys seen in the last ``window`` seconds.
+
+    Keys are queued in arrival order, so expired keys are evicted from the
+    front at constant cost per insert. At most ``max_keys`` keys are held;
+    beyond that the oldest are evicted early, which can only let a duplicate
+    through, never drop a new record.
+    """
+
+    def __init__(self, window=300, max_keys=1000000, clock=time.monotonic):
+        self.window = window
+        self.max_keys = max_keys
+        self.clock = clock
+        self._arrivals = {}     # key -> arrival time
+        self._order = deque()   # (arrival time, key), oldest first
+
+    def __len__(self):
+        return len(self._arrivals)
+
+    def add(self, key):
+        """Add a key; returns True if it was already present within the window."""
+        return self.add_many([key])[0]
+
+    def add_many(self, keys):
+        """Add keys in order; returns for each whether it was already present."""
+        now = self.clock()
+        arrivals = self._arrivals
+        order = self._order
+
+        # Evict expired keys; a key re-added later has a newer arrival and stays
+        cutoff = now - self.window
+        while order and order[0][0] <= cutoff:
+            arrived, key = order.popleft()
+            if arrivals.get(key) == arrived:
+                del arrivals[key]
+
+        seen = []
+        for key in keys:
+            if key in arrivals:
+                seen.append(True)
+                continue
+            seen.append(False)
+            arrivals[key] = now
+            order.append((now, key))
+            if len(arrivals) > self.max_keys:
+                arrived, oldest = order.popleft()
+                if arrivals.get(oldest) == arrived:
+                    del arrivals[oldest]
+        return seen
+
+class RotatingBloomFilter:
+    """Approximate set of recent keys for very high cardinality.
+
+    Keeps ``generations`` Bloom filters; a new one replaces the oldest every
+    ``window / (generations - 1)`` seconds, so a key is remembered for at least
+    ``window`` seconds. Memory is fixed by ``capacity`` (keys per window) and
+    ``error_rate``. A false positive drops a record that was not a duplicate,
+    so choose the error rate accordingly. Positions come from Python's
+    ``hash()``, so a filter is only meaningful within one process. Batches are
+    checked with NumPy when it is installed.
+    """
+
+    def __init__(self, window=300, capacity=10000000, error_rate=0.001, generations=3,
+                 clock=time.monotonic):
+        if generations < 2:
+            raise ValueError("RotatingBloomFilter needs at least two generations.")
+        self.window = window
+        self.clock = clock
+        self.rotate_every = window / (generations - 1)
+        self.generations = generations
+
+        # Each generation holds the keys of one rotation period
+        per_generation = max(1, math.ceil(capacity / (generations - 1)))
+        self.bits = max(64, int(-per_generation * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / per_generation * math.log(2)))
+        self._filters = [self._new_filter() for _ in range(generations)]
+        self._rotated_at = clock()
+
+    @property
+    def memory_bytes(self):
+        return sum(len(f) for f in self._filters)
+
+    def add(self, key):
+        """Add a key; returns True if it was (probably) seen within the window."""
+        return self.add_many([key])[0]
+
+    def add_many(self, keys):
+        """Add keys in order; returns for each whether it was (probably) seen before."""
+        now = self.clock()
+        if now - self._rotated_at >= self.rotate_every:
+            self._rotate(now)
+        if np is not None and len(keys) > 1:
+            return self._add_vectorized(keys)
+
+        seen = []
+        current = self._filters[0]
+        for key in keys:
+            positions = self._positions(hash(key))
+            if any(all(f[p >> 3] & (1 << (p & 7)) for p in positions) for f in self._filters):
+                seen.append(True)
+                continue
+            seen.append(False)
+            for p in positions:
+                current[p >> 3] |= 1 << (p & 7)
+        return seen
+
+    def _positions(self, h):
+        # Double hashing: k positions from the two 32-bit halves of one 64-bit hash
+        h &= 0xFFFFFFFFFFFFFFFF
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def _add_vectorized(self, keys):
+        # Later copies of a key within the batch are duplicates of the first one
+        first = {}
+        for i, key in enumerate(keys):
+            first.setdefault(key, i)
+        repeated = np.ones(len(keys), dtype=bool)
+        repeated[list(first.values())] = False
+
+        h = np.array([hash(key) for key in keys], dtype=np.int64).view(np.uint64)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        positions = ((h & np.uint64(0xFFFFFFFF))[:, None]
+                     + steps * ((h >> np.uint64(32)) | np.uint64(1))[:, None]) % np.uint64(self.bits)
+        byte = (positions >> np.uint64(3)).astype(np.intp)
+        bit = np.left_shift(np.uint8(1), (positions & np.uint64(7)).astype(np.uint8))
+
+        present = np.zeros(len(keys), dtype=bool)
+        for f in self._filters:
+            present |= ((f[byte] & bit) != 0).all(axis=1)
+        seen = present | repeated
+
+        new = ~seen
+        np.bitwise_or.at(self._filters[0], byte[new].ravel(), bit[new].ravel())
+        return seen.tolist()
+
+    def _new_filter(self):
+        size = (self.bits + 7) // 8
+        return np.zeros(size, dtype=np.uint8) if np is not None else bytearray(size)
+
+    def _rotate(self, now):
+        periods = int((now - self._rotated_at) // self.rotate_every)
+        for _ in range(min(periods, self.generations)):
+            self._filters.pop()
+            self._filters.insert(0, self._new_filter())
+        self._rotated_at += periods * self.rotate_every
+
+class Deduplicator:
+    """Drops records whose key was already seen recently, per schema.
+
+    ``keys`` maps a schema ID to the fields forming its record key; records of
+    other schemas pass through untouched. ``index_factory`` creates the index
+    of one schema, e.g. TimeWindowIndex or RotatingBloomFilter.
+    """
+
+    def __init__(self, keys, index_factory=TimeWindowIndex):
+        self.keys = {schema_id: tuple(fields) for schema_id, fields in keys.items()}
+        self.index_factory = index_factory
+        self._indexes = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def filter(self, records, schema_id):
+        """Return the records of a batch that were not seen before, in order."""
+        fields = self.keys.get(schema_id)
+        if fields is None:
+            return records
+
+        keys = [tuple(record.get(field) for field in fields) for record in records]
+        with self._lock:
+            index = self._indexes.get(schema_id)
+            if index is None:
+                index = self._indexes[schema_id] = self.index_factory()
+                self._counters[schema_id] = {'hits': 0, 'misses': 0}
+            seen = index.add_many(keys)
+
+            unique = [record for record, duplicate in zip(records, seen) if not duplicate]
+            counters = self._counters[schema_id]
+            counters['hits'] += len(records) - len(unique)
+            counters['misses'] += len(unique)
+        return unique
+
+    def stats(self):
+        """Duplicate (hit) and new (miss) record counts per schema."""
+        with self._lock:
+            return {schema_id: dict(counters) for schema_id, counters in self._counters.items()}
@@ -0,0 +1,211 @@
+import queue
+import threading
+from src.dispatcher.core import Dispatcher
+from src.utils.logging import logger
+from src.utils.metrics import metrics
+
+# Sentinel telling a worker thread to exit once everything before it is handled
+_STOP = object()
+
+class _Completion:
+    """Calls ``on_done`` once a batch is routed and every consumer it went to has had its part."""
+
+    def __init__(self, on_done):
+        self.on_done = on_done
+        self._pending = 1  # Routing, plus one per delivery queued
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self._pending += count
+
+    def done(self):
+        with self._lock:
+            self._pending -= 1
+            finished = self._pending == 0
+        if finished:
+            self.on_done()
+
+class _ConsumerWorker:
+    """Delivers routed batches to one consumer from its own queue and thread."""
+
+    def __init__(self, dispatcher, consumer, queue_size):
+        self.dispatcher = dispatcher
+        self.consumer = consumer
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(
+            target=self._run, name=f"consumer-{consumer.__class__.__name__}", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            records, source_name, schema_id, completion = item
+            self.dispatcher._deliver(self.consumer, records, source_name, schema_id)
+            if completion is not None:
+                completion.done()
+
+class PipelinedDispatcher(Dispatcher):
+    """Dispatcher that decouples adapters, validation and consumers with bounded queues.
+
+    ``receive_data``/``receive_batch`` only enqueue the records and return. A pool
+    of validation workers drains the queues, and every registered consumer gets
+    its own delivery queue and thread, so a slow consumer no longer stalls the
+    adapter threads. Each validation worker has its own queue and every source
+    is assigned to one of them, so the batches of a source (and of every Kafka
+    partition in it) are validated and delivered in the order they arrived;
+    more workers only help with several busy sources. All queues are bounded:
+    when they fill up, ``put`` blocks and the backpressure reaches the
+    adapters. ``close()`` drains every queue before closing the consumers.
+
+    Since returning from ``receive_batch`` only means the batch was queued,
+    adapters that acknowledge their source (e.g. commit Kafka offsets) pass
+    ``on_done``, which is called from the worker threads once the batch has
+    been delivered. A batch whose validation or routing raises is written to
+    the rejected stream with the error (the dead-letter store's ``rejected``
+    queue, if there is one) and counts as finished too, so it does not hold
+    back the acknowledgement of the batches behind it.
+    """
+
+    def __init__(self, schema_registry, output_dir='output', output_sink=None,
+                 queue_size=1000, validation_workers=2, consumer_queue_size=100, deduplicator=None,
+                 admission=None, dead_letters=None):
+        super().__init__(schema_registry, output_dir=output_dir, output_sink=output_sink,
+                         deduplicator=deduplicator, admission=admission, dead_letters=dead_letters)
+        self.consumer_queue_size = consumer_queue_size
+        # queue_size is shared out between the validation workers' queues
+        self._ingress = [queue.Queue(maxsize=max(1, queue_size // validation_workers))
+                         for _ in range(validation_workers)]
+        self._consumer_workers = []
+        self._workers_by_route = {}
+        self._routing = threading.local()  # Completion of the batch a validation worker is routing
+        self._accepting = True
+
+        metrics.gauge('ingest_queue_depth', 'Batches waiting in dispatcher queues.', ('queue',),
+                      callback=self.queue_depths)
+        
+        self._validation_workers = []
+        for n, ingress in enumerate(self._ingress):
+            thread = threading.Thread(target=self._validate_loop, args=(ingress,),
+                                      name=f"validation-{n}", daemon=True)
+            thread.start()
+            self._validation_workers.append(thread)
+
+    def register_consumer(self, consumer, sources=None, schemas=None, where=None):
+        """Register a consumer and start its delivery thread."""
+        route = super().register_consumer(consumer, sources, schemas, where)
+        worker = _ConsumerWorker(self, consumer, self.consumer_queue_size)
+        self._consumer_workers.append(worker)
+        self._workers_by_route[route] = worker
+        return route
+
+    def receive_data(self, data, source_name, schema_id, version=None):
+        """Queue a single record for validation and routing."""
+        return self.receive_batch([data], source_name, schema_id, version) == 1
+
+    def receive_batch(self, records, source_name, schema_id, version=None, on_done=None):
+        """Queue a batch for validation and routing, blocking while the queue is full.
+
+        Returns the number of records queued; validation happens asynchronously.
+        With admission control, a batch keeps its source's slot until it has
+        been validated and routed.
+        """
+        if not self._accepting:
+            raise RuntimeError("Dispatcher is closed.")
+        if self.admission is not None and not self.admission.admit(source_name, len(records)):
+            self._shed(records, source_name, schema_id)
+            if on_done is not None:
+                on_done()
+            return 0
+        completion = _Completion(on_done) if on_done is not None else None
+        self._shard(source_name).put((list(records), None, source_name, schema_id, version, completion))
+        return len(records)
+        
+    def receive_validated_batch(self, accepted, rejected, source_name, schema_id, on_done=None):
+        """Queue an already validated batch for routing, blocking while the queue is full."""
+        if not self._accepting:
+            raise RuntimeError("Dispatcher is closed.")
+        if self.admission is not None and not self.admission.admit(source_name, len(accepted)):
+            self._shed(accepted, source_name, schema_id)
+            if rejected:
+                self._dispatch_validated([], rejected, source_name, schema_id)
+            if on_done is not None:
+                on_done()
+            return 0
+        completion = _Completion(on_done) if on_done is not None else None
+        self._shard(source_name).put((list(accepted), list(rejected), source_name, schema_id, None,
+                                      completion))
+        return len(accepted)
+
+    def route_batch(self, records, source_name, schema_id=None):
+        """Queue validated records on the delivery queues of the consumers they are routed to."""
+        deliveries, unmatched = self.routes.route(records, source_name, schema_id)
+        completion = getattr(self._routing, 'completion', None)
+        if completion is not None:
+            completion.add(len(deliveries))
+        for route, selected in deliveries:
+            self._workers_by_route[route].queue.put((selected, source_name, schema_id, completion))
+        if unmatched:
+            self._write_batch_to_file(unmatched, source_name, schema_id)
+        return True
+
+    def queue_depths(self):
+        """Current number of queued batches, for monitoring."""
+        depths = {'ingress': sum(ingress.qsize() for ingress in self._ingress)}
+        for worker in self._consumer_workers:
+            depths[worker.consumer.__class__.__name__] = worker.queue.qsize()
+        return depths
+
+    def close(self):
+        """Stop accepting records, drain all queues, then close consumers and output."""
+        self._accepting = False
+        logger.info(f"Draining dispatcher queues: {self.queue_depths()}")
+
+        # Sentinels queue up behind the pending batches, so everything is processed first
+        for ingress in self._ingress:
+            ingress.put(_STOP)
+        for thread in self._validation_workers:
+            thread.join()
+
+        for worker in self._consumer_workers:
+            worker.queue.put(_STOP)
+        for worker in self._consumer_workers:
+            worker.thread.join()
+
+        super().close()
+
+    def _shard(self, source_name):
+        """The validation queue of a source; the same one for as long as the dispatcher runs."""
+        return self._ingress[hash(source_name) % len(self._ingress)]
+
+    def _set_aside(self, records, source_name, schema_id, error):
+        """Keep a batch that failed to dispatch in the rejected stream, so it can be replayed."""
+        failed = [(record, f"Dispatch failed: {error}") for record in records]
+        try:
+            self._write_batch_to_rejected(failed, source_name, schema_id)
+        except Exception as e:
+            logger.error(f"Dropped {len(failed)} records from {source_name} that failed to dispatch: {str(e)}")
+
+    def _validate_loop(self, ingress):
+        while True:
+            item = ingress.get()
+            if item is _STOP:
+                return
+            records, rejected, source_name, schema_id, version, completion = item
+            self._routing.completion = completion
+            try:
+                if rejected is None:
+                    self._receive_batch(records, source_name, schema_id, version)
+                else:
+                    self._dispatch_validated(records, rejected, source_name, schema_id)
+            except Exception as e:
+                logger.error("Error dispatching batch from %s: %s", source_name, e)
+                self._set_aside(records, source_name, schema_id, e)
+            finally:
+                self._routing.completion = None
+                if self.admission is not None:
+                    self.admission.release(source_name)
+            if completion is not None:
+                completion.done()
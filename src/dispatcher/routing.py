@@ -0,0 +1,161 @@
+"""Content-based routing of validated records to consumers.
+
+Each route names the sources and schemas it wants and, optionally,
+conditions on field values. Conditions are compiled once into a batch
+filter, and the routes that apply to a (source, schema) pair are looked up
+in an index built on first use, so routing a batch only costs the routes
+that can match it.
+
+A condition maps a field name to a value it must equal, or to a dict of
+operators that must all hold::
+
+    {'lat': {'between': [37.6, 37.9]}, 'lng': {'between': [-122.6, -122.3]},
+     'status': {'in': ['moving', 'idle']}, 'driver': {'exists': True}}
+"""
+import threading
+from src.utils.logging import logger
+
+_MISSING = object()
+
+# Operator -> expression template over the field value ``v`` and operand ``x``
+_OPERATORS = {
+    'eq': '{v} == {x}',
+    'ne': '{v} != {x}',
+    'lt': '{v} is not None and {v} < {x}',
+    'le': '{v} is not None and {v} <= {x}',
+    'gt': '{v} is not None and {v} > {x}',
+    'ge': '{v} is not None and {v} >= {x}',
+    'in': '{v} in {x}',
+    'not_in': '{v} not in {x}',
+}
+
+def compile_predicate(where):
+    """Compile field conditions into ``match(records) -> matching records``.
+
+    Fields missing from a record only satisfy ``ne``, ``not_in`` and
+    ``exists: False``. Raises ValueError for unknown operators.
+    """
+    namespace = {'_missing': _MISSING}
+    conditions = []
+    for n, (field, condition) in enumerate(sorted(where.items())):
+        v = f'v{n}'
+        get = f'({v} := r.get({field!r}, _missing))'
+        if not isinstance(condition, dict):
+            condition = {'eq': condition}
+        for m, (op, operand) in enumerate(sorted(condition.items())):
+            # The first test of a field reads it, the others reuse the value
+            value = get if m == 0 else v
+            if op == 'exists':
+                conditions.append(f'{value} is {"not " if operand else ""}_missing')
+                continue
+            if op == 'between':
+                low, high = operand
+                namespace[f'_low{n}'], namespace[f'_high{n}'] = low, high
+                conditions.append(f'{value} is not _missing and {v} is not None '
+                                  f'and _low{n} <= {v} <= _high{n}')
+                continue
+            if op not in _OPERATORS:
+                raise ValueError(f"Unknown routing operator {op!r} for field {field!r}")
+            if op in ('in', 'not_in'):
+                operand = frozenset(operand)
+            namespace[f'_x{n}_{m}'] = operand
+            test = _OPERATORS[op].format(v=v, x=f'_x{n}_{m}')
+            if op in ('ne', 'not_in'):
+                conditions.append(f'({value} is _missing or {test})')
+            else:
+                conditions.append(f'{value} is not _missing and {test}')
+
+    expression = ' and '.join(f'({c})' for c in conditions) or 'True'
+    source = (f'def match(records):\n'
+              f'    return [r for r in records if {expression}]')
+    exec(compile(source, '<routing predicate>', 'exec'), namespace)
+    return namespace['match']
+
+class Route:
+    """A consumer and the records it should receive."""
+
+    __slots__ = ('consumer', 'sources', 'schemas', 'where', '_match')
+
+    def __init__(self, consumer, sources=None, schemas=None, where=None):
+        self.consumer = consumer
+        self.sources = None if sources is None else frozenset(sources)
+        self.schemas = None if schemas is None else frozenset(schemas)
+        self.where = where
+        self._match = compile_predicate(where) if where else None
+
+    def applies_to(self, source_name, schema_id):
+        return ((self.sources is None or source_name in self.sources)
+                and (self.schemas is None or schema_id in self.schemas))
+
+    def select(self, records):
+        """The records of a batch this route matches."""
+        if self._match is None:
+            return records
+        try:
+            return self._match(records)
+        except TypeError:
+            # A value of an unexpected type; judge the batch record by record
+            return [record for record in records if self._matches_one(record)]
+
+    def _matches_one(self, record):
+        try:
+            return bool(self._match([record]))
+        except TypeError:
+            return False
+
+class RoutingTable:
+    """Routes batches to the consumers whose routes match them.
+
+    Lookups read an index of ``(source, schema) -> routes`` without locking;
+    adding or removing a route swaps in a fresh, empty index.
+    """
+
+    def __init__(self):
+        self.routes = []
+        self._lock = threading.Lock()
+        self._index = {}
+
+    def add(self, consumer, sources=None, schemas=None, where=None):
+        """Add a route and return it; ``None`` for sources or schemas means any."""
+        route = Route(consumer, sources, schemas, where)
+        with self._lock:
+            self.routes = self.routes + [route]
+            self._index = {}
+        return route
+
+    def remove(self, route):
+        with self._lock:
+            self.routes = [r for r in self.routes if r is not route]
+            self._index = {}
+
+    def routes_for(self, source_name, schema_id):
+        """Routes that apply to records of a source and schema, in registration order."""
+        index = self._index
+        routes = index.get((source_name, schema_id))
+        if routes is None:
+            routes = tuple(r for r in self.routes if r.applies_to(source_name, schema_id))
+            index[(source_name, schema_id)] = routes
+            logger.debug("Indexed %d routes for %s/%s", len(routes), source_name, schema_id)
+        return routes
+
+    def route(self, records, source_name, schema_id):
+        """Split a batch by route.
+
+        Returns ``(deliveries, unmatched)``: ``(route, records)`` pairs for the
+        routes that match at least one record, and the records no route matched.
+        """
+        deliveries = []
+        matched = set()
+        catch_all = False
+        for route in self.routes_for(source_name, schema_id):
+            selected = route.select(records)
+            if not selected:
+                continue
+            deliveries.append((route, selected))
+            if selected is records:
+                catch_all = True
+            elif not catch_all:
+                matched.update(map(id, selected))
+        if catch_all:
+            return deliveries, []
+        return deliveries, [record for record in records if id(record) not in matched]
@@ -2,37 +2,51 @@ import os
 import time
 import signal
 import sys
+from src.config.settings import (ADMISSION, BATCH_SETTINGS, DATABASE, DEAD_LETTERS, DEDUP, DISPATCHER,
+                                 GEO_AGGREGATION, MESSAGE_QUEUE, METRICS, OUTPUT, PARQUET, SCHEMA_REGISTRY)
 from src.schema_registry.registry import SchemaRegistry
 from src.dispatcher.core import Dispatcher
+from src.dispatcher.pipeline import PipelinedDispatcher
+from src.dispatcher.admission import AdmissionController
+from src.dispatcher.dead_letter import DeadLetterStore
+from src.dispatcher.dedup import Deduplicator, TimeWindowIndex, RotatingBloomFilter
+from src.output.sinks import JsonLinesSink, WireFormatSink
 from src.adapters.streaming.kafka_adapter import KafkaAdapter
 from src.adapters.batch.api_adapter import ApiAdapter
 from src.adapters.batch.csv_adapter import CsvAdapter
+from src.adapters.batch.ftp_adapter import FtpAdapter
 from src.utils.logging import logger
+from src.utils.metrics import MetricsServer, metrics
 
 # Global flag for clean shutdown
 running = True
 
 def signal_handler(sig, frame):
-    """Handle termination signals."""
+    """Handle termination signals.
+    
+    Only stops the main loop; the cleanup in main() then closes the adapters
+    and drains the dispatcher so in-flight records are not dropped.
+    """
     global running
     logger.info("Shutting down gracefully...")
     running = False
     
-def main():
-    """Main entry point of the application."""
-    # Register signal handlers for graceful shutdown
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
-    logger.info("Starting Unified Data Ingestion System...")
-    
-    # Create necessary directories
-    for directory in ['output', 'input', 'logs', 'schemas']:
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-    
+def create_schema_registry():
+    """Create the configured schema registry, with the default schema registered."""
     # Initialize schema registry
-    schema_registry = SchemaRegistry(schema_dir='schemas')
+    if SCHEMA_REGISTRY['backend'] == 'remote':
+        from src.schema_registry.remote import RemoteSchemaRegistry
+        schema_registry = RemoteSchemaRegistry(
+            SCHEMA_REGISTRY['url'],
+            schema_dir='schemas',
+            cache_ttl=SCHEMA_REGISTRY['cache_ttl'],
+            negative_ttl=SCHEMA_REGISTRY['negative_ttl'],
+            timeout=SCHEMA_REGISTRY['timeout'],
+            error_backoff=SCHEMA_REGISTRY['error_backoff'],
+            compatibility=SCHEMA_REGISTRY['compatibility']
+        )
+    else:
+        schema_registry = SchemaRegistry(schema_dir='schemas', compatibility=SCHEMA_REGISTRY['compatibility'])
     
     # Add default schema if missing
     location_schema = {
@@ -56,28 +70,201 @@ def main():
     except ValueError:
         # Schema already exists, which is fine
         pass
+    return schema_registry
+    
+def create_dispatcher(schema_registry, admission=None, dead_letters=None):
+    """Create the configured dispatcher, output sink and consumers."""
+    # Initialize dispatcher with a buffered, rolling output sink
+    sink_options = dict(
+        segment_bytes=OUTPUT['segment_bytes'],
+        segment_seconds=OUTPUT['segment_seconds'],
+        flush_records=OUTPUT['flush_records'],
+        flush_interval=OUTPUT['flush_interval']
+    )
+    if OUTPUT['format'] == 'wire':
+        output_sink = WireFormatSink(schema_registry, OUTPUT['dir'], **sink_options)
+    else:
+        output_sink = JsonLinesSink(OUTPUT['dir'], **sink_options)
+    deduplicator = None
+    if DEDUP['enabled']:
+        if DEDUP['backend'] == 'bloom':
+            index_factory = lambda: RotatingBloomFilter(
+                window=DEDUP['window_seconds'], capacity=DEDUP['capacity'],
+                error_rate=DEDUP['error_rate'])
+        else:
+            index_factory = lambda: TimeWindowIndex(
+                window=DEDUP['window_seconds'], max_keys=DEDUP['max_keys'])
+        deduplicator = Deduplicator(DEDUP['keys'], index_factory)
+    
+    if DISPATCHER['mode'] == 'pipelined':
+        dispatcher = PipelinedDispatcher(
+            schema_registry,
+            output_dir=OUTPUT['dir'],
+            output_sink=output_sink,
+            queue_size=DISPATCHER['queue_size'],
+            validation_workers=DISPATCHER['validation_workers'],
+            consumer_queue_size=DISPATCHER['consumer_queue_size'],
+            deduplicator=deduplicator,
+            admission=admission,
+            dead_letters=dead_letters
+        )
+    else:
+        dispatcher = Dispatcher(schema_registry, output_dir=OUTPUT['dir'], output_sink=output_sink,
+                                deduplicator=deduplicator, admission=admission, dead_letters=dead_letters)
+    
+    # Register optional output consumers
+    if PARQUET['enabled']:
+        from src.output.parquet_writer import ParquetWriter
+        dispatcher.register_consumer(ParquetWriter(
+            schema_registry,
+            output_dir=PARQUET['dir'],
+            row_group_size=PARQUET['row_group_size'],
+            flush_interval=PARQUET['flush_interval'],
+            file_row_groups=PARQUET['file_row_groups'],
+            dictionary_fields=PARQUET['dictionary_fields']
+        ))
+    if DATABASE['enabled']:
+        from src.output.database_writer import DatabaseWriter
+        dispatcher.register_consumer(DatabaseWriter(
+            schema_registry,
+            path=DATABASE['path'],
+            batch_size=DATABASE['batch_size'],
+            flush_interval=DATABASE['flush_interval'],
+            latest_key=DATABASE['latest_key'],
+            latest_order=DATABASE['latest_order'],
+            dead_letters=dead_letters
+        ))
+    if GEO_AGGREGATION['enabled']:
+        from src.output.geo_aggregator import GeoAggregator
+        dispatcher.register_consumer(GeoAggregator(
+            sink=output_sink,
+            cell_degrees=GEO_AGGREGATION['cell_degrees'],
+            window_seconds=GEO_AGGREGATION['window_seconds'],
+            position_ttl=GEO_AGGREGATION['position_ttl']
+        ), schemas=GEO_AGGREGATION['schemas'])
+    return dispatcher
+    
+def main():
+    """Main entry point of the application."""
+    # Register signal handlers for graceful shutdown
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    
+    logger.info("Starting Unified Data Ingestion System...")
     
-    # Initialize dispatcher
-    dispatcher = Dispatcher(schema_registry, output_dir='output')
+    # Create necessary directories
+    for directory in ['output', 'input', 'logs', 'schemas']:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+    
+    # Expose metrics for scraping
+    metrics_server = None
+    if METRICS['enabled']:
+        metrics_server = MetricsServer(metrics, host=METRICS['host'], port=METRICS['port'])
+        metrics_server.start()
+    
+    schema_registry = create_schema_registry()
+    
+    if SCHEMA_REGISTRY['watch']:
+        schema_registry.watch(poll_interval=SCHEMA_REGISTRY['poll_interval'])
+    
+    admission = None
+    if ADMISSION['enabled']:
+        admission = AdmissionController(ADMISSION['sources'], default=ADMISSION['default'],
+                                        capacity=ADMISSION['capacity'])
+    
+    dead_letters = None
+    if DEAD_LETTERS['enabled']:
+        dead_letters = DeadLetterStore(
+            DEAD_LETTERS['dir'],
+            segment_bytes=DEAD_LETTERS['segment_bytes'],
+            retry_delay=DEAD_LETTERS['retry_delay'],
+            max_retries=DEAD_LETTERS['max_retries']
+        )
+    dispatcher = create_dispatcher(schema_registry, admission=admission, dead_letters=dead_letters)
     
     # Initialize adapters
-    kafka_adapter = KafkaAdapter(dispatcher)
-    api_adapter = ApiAdapter(dispatcher, interval=30)  # Fetch from API every 30 seconds
-    csv_adapter = CsvAdapter(dispatcher)
+    consumer = None
+    if MESSAGE_QUEUE['backend'] == 'memory':
+        from src.adapters.streaming.fake_broker import InMemoryBroker
+        consumer = InMemoryBroker().consumer(MESSAGE_QUEUE['topic'], MESSAGE_QUEUE['group_id'])
+    kafka_adapter = KafkaAdapter(
+        dispatcher,
+        topic=MESSAGE_QUEUE['topic'],
+        schema_id=MESSAGE_QUEUE['schema_id'],
+        max_poll_records=MESSAGE_QUEUE['max_poll_records'],
+        poll_timeout=MESSAGE_QUEUE['poll_timeout'],
+        group_id=MESSAGE_QUEUE['group_id'],
+        bootstrap_servers=MESSAGE_QUEUE['bootstrap_servers'],
+        consumer_config={
+            'fetch_min_bytes': MESSAGE_QUEUE['fetch_min_bytes'],
+            'fetch_max_wait_ms': MESSAGE_QUEUE['fetch_max_wait_ms'],
+            'max_partition_fetch_bytes': MESSAGE_QUEUE['max_partition_fetch_bytes']
+        },
+        partition_queue_size=MESSAGE_QUEUE['partition_queue_size'],
+        consumer=consumer,
+        value_format=MESSAGE_QUEUE['value_format']
+    )
+    api_settings = BATCH_SETTINGS['api']
+    api_adapter = ApiAdapter(
+        dispatcher,
+        endpoints=api_settings['endpoints'],
+        interval=api_settings['interval'],
+        timeout=api_settings['timeout'],
+        page_workers=api_settings['page_workers']
+    )
+    csv_settings = BATCH_SETTINGS['csv']
+    csv_adapter = CsvAdapter(
+        dispatcher,
+        input_dir=csv_settings['input_dir'],
+        batch_size=csv_settings['batch_size'],
+        workers=csv_settings['workers'],
+        chunk_bytes=csv_settings['chunk_bytes'],
+        vectorized=csv_settings['vectorized'],
+        checkpoint_rows=csv_settings['checkpoint_rows']
+    )
+    
+    ftp_adapter = None
+    ftp_settings = BATCH_SETTINGS['ftp']
+    if ftp_settings['enabled']:
+        ftp_adapter = FtpAdapter(
+            dispatcher,
+            ftp_settings['host'],
+            port=ftp_settings['port'],
+            username=ftp_settings['username'],
+            password=ftp_settings['password'],
+            directory=ftp_settings['directory'],
+            connections=ftp_settings['connections'],
+            batch_size=ftp_settings['batch_size'],
+            listing_cache=ftp_settings['listing_cache']
+        )
     
     # Start adapters
     try:
-        # Start streaming adapter
-        kafka_adapter.ingest()
-        logger.info("Kafka adapter started")
+        # Start streaming adapter; without a broker the batch adapters still run
+        try:
+            kafka_adapter.ingest()
+            logger.info("Kafka adapter started")
+        except Exception as e:
+            logger.error(f"Kafka adapter not started: {str(e)}")
         
         # Start API adapter
         api_adapter.ingest()
         logger.info("API adapter started")
         
-        # Process CSV files immediately
-        csv_adapter.ingest()
-        logger.info("CSV processing complete")
+        # Process CSV files, then keep watching for new ones if enabled
+        if csv_settings['watch']:
+            csv_adapter.watch(poll_interval=csv_settings['poll_interval'],
+                              settle_time=csv_settings['settle_time'])
+            logger.info("CSV adapter watching for new files")
+        else:
+            csv_adapter.ingest()
+            logger.info("CSV processing complete")
+        
+        # Ingest new files from the FTP server
+        if ftp_adapter:
+            ftp_adapter.ingest()
+            logger.info("FTP ingestion complete")
         
         # Keep the main thread running
         while running:
@@ -87,11 +274,20 @@ def main():
         logger.error(f"Error in main loop: {str(e)}")
     
     finally:
-        # Cleanup
+        # Cleanup: stop the adapters first, then drain the dispatcher
         kafka_adapter.close()
         api_adapter.close()
         csv_adapter.close()
+        if ftp_adapter:
+            ftp_adapter.close()
         logger.info("All adapters closed")
         
+        dispatcher.close()
+        logger.info("Dispatcher and consumers closed")
+        
+        schema_registry.close()
+        if metrics_server:
+            metrics_server.stop()
+        
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,321 @@
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from src.utils.logging import logger
+from src.utils.metrics import metrics
+
+_ROWS_WRITTEN = metrics.counter('output_database_rows_total',
+                                'Rows written to the database.', ('table',))
+_TRANSACTION_SECONDS = metrics.histogram('output_database_transaction_seconds',
+                                         'Time to write and commit one transaction.')
+
+# JSON schema type -> SQLite column type
+_SQL_TYPES = {
+    'number': 'REAL',
+    'integer': 'INTEGER',
+    'boolean': 'INTEGER',
+    'string': 'TEXT',
+}
+
+# Avro primitive type -> SQLite column type
+_AVRO_SQL_TYPES = {
+    'double': 'REAL',
+    'float': 'REAL',
+    'int': 'INTEGER',
+    'long': 'INTEGER',
+    'boolean': 'INTEGER',
+    'string': 'TEXT',
+    'bytes': 'BLOB',
+}
+
+# Sentinels on the writer queue
+_FLUSH = object()
+_STOP = object()
+
+class _Table:
+    """Insert statements and row conversion for one schema's table."""
+
+    def __init__(self, entry, name, columns, encoders, insert, upsert):
+        self.entry = entry        # Registry entry the layout was built from
+        self.name = name
+        self.columns = columns    # Record fields, in column order
+        self.encoders = encoders  # Column index -> encode function for nested values
+        self.insert = insert
+        self.upsert = upsert      # Statement keeping the latest row per key, or None
+
+    def rows(self, records, source_name):
+        columns = self.columns
+        if not self.encoders:
+            return [tuple(map(record.get, columns)) + (source_name,) for record in records]
+        encoders = self.encoders.items()
+        rows = []
+        for record in records:
+            row = list(map(record.get, columns))
+            for i, encode in encoders:
+                if row[i] is not None:
+                    row[i] = encode(row[i])
+            row.append(source_name)
+            rows.append(row)
+        return rows
+
+class DatabaseWriter:
+    """Consumer that writes validated records to SQLite, one table per schema.
+
+    Tables are created from the registered JSON or Avro schema, with one
+    column per field (nested values are stored as JSON text) plus
+    ``_source``; fields added by later schema versions become new columns.
+    Batches are queued for a dedicated writer thread, which owns the
+    connection and writes everything gathered so far with ``executemany``
+    in one transaction, once ``batch_size`` rows are waiting or
+    ``flush_interval`` seconds have passed. The database runs in WAL mode
+    so readers do not block the writer.
+
+    With ``latest_key`` set, a ``<table>_latest`` table also keeps the
+    newest row per key (by ``latest_order`` when the schema has that field),
+    for example the last known position of every vehicle.
+
+    Batches whose write fails are handed to ``dead_letters`` (a
+    ``DeadLetterStore``) for retry, as the dispatcher does for consumers that
+    raise; without one they are logged and dropped.
+    """
+
+    def __init__(self, schema_registry, path='output/ingest.db', batch_size=10000, flush_interval=1.0,
+                 queue_size=100, latest_key='vehicle_id', latest_order='timestamp',
+                 default_schema_id='location_v1', synchronous='NORMAL', dead_letters=None):
+        self.schema_registry = schema_registry
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.latest_key = latest_key
+        self.latest_order = latest_order
+        self.default_schema_id = default_schema_id
+        self.synchronous = synchronous  # WAL with NORMAL only syncs at checkpoints
+        self.dead_letters = dead_letters
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # Opened here so a bad path fails now; only the writer thread uses it afterwards
+        self._connection = self._connect()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._tables = {}  # schema_id -> _Table; used by the writer thread only
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name="database-writer", daemon=True)
+        self._writer.start()
+
+    def process(self, data):
+        """Queue a single record of the default schema."""
+        self.process_batch([data], None, self.default_schema_id)
+
+    def process_batch(self, records, source_name, schema_id):
+        """Queue a batch of validated records, blocking while the writer is behind."""
+        if self._closed:
+            raise RuntimeError("DatabaseWriter is closed.")
+        self._queue.put((list(records), source_name, schema_id or self.default_schema_id))
+
+    def flush(self):
+        """Write and commit everything queued so far."""
+        if self._closed:
+            raise RuntimeError("DatabaseWriter is closed.")
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        done.wait()
+
+    def close(self):
+        """Write everything queued, then close the database."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._writer.join()
+
+    def _run(self):
+        connection = self._connection
+        pending = {}  # schema_id -> [(records, source_name)]
+        rows = 0
+        deadline = None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                if item is not None and item is not _STOP and item[0] is not _FLUSH:
+                    records, source_name, schema_id = item
+                    pending.setdefault(schema_id, []).append((records, source_name))
+                    rows += len(records)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                    if rows < self.batch_size and time.monotonic() < deadline:
+                        continue
+                if pending:
+                    try:
+                        failed = self._write(connection, pending)
+                    except Exception as e:
+                        failed = {schema_id: (batches, str(e)) for schema_id, batches in pending.items()}
+                    if failed:
+                        self._undeliverable(failed)
+                    pending = {}
+                    rows = 0
+                    deadline = None
+                if item is _STOP:
+                    return
+                if item is not None and item[0] is _FLUSH:
+                    item[1].set()
+        finally:
+            connection.close()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(f'PRAGMA synchronous={self.synchronous}')
+        return connection
+
+    def _write(self, connection, pending):
+        """Write pending batches in one transaction.
+
+        Each schema is written under a savepoint, so a failing schema is
+        rolled back without leaving part of its rows in the transaction;
+        returns ``{schema_id: (batches, error)}`` of the rolled back ones.
+        """
+        started = time.perf_counter()
+        written = {}
+        failed = {}
+        connection.execute('BEGIN')
+        try:
+            for schema_id, batches in pending.items():
+                connection.execute('SAVEPOINT schema_batch')
+                try:
+                    table = self._table(connection, schema_id)
+                    rows = [row for records, source_name in batches
+                            for row in table.rows(records, source_name)]
+                    connection.executemany(table.insert, rows)
+                    if table.upsert:
+                        connection.executemany(table.upsert, rows)
+                except (sqlite3.Error, TypeError, ValueError) as e:
+                    logger.error(f"Error writing {schema_id} rows to {self.path}: {str(e)}")
+                    connection.execute('ROLLBACK TO schema_batch')
+                    connection.execute('RELEASE schema_batch')
+                    self._tables.pop(schema_id, None)
+                    failed[schema_id] = (batches, str(e))
+                    continue
+                connection.execute('RELEASE schema_batch')
+                written[table.name] = len(rows)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        _TRANSACTION_SECONDS.observe(time.perf_counter() - started)
+        for name, count in written.items():
+            _ROWS_WRITTEN.inc((name,), count)
+        logger.debug("Committed %d rows to %s", sum(written.values()), self.path)
+        return failed
+
+    def _undeliverable(self, failed):
+        """Hand batches that could not be written to the dead-letter store, or drop them."""
+        for schema_id, (batches, error) in failed.items():
+            for records, source_name in batches:
+                if self.dead_letters is None:
+                    logger.error(f"Dropped {len(records)} {schema_id} rows after a failed write "
+                                 f"to {self.path}: {error}")
+                    continue
+                try:
+                    self.dead_letters.undeliverable(records, self.__class__.__name__, source_name,
+                                                    schema_id, error)
+                except Exception as e:
+                    logger.error(f"Dropped {len(records)} {schema_id} rows: failed write to {self.path} "
+                                 f"({error}) could not be stored as dead letters: {str(e)}")
+
+    def _table(self, connection, schema_id):
+        """Create or extend the tables of a schema and return its statements."""
+        entry = self.schema_registry.get_schema(schema_id)
+        table = self._tables.get(schema_id)
+        if table is not None and table.entry is entry:
+            return table
+        if not entry:
+            raise ValueError(f"Schema {schema_id} not found.")
+
+        columns, encoders = self._columns(entry)
+        name = _identifier(schema_id)
+        names = [column for column, _ in columns]
+        self._ensure_table(connection, name, columns, key=None)
+
+        quoted = ', '.join(_quote(n) for n in names + ['_source'])
+        params = ', '.join('?' for _ in range(len(names) + 1))
+        insert = f'INSERT INTO {_quote(name)} ({quoted}) VALUES ({params})'
+        upsert = None
+        if self.latest_key and self.latest_key in names:
+            latest = f'{name}_latest'
+            self._ensure_table(connection, latest, columns, key=self.latest_key)
+            updates = ', '.join(f'{_quote(n)} = excluded.{_quote(n)}'
+                                for n in names + ['_source'] if n != self.latest_key)
+            upsert = (f'INSERT INTO {_quote(latest)} ({quoted}) VALUES ({params}) '
+                      f'ON CONFLICT({_quote(self.latest_key)}) DO UPDATE SET {updates}')
+            if self.latest_order and self.latest_order in names:
+                order = _quote(self.latest_order)
+                # Records arriving late do not overwrite newer ones
+                upsert += f' WHERE excluded.{order} >= {_quote(latest)}.{order}'
+
+        encoder_map = {names.index(column): encode for column, encode in encoders.items()}
+        table = self._tables[schema_id] = _Table(entry, name, names, encoder_map, insert, upsert)
+        return table
+
+    def _columns(self, entry):
+        """``([(column, SQL type)], {column: encoder})`` from a registry entry."""
+        if entry.get('type') == 'avro':
+            fields = [(field['name'], _avro_sql_type(field['type']))
+                      for field in entry['schema'].get('fields', [])]
+        else:
+            fields = [(name, _SQL_TYPES.get(_json_type(prop.get('type'))))
+                      for name, prop in entry.get('schema', {}).get('properties', {}).items()]
+
+        columns = []
+        encoders = {}
+        for name, sql_type in fields:
+            if sql_type is None:
+                # Nested or untyped values are kept as JSON text
+                sql_type = 'TEXT'
+                encoders[name] = json.dumps
+            columns.append((name, sql_type))
+        return columns, encoders
+
+    def _ensure_table(self, connection, name, columns, key):
+        existing = {row[1] for row in connection.execute(f'PRAGMA table_info({_quote(name)})')}
+        if not existing:
+            definitions = [f'{_quote(column)} {sql_type}' + (' PRIMARY KEY' if column == key else '')
+                           for column, sql_type in columns]
+            definitions.append('_source TEXT')
+            connection.execute(f'CREATE TABLE {_quote(name)} ({", ".join(definitions)})')
+            logger.info(f"Created table {name} in {self.path}")
+            return
+        # Fields added by a newer schema version become new, nullable columns
+        for column, sql_type in columns:
+            if column not in existing:
+                connection.execute(f'ALTER TABLE {_quote(name)} ADD COLUMN {_quote(column)} {sql_type}')
+                logger.info(f"Added column {column} to table {name} in {self.path}")
+
+def _identifier(name):
+    return re.sub(r'\W', '_', name)
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _json_type(json_type):
+    """The type of a nullable JSON ``[type, "null"]`` list, or the type itself."""
+    if isinstance(json_type, list):
+        types = [t for t in json_type if t != 'null']
+        json_type = types[0] if len(types) == 1 else None
+    return json_type if isinstance(json_type, str) else None
+
+def _avro_sql_type(avro_type):
+    """SQLite type of an Avro field, looking through nullable unions."""
+    if isinstance(avro_type, list):
+        types = [t for t in avro_type if t != 'null']
+        avro_type = types[0] if len(types) == 1 else None
+    return _AVRO_SQL_TYPES.get(avro_type) if isinstance(avro_type, str) else None
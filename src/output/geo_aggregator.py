@@ -0,0 +1,245 @@
+import math
+import threading
+import time
+from array import array
+from src.utils.logging import logger
+from src.utils.metrics import metrics
+
+_POINTS = metrics.counter('aggregation_geo_points_total',
+                          'Location records added to the live geospatial state.')
+_EXPIRED = metrics.counter('aggregation_geo_expired_total',
+                           'Vehicles dropped from the live geospatial state for going quiet.')
+
+EARTH_RADIUS_M = 6371008.8
+
+class GeoAggregator:
+    """Consumer keeping live positions of vehicles and rolling them up per time window.
+
+    The latest position of every vehicle is held in a table of parallel
+    arrays, one slot per vehicle, and each slot is filed under the grid cell
+    (``cell_degrees`` of latitude by longitude) it is in, so a bounding box
+    query only visits the cells it overlaps. Records older than a vehicle's
+    latest (by ``timestamp``) are counted but do not move it.
+
+    Every ``window_seconds`` (tumbling, aligned to the clock) the points
+    counted per cell and the distance each vehicle travelled are written to
+    the ``geo_cells`` and ``geo_distance`` streams of ``sink``, if given.
+    With ``position_ttl``, vehicles not heard from for that many seconds are
+    dropped when a window closes, so the table only holds live vehicles.
+    """
+
+    def __init__(self, sink=None, cell_degrees=0.01, window_seconds=60, clock=time.time,
+                 position_ttl=None):
+        if cell_degrees <= 0:
+            raise ValueError("cell_degrees must be positive")
+        self.sink = sink
+        self.cell_degrees = cell_degrees
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.position_ttl = position_ttl  # Seconds without records before a vehicle is dropped
+
+        self._lock = threading.Lock()
+        self._slots = {}  # vehicle_id -> slot
+        self._vehicle_ids = []
+        self._lat = array('d')
+        self._lng = array('d')
+        self._timestamps = []
+        self._seen = array('d')  # Slot -> clock time of its last record
+        self._cells = []  # Slot -> grid cell it is filed under
+        self._grid = {}  # (row, column) -> set of slots
+        self._window_start = self._window_floor(clock())
+        self._cell_counts = {}  # Cell -> points in the current window
+        self._distance = {}  # Slot -> [metres, points] in the current window
+
+        self._stop = threading.Event()
+        self._roller = threading.Thread(target=self._roll_loop, name="geo-rollup", daemon=True)
+        self._roller.start()
+
+        metrics.gauge('aggregation_geo_vehicles', 'Vehicles with a live position.',
+                      callback=lambda: len(self._vehicle_ids))
+
+    def process(self, data):
+        self.process_batch([data], None, None)
+
+    def process_batch(self, records, source_name, schema_id):
+        """Update positions, cell counts and distances from a batch of location records."""
+        added = 0
+        now = self.clock()
+        with self._lock:
+            slots = self._slots
+            lat_table, lng_table = self._lat, self._lng
+            for record in records:
+                vehicle_id = record.get('vehicle_id')
+                lat = record.get('lat')
+                lng = record.get('lng')
+                if vehicle_id is None or lat is None or lng is None:
+                    continue
+                cell = self._cell(lat, lng)
+                self._cell_counts[cell] = self._cell_counts.get(cell, 0) + 1
+                added += 1
+
+                timestamp = record.get('timestamp')
+                slot = slots.get(vehicle_id)
+                if slot is None:
+                    slot = slots[vehicle_id] = len(self._vehicle_ids)
+                    self._vehicle_ids.append(vehicle_id)
+                    lat_table.append(lat)
+                    lng_table.append(lng)
+                    self._timestamps.append(timestamp)
+                    self._seen.append(now)
+                    self._cells.append(cell)
+                    self._grid.setdefault(cell, set()).add(slot)
+                    self._distance[slot] = [0.0, 1]
+                    continue
+
+                self._seen[slot] = now
+                latest = self._timestamps[slot]
+                if timestamp is not None and latest is not None and timestamp < latest:
+                    continue  # Late record; the vehicle has moved on since
+                travelled = self._distance.setdefault(slot, [0.0, 0])
+                travelled[0] += haversine(lat_table[slot], lng_table[slot], lat, lng)
+                travelled[1] += 1
+                lat_table[slot] = lat
+                lng_table[slot] = lng
+                self._timestamps[slot] = timestamp
+                if cell != self._cells[slot]:
+                    self._move(slot, cell)
+        _POINTS.inc(amount=added)
+
+    def position(self, vehicle_id):
+        """The latest position of a vehicle, or None if it has not been seen."""
+        with self._lock:
+            slot = self._slots.get(vehicle_id)
+            return None if slot is None else self._position(slot)
+
+    def within(self, min_lat, min_lng, max_lat, max_lng):
+        """Latest positions inside a bounding box; boxes may cross the antimeridian (min_lng > max_lng)."""
+        if min_lng > max_lng:
+            return self.within(min_lat, min_lng, max_lat, 180.0) + self.within(min_lat, -180.0, max_lat, max_lng)
+        min_row, min_col = self._cell(min_lat, min_lng)
+        max_row, max_col = self._cell(max_lat, max_lng)
+        with self._lock:
+            grid = self._grid
+            if (max_row - min_row + 1) * (max_col - min_col + 1) <= len(grid):
+                cells = (grid.get((row, col)) for row in range(min_row, max_row + 1)
+                         for col in range(min_col, max_col + 1))
+            else:
+                # A box larger than the occupied area: visit the occupied cells instead
+                cells = (slots for (row, col), slots in grid.items()
+                         if min_row <= row <= max_row and min_col <= col <= max_col)
+            lat_table, lng_table = self._lat, self._lng
+            return [self._position(slot) for slots in cells if slots for slot in slots
+                    if min_lat <= lat_table[slot] <= max_lat and min_lng <= lng_table[slot] <= max_lng]
+
+    def cell_counts(self):
+        """Points counted per cell so far in the current window, keyed by the cell's south-west corner."""
+        with self._lock:
+            return {self._corner(cell): count for cell, count in self._cell_counts.items()}
+
+    def roll(self, now=None):
+        """Close the current window if it has ended and write its rollups; returns them, or None."""
+        now = self.clock() if now is None else now
+        with self._lock:
+            if now < self._window_start + self.window_seconds:
+                return None
+            start = self._window_start
+            end = start + self.window_seconds
+            cells, self._cell_counts = self._cell_counts, {}
+            distance, self._distance = self._distance, {}
+            self._window_start = self._window_floor(now)
+            vehicle_ids = self._vehicle_ids
+
+            window = {'window_start': _iso(start), 'window_end': _iso(end)}
+            cell_rows = []
+            for cell, count in cells.items():
+                lat, lng = self._corner(cell)
+                cell_rows.append(dict(window, lat=lat, lng=lng, cell_degrees=self.cell_degrees, count=count))
+            distance_rows = [dict(window, vehicle_id=vehicle_ids[slot], distance_m=round(metres, 1), points=points)
+                             for slot, (metres, points) in distance.items()]
+            if self.position_ttl is not None:
+                self._expire(now - self.position_ttl)
+        if self.sink is not None:
+            if cell_rows:
+                self.sink.write('geo_cells', cell_rows)
+            if distance_rows:
+                self.sink.write('geo_distance', distance_rows)
+        return cell_rows, distance_rows
+
+    def close(self):
+        """Stop rolling up windows and write the current, partial one."""
+        self._stop.set()
+        self._roller.join()
+        self.roll(now=self._window_start + self.window_seconds)
+
+    def _position(self, slot):
+        return {
+            'vehicle_id': self._vehicle_ids[slot],
+            'lat': self._lat[slot],
+            'lng': self._lng[slot],
+            'timestamp': self._timestamps[slot]
+        }
+
+    def _cell(self, lat, lng):
+        size = self.cell_degrees
+        return math.floor(lat / size), math.floor(lng / size)
+
+    def _corner(self, cell):
+        return round(cell[0] * self.cell_degrees, 9), round(cell[1] * self.cell_degrees, 9)
+
+    def _move(self, slot, cell):
+        """File a slot under a new cell. Caller holds the lock."""
+        self._unfile(slot, self._cells[slot])
+        self._grid.setdefault(cell, set()).add(slot)
+        self._cells[slot] = cell
+
+    def _expire(self, cutoff):
+        """Drop vehicles last seen before cutoff. Caller holds the lock.
+
+        The last slot is moved into each freed one, so the table stays dense.
+        The window's distances must already be written, as slots change.
+        """
+        seen = self._seen
+        expired = [slot for slot in range(len(seen)) if seen[slot] < cutoff]
+        # From the top down, the last slot is never one still waiting to be dropped
+        for slot in reversed(expired):
+            self._unfile(slot, self._cells[slot])
+            del self._slots[self._vehicle_ids[slot]]
+            last = len(self._vehicle_ids) - 1
+            if slot != last:
+                cell = self._cells[last]
+                self._unfile(last, cell)
+                self._grid.setdefault(cell, set()).add(slot)
+                self._slots[self._vehicle_ids[last]] = slot
+                for table in (self._vehicle_ids, self._lat, self._lng, self._timestamps, seen, self._cells):
+                    table[slot] = table[last]
+            for table in (self._vehicle_ids, self._lat, self._lng, self._timestamps, seen, self._cells):
+                table.pop()
+        if expired:
+            _EXPIRED.inc(amount=len(expired))
+
+    def _unfile(self, slot, cell):
+        slots = self._grid[cell]
+        slots.discard(slot)
+        if not slots:
+            del self._grid[cell]
+
+    def _window_floor(self, now):
+        return now - now % self.window_seconds
+
+    def _roll_loop(self):
+        while not self._stop.wait(max(0.01, self._window_start + self.window_seconds - self.clock())):
+            try:
+                self.roll()
+            except Exception as e:
+                logger.error(f"Error writing geospatial rollups: {str(e)}")
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Great-circle distance in metres between two points in degrees."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+def _iso(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
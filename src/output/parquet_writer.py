@@ -0,0 +1,243 @@
+import json
+import os
+import threading
+import time
+from src.utils.logging import logger
+from src.utils.metrics import metrics
+
+_BYTES_WRITTEN = metrics.counter('output_bytes_written_total',
+                                 'Bytes written to output files.', ('format', 'stream'))
+
+# JSON schema type -> Arrow type name, resolved lazily once pyarrow is imported
+_ARROW_TYPES = {
+    'number': 'float64',
+    'integer': 'int64',
+    'boolean': 'bool_',
+    'string': 'string',
+}
+
+# Avro primitive type -> Arrow type name
+_AVRO_ARROW_TYPES = {
+    'double': 'float64',
+    'float': 'float64',
+    'int': 'int64',
+    'long': 'int64',
+    'boolean': 'bool_',
+    'string': 'string',
+}
+
+class _ColumnBuffer:
+    """Column-oriented buffer of records for a single schema."""
+
+    def __init__(self, arrow_schema):
+        self.arrow_schema = arrow_schema
+        self.columns = {name: [] for name in arrow_schema.names}
+        self.rows = 0
+        self.created_at = time.time()
+
+    def append(self, records, encoders):
+        for name, values in self.columns.items():
+            encode = encoders.get(name)
+            if encode is None:
+                values.extend(record.get(name) for record in records)
+            else:
+                values.extend(encode(record.get(name)) for record in records)
+        self.rows += len(records)
+
+class _ParquetFile:
+    """A Parquet file being written under a temporary name."""
+
+    def __init__(self, writer, final_path, arrow_schema):
+        self.writer = writer
+        self.final_path = final_path
+        self.tmp_path = final_path + '.tmp'
+        self.arrow_schema = arrow_schema
+        self.row_groups = 0
+
+class ParquetWriter:
+    """Consumer that writes validated records to Parquet, one directory per schema.
+
+    Records are gathered into typed column buffers and written as a row group
+    once ``row_group_size`` rows are buffered or ``flush_interval`` seconds have
+    passed. Each file holds up to ``file_row_groups`` row groups and is written
+    under a ``.tmp`` name, then renamed when it is closed.
+    """
+
+    def __init__(self, schema_registry, output_dir='output/parquet', row_group_size=100000,
+                 flush_interval=60, file_row_groups=10, dictionary_fields=('vehicle_id',),
+                 default_schema_id='location_v1', compression='snappy'):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("ParquetWriter requires pyarrow: pip install pyarrow")
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+
+        self.schema_registry = schema_registry
+        self.output_dir = output_dir
+        self.row_group_size = row_group_size
+        self.flush_interval = flush_interval
+        self.file_row_groups = file_row_groups
+        self.dictionary_fields = set(dictionary_fields)
+        self.default_schema_id = default_schema_id
+        self.compression = compression
+
+        self._lock = threading.Lock()
+        self._buffers = {}  # schema_id -> _ColumnBuffer
+        self._files = {}    # schema_id -> _ParquetFile
+        self._encoders = {} # schema_id -> {column: encode function}
+        self._sequence = 0
+        self._closed = threading.Event()
+
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def process(self, data):
+        """Buffer a single record of the default schema."""
+        self.process_batch([data], None, self.default_schema_id)
+
+    def process_batch(self, records, source_name, schema_id):
+        """Buffer a batch of validated records, writing a row group when full."""
+        schema_id = schema_id or self.default_schema_id
+        with self._lock:
+            buffer = self._buffers.get(schema_id)
+            if buffer is None:
+                buffer = self._buffers[schema_id] = _ColumnBuffer(self._arrow_schema(schema_id))
+            buffer.append(records, self._encoders[schema_id])
+            if buffer.rows >= self.row_group_size:
+                self._write_row_group(schema_id)
+
+    def flush(self):
+        """Write row groups for buffers older than the flush interval."""
+        with self._lock:
+            now = time.time()
+            for schema_id, buffer in list(self._buffers.items()):
+                if now - buffer.created_at >= self.flush_interval:
+                    self._write_row_group(schema_id)
+
+    def close(self):
+        """Write all buffered rows and finish every open Parquet file."""
+        self._closed.set()
+        with self._lock:
+            for schema_id in list(self._buffers):
+                self._write_row_group(schema_id)
+            for schema_id in list(self._files):
+                self._close_file(schema_id)
+
+    def _flush_periodically(self):
+        while not self._closed.wait(min(self.flush_interval, 1.0)):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing Parquet writer: {str(e)}")
+
+    def _arrow_schema(self, schema_id):
+        """Build the Arrow schema (and per-column encoders) from the registered JSON or Avro schema."""
+        entry = self.schema_registry.get_schema(schema_id)
+        if not entry:
+            raise ValueError(f"Schema {schema_id} not found.")
+        if entry.get('type') == 'avro':
+            columns = [(field['name'], _AVRO_ARROW_TYPES.get(_non_null(field['type'])))
+                       for field in entry['schema'].get('fields', [])]
+        else:
+            columns = [(name, _ARROW_TYPES.get(_non_null(prop.get('type'))))
+                       for name, prop in entry.get('schema', {}).get('properties', {}).items()]
+
+        fields = []
+        encoders = {}
+        for name, type_name in columns:
+            if type_name:
+                arrow_type = getattr(self._pa, type_name)()
+            else:
+                # Nested or untyped values are kept as JSON text
+                arrow_type = self._pa.string()
+                encoders[name] = lambda v: None if v is None else json.dumps(v)
+            if name in self.dictionary_fields and arrow_type == self._pa.string():
+                arrow_type = self._pa.dictionary(self._pa.int32(), self._pa.string())
+            fields.append(self._pa.field(name, arrow_type))
+
+        self._encoders[schema_id] = encoders
+        return self._pa.schema(fields)
+
+    def _write_row_group(self, schema_id):
+        """Write a schema's buffer as one row group. Caller holds the lock."""
+        buffer = self._buffers.get(schema_id)
+        if buffer is None or not buffer.rows:
+            self._buffers.pop(schema_id, None)
+            return
+
+        try:
+            table = self._table(buffer.arrow_schema, buffer.columns)
+        except (TypeError, ValueError, OverflowError):
+            table = self._table(buffer.arrow_schema, self._convertible_rows(schema_id, buffer))
+        del self._buffers[schema_id]
+
+        # A large batch can overshoot the threshold; split it into full-size row groups
+        for offset in range(0, table.num_rows, self.row_group_size):
+            self._write_table(schema_id, table.slice(offset, self.row_group_size))
+
+    def _table(self, arrow_schema, columns):
+        arrays = [self._pa.array(columns[field.name], type=field.type) for field in arrow_schema]
+        return self._pa.Table.from_arrays(arrays, schema=arrow_schema)
+
+    def _convertible_rows(self, schema_id, buffer):
+        """The buffer's columns without the rows holding a value of the wrong type, which are logged and dropped."""
+        bad = set()
+        for field in buffer.arrow_schema:
+            for row, value in enumerate(buffer.columns[field.name]):
+                if row in bad:
+                    continue
+                try:
+                    self._pa.array([value], type=field.type)
+                except (TypeError, ValueError, OverflowError):
+                    bad.add(row)
+        logger.error(f"Dropped {len(bad)} of {buffer.rows} {schema_id} rows with values "
+                     f"that do not fit the Parquet schema")
+        return {name: [value for row, value in enumerate(values) if row not in bad]
+                for name, values in buffer.columns.items()}
+
+    def _write_table(self, schema_id, table):
+        """Append a table as one row group, rolling the file when it is full."""
+        open_file = self._files.get(schema_id)
+        if open_file is not None and not open_file.arrow_schema.equals(table.schema):
+            # The registered schema changed; start a new file for the new layout
+            self._close_file(schema_id)
+            open_file = None
+        if open_file is None:
+            open_file = self._files[schema_id] = self._open_file(schema_id, table.schema)
+
+        open_file.writer.write_table(table, row_group_size=table.num_rows)
+        open_file.row_groups += 1
+        logger.info(f"Wrote row group of {table.num_rows} {schema_id} rows to {open_file.tmp_path}")
+
+        if open_file.row_groups >= self.file_row_groups:
+            self._close_file(schema_id)
+
+    def _open_file(self, schema_id, arrow_schema):
+        directory = os.path.join(self.output_dir, schema_id)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._sequence += 1
+        name = (f"part-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}"
+                f"-{os.getpid()}-{self._sequence:06d}.parquet")
+        final_path = os.path.join(directory, name)
+        writer = self._pq.ParquetWriter(final_path + '.tmp', arrow_schema,
+                                        compression=self.compression)
+        return _ParquetFile(writer, final_path, arrow_schema)
+
+    def _close_file(self, schema_id):
+        parquet_file = self._files.pop(schema_id)
+        parquet_file.writer.close()
+        os.rename(parquet_file.tmp_path, parquet_file.final_path)
+        _BYTES_WRITTEN.inc(('parquet', schema_id), os.path.getsize(parquet_file.final_path))
+        logger.info(f"Closed Parquet file {parquet_file.final_path} "
+                    f"({parquet_file.row_groups} row groups)")
+
+def _non_null(type_name):
+    """The type of a nullable Avro ``["null", type]`` union or JSON ``[type, "null"]`` list, or the type itself."""
+    if isinstance(type_name, list):
+        types = [t for t in type_name if t != 'null']
+        return types[0] if len(types) == 1 else None
+    return type_name if isinstance(type_name, str) else None
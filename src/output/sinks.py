@@ -0,0 +1,262 @@
+import json
+import os
+import struct
+import threading
+import time
+from src.utils.logging import logger
+from src.utils.metrics import metrics
+
+_BYTES_WRITTEN = metrics.counter('output_bytes_written_total',
+                                 'Bytes written to output files.', ('format', 'stream'))
+
+class OutputSink:
+    """Base class for dispatcher output sinks."""
+
+    def write(self, stream, records, schema_id=None):
+        """Write a list of records to the named stream.
+
+        ``schema_id`` names the schema the records were validated against, or
+        is None for records without one (e.g. rejected records).
+        """
+        raise NotImplementedError("Write method must be implemented by subclasses.")
+
+    def flush(self):
+        """Push buffered records to storage."""
+        pass
+
+    def close(self):
+        """Flush and release any open files."""
+        pass
+
+# Open paths of the segments this process is writing, across all sinks
+_open_paths = set()
+
+class _Segment:
+    """An open, not yet published segment file of one stream."""
+
+    def __init__(self, final_path):
+        self.final_path = final_path
+        self.open_path = final_path + '.open'
+        self.file = open(self.open_path, 'ab')
+        _open_paths.add(self.open_path)
+        self.created_at = time.time()
+        self.size = 0
+
+class JsonLinesSink(OutputSink):
+    """Append newline-delimited JSON to rolling per-stream segment files.
+
+    Records are buffered in memory and appended to ``<stream>_<time>_<pid>_<seq>.jsonl.open``.
+    A segment is fsynced and renamed to its final ``.jsonl`` name when it rolls
+    over, so readers only ever see complete segments.
+    """
+
+    suffix = '.jsonl'
+
+    def __init__(self, output_dir, segment_bytes=64 * 1024 * 1024, segment_seconds=300,
+                 flush_records=1000, flush_interval=1.0):
+        self.output_dir = output_dir
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._buffers = {}   # stream -> list of encoded records
+        self._segments = {}  # stream -> _Segment
+        self._sequence = 0
+        self._closed = threading.Event()
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        self._recover()
+
+        # Background flusher so quiet streams still reach disk and roll on time
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def _encode(self, record):
+        """Serialize one record to bytes, including the record separator."""
+        return json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+
+    def write(self, stream, records, schema_id=None):
+        """Buffer records for a stream, flushing when the batch size is reached."""
+        self._append(stream, [self._encode(record) for record in records])
+
+    def _append(self, stream, encoded):
+        """Buffer already encoded records for a stream."""
+        with self._lock:
+            if self._closed.is_set():
+                raise RuntimeError(f"{self.__class__.__name__} is closed.")
+            buffer = self._buffers.setdefault(stream, [])
+            buffer.extend(encoded)
+            if len(buffer) >= self.flush_records:
+                self._flush_stream(stream)
+
+    def flush(self):
+        """Write all buffered records and roll segments that are due."""
+        with self._lock:
+            for stream in list(self._buffers):
+                self._flush_stream(stream)
+            now = time.time()
+            for stream, segment in list(self._segments.items()):
+                if now - segment.created_at >= self.segment_seconds:
+                    self._roll(stream)
+
+    def close(self):
+        """Flush everything and publish all open segments."""
+        self._closed.set()
+        with self._lock:
+            for stream in list(self._buffers):
+                self._flush_stream(stream)
+            for stream in list(self._segments):
+                self._roll(stream)
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing output sink: {str(e)}")
+
+    def _flush_stream(self, stream):
+        """Append a stream's buffer to its segment. Caller holds the lock."""
+        buffer = self._buffers.pop(stream, None)
+        if not buffer:
+            return
+
+        segment = self._segments.get(stream)
+        if segment is None:
+            segment = self._segments[stream] = self._open_segment(stream)
+
+        data = b''.join(buffer)
+        segment.file.write(data)
+        segment.file.flush()
+        segment.size += len(data)
+        _BYTES_WRITTEN.inc((self.suffix[1:], stream), len(data))
+
+        if segment.size >= self.segment_bytes \
+                or time.time() - segment.created_at >= self.segment_seconds:
+            self._roll(stream)
+
+    def _open_segment(self, stream):
+        self._sequence += 1
+        name = (f"{stream}_{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}"
+                f"_{os.getpid()}_{self._sequence:06d}{self.suffix}")
+        return _Segment(os.path.join(self.output_dir, name))
+
+    def _roll(self, stream):
+        """Fsync and atomically publish a stream's segment. Caller holds the lock."""
+        segment = self._segments.pop(stream, None)
+        if segment is None:
+            return
+
+        segment.file.flush()
+        os.fsync(segment.file.fileno())
+        segment.file.close()
+        os.rename(segment.open_path, segment.final_path)
+        _open_paths.discard(segment.open_path)
+        logger.info(f"Published segment {segment.final_path} ({segment.size} bytes)")
+
+    def _recover(self):
+        """Publish segments left open by a previous run, dropping any torn last record.
+
+        Segments of processes that are still running, such as an ingestion
+        process sharing the directory with a replay, are left to them.
+        """
+        for filename in os.listdir(self.output_dir):
+            if not filename.endswith(self.suffix + '.open'):
+                continue
+            if _writer_alive(os.path.join(self.output_dir, filename)):
+                continue
+            open_path = os.path.join(self.output_dir, filename)
+            self._truncate_partial_record(open_path)
+            os.rename(open_path, open_path[:-len('.open')])
+            logger.warning(f"Recovered unfinished segment {open_path}")
+
+    def _truncate_partial_record(self, path):
+        with open(path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end != len(data):
+                f.truncate(end)
+
+def _writer_alive(open_path):
+    """Whether the process that named a segment ``<stream>_<time>_<pid>_<seq>`` still writes it."""
+    try:
+        pid = int(os.path.basename(open_path).rsplit('_', 2)[1])
+    except (IndexError, ValueError):
+        return False
+    if pid == os.getpid():
+        # Left by an earlier run that had the same pid, unless a sink here has it open
+        return open_path in _open_paths
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Running, under another user
+    return True
+
+_LENGTH = struct.Struct('>I')
+
+class WireFormatSink(JsonLinesSink):
+    """Rolling segments of binary Avro records in the schema-id-prefixed wire format.
+
+    Each record is stored as its 4-byte big-endian length followed by the
+    wire-format payload from ``AvroCodec``, so segments can be read back
+    record by record with ``read_wire_segment``. Records without an Avro
+    schema, such as the rejected streams, go to JSON Lines segments in the
+    same directory.
+    """
+
+    suffix = '.wire'
+
+    def __init__(self, schema_registry, output_dir, **options):
+        from src.schema_registry.wire_format import AvroCodec
+        self.codec = AvroCodec(schema_registry)
+        self.schema_registry = schema_registry
+        self.json_sink = JsonLinesSink(output_dir, **options)
+        super().__init__(output_dir, **options)
+
+    def write(self, stream, records, schema_id=None):
+        entry = self.schema_registry.get_schema(schema_id) if schema_id else None
+        if not entry or entry.get('type') != 'avro':
+            self.json_sink.write(stream, records, schema_id)
+            return
+        payloads, rejected = self.codec.encode_batch(records, schema_id)
+        if rejected:
+            logger.error(f"Could not encode {len(rejected)} records of {stream} as {schema_id}, "
+                         f"writing them as JSON: {rejected[0][1]}")
+            self.json_sink.write(stream, [record for record, _ in rejected], schema_id)
+        self._append(stream, [_LENGTH.pack(len(payload)) + payload for payload in payloads])
+
+    def flush(self):
+        super().flush()
+        self.json_sink.flush()
+
+    def close(self):
+        super().close()
+        self.json_sink.close()
+
+    def _truncate_partial_record(self, path):
+        with open(path, 'rb+') as f:
+            data = f.read()
+            end = 0
+            while end + _LENGTH.size <= len(data):
+                size = _LENGTH.unpack_from(data, end)[0]
+                if end + _LENGTH.size + size > len(data):
+                    break
+                end += _LENGTH.size + size
+            if end != len(data):
+                f.truncate(end)
+
+def read_wire_segment(path):
+    """Yield the wire-format payloads stored in a ``WireFormatSink`` segment."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + _LENGTH.size <= len(data):
+        size = _LENGTH.unpack_from(data, offset)[0]
+        offset += _LENGTH.size
+        yield data[offset:offset + size]
+        offset += size
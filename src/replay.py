@@ -0,0 +1,77 @@
+"""Replay a dead-letter queue through the dispatcher.
+
+Rejected and spilled batches are validated and routed again, for example
+after a schema fix; failed batches are handed to the consumer that could
+not process them. The queue is replayed up to where it ended when the run
+started, and the position reached is kept in a ``replay-<queue>`` cursor, so
+an interrupted replay continues where it stopped; the running ingestion
+deletes what lies behind the cursor. A failed batch that fails again stops
+the replay in front of it, so it is retried by the next run. Run from the
+repository root, with the ingestion settings of ``src.config.settings``:
+
+    python -m src.replay --queue rejected
+"""
+import argparse
+from src.config.settings import DEAD_LETTERS
+from src.dispatcher.dead_letter import REPLAYABLE_QUEUES, DeadLetterStore
+from src.utils.logging import logger
+
+def replay(store, queue_name, dispatcher, from_start=False, commit_every=100):
+    """Replay one queue of ``store``; returns ``(records replayed, records failed)``.
+
+    The store is normally open read-only, as the running ingestion appends
+    to it, so records that fail again cannot be written back: the replay
+    stops at their batch and leaves the cursor in front of it.
+    """
+    queue = store.queue(queue_name)
+    cursor_name = f'replay-{queue_name}'
+    start = queue.start_offset if from_start else queue.committed(cursor_name)
+    end = queue.end_offset
+    replayed = failed = 0
+    cursor = start
+    for offset, entry in store.entries(queue_name, start, end):
+        records = entry['records']
+        if queue_name == 'failed':
+            failed_records, error = dispatcher.redeliver(entry['consumer'], records, entry['source'],
+                                                         entry['schema_id'])
+            replayed += len(records) - len(failed_records)
+            if failed_records:
+                logger.error(f"Replay of {len(failed_records)} records to {entry['consumer']} "
+                             f"failed again, stopping at offset {offset}: {error}")
+                failed += len(failed_records)
+                break
+        else:
+            # Records rejected again go back to the rejected stream as usual
+            dispatcher.receive_batch(records, entry['source'], entry['schema_id'])
+            replayed += len(records)
+        cursor = offset + 1
+        if (cursor - start) % commit_every == 0:
+            queue.commit(cursor_name, cursor)
+    if cursor > start:
+        queue.commit(cursor_name, cursor)
+    return replayed, failed
+
+def main():
+    from src.main import create_dispatcher, create_schema_registry
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queue", choices=REPLAYABLE_QUEUES, required=True)
+    parser.add_argument("--dir", default=DEAD_LETTERS['dir'], help="Dead-letter store directory")
+    parser.add_argument("--from-start", action="store_true",
+                        help="Replay the whole queue instead of continuing from the last replay")
+    args = parser.parse_args()
+
+    store = DeadLetterStore(args.dir, readonly=True)
+    schema_registry = create_schema_registry()
+    dispatcher = create_dispatcher(schema_registry)
+    try:
+        replayed, failed = replay(store, args.queue, dispatcher, from_start=args.from_start)
+    finally:
+        dispatcher.close()
+        schema_registry.close()
+        store.close()
+    print(f"Replayed {replayed} records from {args.queue}, {failed} failed"
+          + (" (stopped at the batch that failed)" if failed else ""))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Compatibility checks and record projections between versions of a schema.
+
+Both JSON Schema and Avro entries are reduced to the same field model (name,
+accepted types, required, default, aliases), so one set of rules covers
+both. Only flat fields are compared: nested types must stay identical.
+"""
+import copy
+import json
+
+_MISSING = object()
+
+# Writer type -> reader types that can hold its values unchanged
+_PROMOTIONS = {
+    'integer': {'number'},
+    'int': {'long', 'float', 'double'},
+    'long': {'float', 'double'},
+    'float': {'double'},
+    'string': {'bytes'},
+    'bytes': {'string'},
+}
+
+_AVRO_PRIMITIVES = {'null', 'boolean', 'int', 'long', 'float', 'double', 'bytes', 'string'}
+
+COMPATIBILITY_MODES = ('none', 'backward', 'forward', 'full')
+
+class Field:
+    __slots__ = ('name', 'types', 'required', 'default', 'aliases')
+
+    def __init__(self, name, types, required, default=_MISSING, aliases=()):
+        self.name = name
+        self.types = types  # Set of type names, or None for any type
+        self.required = required
+        self.default = default
+        self.aliases = tuple(aliases)
+
+    @property
+    def has_default(self):
+        return self.default is not _MISSING
+
+def schema_fields(entry):
+    """Return ``{name: Field}`` for a registry entry."""
+    schema = entry.get('schema', {})
+    fields = {}
+    if entry.get('type') == 'avro':
+        # Avro records always carry every field; defaults only apply when reading
+        for field in schema.get('fields', []):
+            fields[field['name']] = Field(
+                field['name'], _avro_types(field['type']), True,
+                field.get('default', _MISSING), field.get('aliases', ()))
+    else:
+        required = set(schema.get('required', []))
+        for name, prop in schema.get('properties', {}).items():
+            types = prop.get('type')
+            fields[name] = Field(
+                name, None if types is None else set([types] if isinstance(types, str) else types),
+                name in required, prop.get('default', _MISSING), prop.get('aliases', ()))
+    return fields
+
+def _avro_types(avro_type):
+    if isinstance(avro_type, list):
+        types = set()
+        for t in avro_type:
+            types |= _avro_types(t)
+        return types
+    if isinstance(avro_type, dict):
+        if avro_type.get('type') in _AVRO_PRIMITIVES:
+            return {avro_type['type']}
+        # Named and nested types only match themselves
+        return {json.dumps(avro_type, sort_keys=True)}
+    return {avro_type}
+
+def _readable(reader_types, writer_types):
+    if reader_types is None:
+        return True
+    if writer_types is None:
+        return False
+    return all(t in reader_types or reader_types & _PROMOTIONS.get(t, set()) for t in writer_types)
+
+def _source_field(reader_field, writer_fields):
+    """The writer field a reader field is read from, following aliases."""
+    for name in (reader_field.name,) + reader_field.aliases:
+        if name in writer_fields:
+            return writer_fields[name]
+    return None
+
+def read_problems(reader_entry, writer_entry):
+    """Why records written with ``writer_entry`` cannot be read as ``reader_entry``.
+
+    Returns a list of messages; an empty list means every valid writer record
+    can be projected to a valid reader record.
+    """
+    writer_fields = schema_fields(writer_entry)
+    problems = []
+    for field in schema_fields(reader_entry).values():
+        source = _source_field(field, writer_fields)
+        if source is None:
+            if field.required and not field.has_default:
+                problems.append(f"Field {field.name!r} is required but missing from "
+                                f"version {writer_entry.get('version')} and has no default")
+            continue
+        if not _readable(field.types, source.types):
+            problems.append(f"Field {field.name!r} cannot be read as {sorted(field.types)} "
+                            f"from {sorted(source.types or ['any'])}")
+        if field.required and not source.required and not field.has_default:
+            problems.append(f"Field {field.name!r} is required but optional in "
+                            f"version {writer_entry.get('version')}")
+    return problems
+
+def compatibility_problems(new_entry, old_entry, mode):
+    """Check a new version against the previous one.
+
+    ``backward``: readers on the new version can read records of the old one.
+    ``forward``: readers on the old version can read records of the new one.
+    ``full``: both.
+    """
+    if mode not in COMPATIBILITY_MODES:
+        raise ValueError(f"Unknown compatibility mode {mode!r}; expected one of {COMPATIBILITY_MODES}")
+    problems = []
+    if mode in ('backward', 'full'):
+        problems.extend(f"backward: {p}" for p in read_problems(new_entry, old_entry))
+    if mode in ('forward', 'full'):
+        problems.extend(f"forward: {p}" for p in read_problems(old_entry, new_entry))
+    return problems
+
+def compile_projection(writer_entry, reader_entry):
+    """Generate a ``project(record) -> record`` function from one version to another.
+
+    The generated code copies each reader field from its writer field (or
+    alias), fills in defaults for fields the writer does not have, and drops
+    fields the reader does not know. Values are not converted, since every
+    allowed type promotion already holds in Python.
+    """
+    writer_fields = schema_fields(writer_entry)
+    namespace = {'_missing': _MISSING, '_deepcopy': copy.deepcopy}
+    always = []  # dict literal entries
+    optional = []  # statements adding fields only present in some records
+    for n, field in enumerate(schema_fields(reader_entry).values()):
+        source = _source_field(field, writer_fields)
+        default = None
+        if field.has_default:
+            if isinstance(field.default, (str, int, float, bool, type(None))):
+                default = repr(field.default)
+            else:
+                namespace[f'_default{n}'] = field.default
+                default = f'_deepcopy(_default{n})'
+        if source is None:
+            if default is not None:
+                always.append(f'{field.name!r}: {default}')
+        elif source.required:
+            always.append(f'{field.name!r}: data[{source.name!r}]')
+        elif default is not None:
+            optional.append(f'    v = data.get({source.name!r}, _missing)')
+            optional.append(f'    out[{field.name!r}] = {default} if v is _missing else v')
+        else:
+            optional.append(f'    v = data.get({source.name!r}, _missing)')
+            optional.append('    if v is not _missing:')
+            optional.append(f'        out[{field.name!r}] = v')
+
+    lines = ['def project(data):', '    out = {' + ', '.join(always) + '}']
+    lines.extend(optional)
+    lines.append('    return out')
+    exec(compile('\n'.join(lines), '<schema projection>', 'exec'), namespace)
+    return namespace['project']
@@ -1,49 +1,364 @@
 import json
 import os
-from jsonschema import validate, ValidationError
+import threading
+from src.schema_registry.evolution import compatibility_problems, compile_projection
+from src.schema_registry.validators import compile_avro_validator, compile_validator
+from src.schema_registry.wire_format import default_wire_id, parse_avro_schema
+from src.utils.logging import logger
+
+class _Snapshot:
+    """Immutable view of the registered schemas and everything compiled from them.
+    
+    Readers take the registry's current snapshot once and use it without
+    locking. Writers build a new snapshot under the registry lock and swap
+    the reference, so a reader never sees a half-applied change.
+    """
+    
+    __slots__ = ('files', 'registered', 'versions', 'schemas', 'wire_ids',
+                 'validators', 'projections', 'avro_schemas')
+                 
+    def __init__(self, files, registered, versions, wire_ids, validators, projections, avro_schemas):
+        self.files = files  # filename -> ((mtime_ns, size), entry or None if it never parsed)
+        self.registered = registered  # (schema_id, version) -> entry from register_schema
+        self.versions = versions  # schema_id -> {version: entry}
+        self.schemas = {schema_id: entries[max(entries, key=_version_order)]
+                        for schema_id, entries in versions.items()}
+        self.wire_ids = wire_ids  # wire id -> (schema_id, version)
+        # Compiled forms keyed by (schema_id, version), or (schema_id, from, to) for projections
+        self.validators = validators
+        self.projections = projections
+        self.avro_schemas = avro_schemas
+        
+    def entry(self, schema_id, version):
+        return self.versions.get(schema_id, {}).get(version)
 
 class SchemaRegistry:
-    def __init__(self, schema_dir='schemas'):
-        self.schemas = {}
+    def __init__(self, schema_dir='schemas', validator_cache_size=128, compatibility='backward'):
         self.schema_dir = schema_dir
+        self.validator_cache_size = validator_cache_size
+        self.compatibility = compatibility  # Default check for new versions; entries may override
+        self._lock = threading.Lock()  # Serializes writers; readers only use self._snapshot
+        self._snapshot = _Snapshot({}, {}, {}, {}, {}, {}, {})
+        # Cache keys hit since eviction last passed them, per cache; marked without the lock
+        self._used = {'validators': set(), 'projections': set(), 'avro_schemas': set()}
+        self._watcher = None
         self._load_schemas()
         
+    @property
+    def schemas(self):
+        """Current version's entry of every schema, by schema_id."""
+        return self._snapshot.schemas
+        
+    @property
+    def _validators(self):
+        return self._snapshot.validators
+        
     def _load_schemas(self):
-        """Load schemas from the schema directory."""
+        """Load schemas from the schema directory.
+        
+        A schema may have several files, one per version; the highest version
+        becomes the current one.
+        """
+        self.reload()
+        
+    def reload(self):
+        """Reparse schema files that changed since the last load and swap in a new snapshot.
+        
+        Files are compared by mtime and size, so unchanged files are not read
+        again. A file that does not parse, does not compile or is not
+        compatible with the current version is logged and skipped, and the
+        schemas it defined before stay in place. Returns True if the snapshot changed.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            try:
+                names = sorted(n for n in os.listdir(self.schema_dir) if n.endswith('.json')) \
+                    if self.schema_dir else []
+            except FileNotFoundError:
+                names = []
+                
+            files = {}
+            changed = []
+            for name in names:
+                path = os.path.join(self.schema_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                signature = (stat.st_mtime_ns, stat.st_size)
+                known = snapshot.files.get(name)
+                if known is not None and known[0] == signature:
+                    files[name] = known
+                    continue
+                try:
+                    with open(path, 'r') as f:
+                        entry = json.load(f)
+                    if not isinstance(entry, dict) or not entry.get('schema_id'):
+                        raise ValueError("no schema_id")
+                except (OSError, ValueError) as e:
+                    logger.error(f"Skipping schema file {path}: {str(e)}")
+                    # Remember the signature so the same broken file is not reported again
+                    files[name] = (signature, known[1] if known else None)
+                    continue
+                changed.append((name, signature, entry, known))
+                
+            if not changed and files.keys() == snapshot.files.keys() \
+                    and all(files[name] is snapshot.files[name] for name in files):
+                return False
+                
+            # Apply changed files oldest version first, so each new version is checked against its predecessor
+            current = self._rebuild(snapshot, files, snapshot.registered)
+            for name, signature, entry, known in sorted(
+                    changed, key=lambda c: (c[2]['schema_id'], _version_order(c[2].get('version')))):
+                trial = dict(files)
+                trial[name] = (signature, entry)
+                try:
+                    self._check_version(current, entry['schema_id'], entry)
+                    candidate = self._rebuild(current, trial, snapshot.registered)
+                    # Compiling up front rejects malformed schemas and warms the new snapshot
+                    candidate.validators[(entry['schema_id'], entry.get('version'))] = _compile_validator(entry)
+                except Exception as e:
+                    logger.error(f"Skipping schema file {os.path.join(self.schema_dir, name)}: {str(e)}")
+                    files[name] = (signature, known[1] if known else None)
+                    current = self._rebuild(current, files, snapshot.registered)
+                    continue
+                files = trial
+                current = candidate
+                logger.info(f"Loaded schema {entry['schema_id']} version {entry.get('version')} from {name}")
+            self._snapshot = current
+            return True
+            
+    def watch(self, poll_interval=1.0, use_inotify=True):
+        """Reload the schema directory in the background whenever a file in it changes."""
+        from src.utils.dir_watcher import DirectoryWatcher
         if not os.path.exists(self.schema_dir):
-            return
+            os.makedirs(self.schema_dir)
+        self._watcher = DirectoryWatcher(
+            self.schema_dir, lambda path: self.reload(), suffix='.json',
+            poll_interval=poll_interval, settle_time=0, use_inotify=use_inotify, report_changes=True)
+        self._watcher.start()
+        
+    def close(self):
+        """Stop watching the schema directory."""
+        if self._watcher:
+            self._watcher.stop()
+            self._watcher = None
             
-        for filename in os.listdir(self.schema_dir):
-            if filename.endswith('.json'):
-                filepath = os.path.join(self.schema_dir, filename)
-                with open(filepath, 'r') as f:
-                    schema_data = json.load(f)
-                    schema_id = schema_data.get('schema_id')
-                    if schema_id:
-                        self.schemas[schema_id] = schema_data
-    
     def register_schema(self, schema_id, schema):
-        """Register a new schema."""
-        if schema_id in self.schemas:
-            raise ValueError(f"Schema with ID {schema_id} already exists.")
-        self.schemas[schema_id] = schema
+        """Register a new schema, or a new version of an existing one.
         
-    def get_schema(self, schema_id):
-        """Get a schema by ID."""
-        return self.schemas.get(schema_id)
+        A new version must be higher than the current one and pass the
+        compatibility check named by the entry's ``compatibility`` key
+        (default: the registry's ``compatibility``) against it.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            registered = dict(snapshot.registered)
+            if snapshot.schemas.get(schema_id) is not None:
+                self._check_version(snapshot, schema_id, schema, require_newer=True)
+            else:
+                for key in [k for k in registered if k[0] == schema_id]:
+                    del registered[key]
+                # Drop anything compiled for an earlier registration under this id
+                snapshot = self._without(snapshot, schema_id)
+            registered[(schema_id, schema.get('version'))] = schema
+            self._snapshot = self._rebuild(snapshot, snapshot.files, registered)
+            
+    def get_schema(self, schema_id, version=None):
+        """Get a schema by ID, in its current or a given version."""
+        if version is None:
+            return self._snapshot.schemas.get(schema_id)
+        return self._snapshot.entry(schema_id, version)
         
-    def validate_data(self, data, schema_id):
-        """Validate data against a schema."""
-        schema = self.get_schema(schema_id)
-        if not schema:
-            raise ValueError(f"Schema {schema_id} not found.")
+    def list_versions(self, schema_id):
+        """Registered versions of a schema, oldest first."""
+        return sorted(self._snapshot.versions.get(schema_id, {}), key=_version_order)
+        
+    def get_validator(self, schema_id, version=None):
+        """Get the compiled validator for a schema, compiling it on first use."""
+        snapshot = self._snapshot
+        schema = _entry(snapshot, schema_id, version)
+        key = (schema_id, schema.get('version'))
+        validator = snapshot.validators.get(key)
+        if validator is not None:
+            self._used['validators'].add(key)
+            return validator
+        return self._compile(snapshot, schema_id, key[1])
+        
+    def get_projection(self, schema_id, from_version, to_version=None):
+        """Get the compiled function converting records between two versions of a schema.
+        
+        ``to_version`` defaults to the current version. The result is cached
+        like validators are.
+        """
+        snapshot = self._snapshot
+        writer = _entry(snapshot, schema_id, from_version)
+        reader = _entry(snapshot, schema_id, to_version)
+        key = (schema_id, writer.get('version'), reader.get('version'))
+        projection = snapshot.projections.get(key)
+        if projection is not None:
+            self._used['projections'].add(key)
+            return projection
+        return self._cache('projections', key, (writer, reader), compile_projection(writer, reader))
+        
+    def project_batch(self, records, schema_id, from_version, to_version=None):
+        """Convert valid records of one version to another (default: the current one)."""
+        reader = _entry(self._snapshot, schema_id, to_version)
+        if from_version == reader.get('version'):
+            return records
+        project = self.get_projection(schema_id, from_version, reader.get('version'))
+        return [project(record) for record in records]
+        
+    def get_avro_schema(self, schema_id, version=None):
+        """Get the parsed Avro schema of an ``"type": "avro"`` entry."""
+        snapshot = self._snapshot
+        schema = _entry(snapshot, schema_id, version)
+        if schema.get('type') != 'avro':
+            raise ValueError(f"Schema {schema_id} is not an Avro schema.")
+        key = (schema_id, schema.get('version'))
+        parsed = snapshot.avro_schemas.get(key)
+        if parsed is not None:
+            self._used['avro_schemas'].add(key)
+            return parsed
+        return self._cache('avro_schemas', key, (schema,), parse_avro_schema(schema['schema']))
+        
+    def wire_id(self, schema_id, version=None):
+        """Numeric id that wire-format payloads carry for a schema version (default: current)."""
+        schema = _entry(self._snapshot, schema_id, version)
+        return _wire_id(schema_id, schema)
+        
+    def lookup_wire_id(self, wire_id):
+        """Return the ``(schema_id, version)`` a wire id belongs to, or None."""
+        return self._snapshot.wire_ids.get(wire_id)
+        
+    def _compile(self, snapshot, schema_id, version):
+        """Compile, cache and return the validator of one schema version."""
+        schema = _entry(snapshot, schema_id, version)
+        return self._cache('validators', (schema_id, version), (schema,), _compile_validator(schema))
+        
+    def _cache(self, kind, key, entries, value):
+        """Publish a compiled value in a new snapshot, unless its schema changed meanwhile.
+        
+        Compilation happens outside the lock; a concurrent miss just compiles
+        twice. Each cache keeps at most ``validator_cache_size`` values and
+        evicts in approximate LRU order (second chance): lock-free hits
+        cannot reorder the cache, so they only mark their key as used, and an
+        oldest entry that was used since eviction last reached it moves to
+        the back instead of being dropped.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            schema_id = key[0]
+            if any(snapshot.entry(schema_id, entry.get('version')) is not entry for entry in entries):
+                return value
+            cache = dict(getattr(snapshot, kind))
+            value = cache.setdefault(key, value)
+            used = self._used[kind]
+            while len(cache) > self.validator_cache_size:
+                oldest = next(iter(cache))
+                if oldest in used:
+                    used.discard(oldest)
+                    cache[oldest] = cache.pop(oldest)
+                else:
+                    del cache[oldest]
+            used.intersection_update(cache)
+            self._snapshot = _replace(snapshot, **{kind: cache})
+        return value
+        
+    def _check_version(self, snapshot, schema_id, schema, require_newer=False):
+        """Raise ValueError unless a new entry may join the schema's versions."""
+        current = snapshot.schemas.get(schema_id)
+        if current is None:
+            return
+        version, current_version = schema.get('version'), current.get('version')
+        if require_newer and (not isinstance(version, int) or not isinstance(current_version, int)
+                              or version <= current_version):
+            raise ValueError(f"Schema with ID {schema_id} already exists.")
+        if not isinstance(version, int) or not isinstance(current_version, int) \
+                or version <= current_version:
+            return  # Replaces an existing version or adds an older one
+        mode = schema.get('compatibility', self.compatibility)
+        problems = compatibility_problems(schema, current, mode)
+        if problems:
+            raise ValueError(f"Version {version} of {schema_id} is not {mode} compatible "
+                             f"with version {current_version}: {'; '.join(problems)}")
+                             
+    def _rebuild(self, previous, files, registered):
+        """Build a snapshot from file and registered entries, keeping still valid compiled forms."""
+        versions = {}
+        wire_ids = {}
+        entries = [(entry['schema_id'], entry) for _, (_, entry) in sorted(files.items()) if entry]
+        entries.extend((key[0], entry) for key, entry in registered.items())
+        for schema_id, entry in entries:
+            key = (schema_id, entry.get('version'))
+            wire_id = _wire_id(schema_id, entry)
+            existing = wire_ids.get(wire_id)
+            if existing is not None and existing != key:
+                raise ValueError(f"Wire id {wire_id} of {schema_id} is already used by {existing[0]}.")
+            wire_ids[wire_id] = key
+            versions.setdefault(schema_id, {})[key[1]] = entry
+            
+        def unchanged(schema_id, *versions_used):
+            return all(previous.entry(schema_id, v) is not None
+                       and previous.entry(schema_id, v) is versions.get(schema_id, {}).get(v)
+                       for v in versions_used)
+        return _Snapshot(
+            files, registered, versions, wire_ids,
+            {k: v for k, v in previous.validators.items() if unchanged(*k)},
+            {k: v for k, v in previous.projections.items() if unchanged(*k)},
+            {k: v for k, v in previous.avro_schemas.items() if unchanged(*k)})
             
-        try:
-            validate(instance=data, schema=schema.get('schema', {}))
-            return True, None
-        except ValidationError as e:
-            return False, str(e)
+    def _without(self, snapshot, schema_id):
+        """A snapshot without anything compiled for a schema."""
+        return _replace(snapshot, **{
+            kind: {k: v for k, v in getattr(snapshot, kind).items() if k[0] != schema_id}
+            for kind in ('validators', 'projections', 'avro_schemas')})
             
+    def validate_data(self, data, schema_id, version=None):
+        """Validate data against a schema."""
+        return self.get_validator(schema_id, version)(data)
+        
+    def validate_batch(self, records, schema_id, version=None):
+        """Validate a list of records, splitting them into accepted and rejected.
+        
+        Returns ``(accepted, rejected)`` where rejected holds ``(record, error)`` pairs.
+        """
+        validator = self.get_validator(schema_id, version)
+        accepted = []
+        rejected = []
+        for record in records:
+            is_valid, error = validator(record)
+            if is_valid:
+                accepted.append(record)
+            else:
+                rejected.append((record, error))
+        return accepted, rejected
+        
     def list_schemas(self):
         """List all available schemas."""
-        return list(self.schemas.keys())
\ No newline at end of file
+        return list(self.schemas.keys())
+
+def _entry(snapshot, schema_id, version=None):
+    schema = snapshot.schemas.get(schema_id) if version is None else snapshot.entry(schema_id, version)
+    if not schema:
+        if version is None:
+            raise ValueError(f"Schema {schema_id} not found.")
+        raise ValueError(f"Schema {schema_id} has no version {version}.")
+    return schema
+
+def _compile_validator(schema):
+    if schema.get('type') == 'avro':
+        return compile_avro_validator(parse_avro_schema(schema['schema']))
+    return compile_validator(schema.get('schema', {}))
+
+def _wire_id(schema_id, schema):
+    return schema.get('wire_id', default_wire_id(schema_id, schema.get('version')))
+
+def _replace(snapshot, **changes):
+    fields = {name: getattr(snapshot, name) for name in _Snapshot.__slots__ if name != 'schemas'}
+    fields.update(changes)
+    return _Snapshot(**fields)
+
+def _version_order(version):
+    # Entries without a version sort before numbered ones
+    return (version is not None, version if isinstance(version, int) else 0)
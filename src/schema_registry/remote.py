@@ -0,0 +1,230 @@
+"""Schema registry backed by a Confluent-compatible schema registry HTTP API.
+
+Subjects are schema ids and subject versions are schema versions; the
+registry's global schema id becomes the entry's wire id, so payloads
+written by Confluent serializers decode as they are. Schemas are fetched
+on first use and installed into the registry's snapshot, after which they
+validate, project and decode exactly like local ones.
+"""
+import json
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import quote
+from src.schema_registry.registry import SchemaRegistry
+from src.utils.logging import logger, RateLimitedLogger
+
+# Confluent schemaType -> registry entry type; entries without one are Avro
+_SCHEMA_TYPES = {'AVRO': 'avro', 'JSON': 'json'}
+
+_throttled = RateLimitedLogger(logger, interval=30.0)
+
+class RemoteSchemaRegistry(SchemaRegistry):
+    """Resolves schemas from a remote registry, with a local cache in front of it.
+
+    The latest version of a subject is looked up again once ``cache_ttl``
+    seconds have passed; specific versions and ids never change once
+    registered, so they are fetched only once. Concurrent misses for the
+    same schema share one request, and subjects, versions or ids the
+    registry does not know are remembered as missing for ``negative_ttl``
+    seconds. When the registry cannot be reached, schemas resolved earlier
+    stay in use and the refresh is retried after ``negative_ttl`` seconds;
+    schemas never resolved are treated as missing for ``error_backoff``
+    seconds, so callers do not each wait out a request timeout.
+
+    Schemas from ``schema_dir`` or ``register_schema`` take precedence and
+    are never looked up remotely.
+    """
+
+    def __init__(self, url, schema_dir=None, cache_ttl=300.0, negative_ttl=30.0, timeout=5.0,
+                 pool_size=8, session=None, error_backoff=5.0, **options):
+        self.url = url.rstrip('/')
+        self.cache_ttl = cache_ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout  # Seconds per HTTP request
+        self.error_backoff = error_backoff  # Seconds before retrying a lookup that failed to connect
+        self.pool_size = pool_size  # Pooled keep-alive connections to the registry
+        self.session = session
+        self._own_session = session is None
+        self._session_lock = threading.Lock()
+        self._latest = {}   # subject -> monotonic time its latest version is due for a refresh
+        self._missing = {}  # lookup key -> monotonic time until which it is known to be absent
+        self._flights = {}  # lookup key -> Future of the request in progress
+        self._flights_lock = threading.Lock()
+        super().__init__(schema_dir, **options)
+
+    def get_schema(self, schema_id, version=None):
+        self._resolve(schema_id, version)
+        return super().get_schema(schema_id, version)
+
+    def list_versions(self, schema_id):
+        """Versions of a schema resolved so far, oldest first."""
+        self._resolve(schema_id)
+        return super().list_versions(schema_id)
+
+    def get_validator(self, schema_id, version=None):
+        self._resolve(schema_id, version)
+        return super().get_validator(schema_id, version)
+
+    def get_projection(self, schema_id, from_version, to_version=None):
+        self._resolve(schema_id, from_version)
+        self._resolve(schema_id, to_version)
+        return super().get_projection(schema_id, from_version, to_version)
+
+    def project_batch(self, records, schema_id, from_version, to_version=None):
+        self._resolve(schema_id, to_version)
+        return super().project_batch(records, schema_id, from_version, to_version)
+
+    def get_avro_schema(self, schema_id, version=None):
+        self._resolve(schema_id, version)
+        return super().get_avro_schema(schema_id, version)
+
+    def wire_id(self, schema_id, version=None):
+        self._resolve(schema_id, version)
+        return super().wire_id(schema_id, version)
+
+    def lookup_wire_id(self, wire_id):
+        found = super().lookup_wire_id(wire_id)
+        if found is None and not self._known_missing(('id', wire_id)):
+            self._single_flight(('id', wire_id), lambda: self._fetch_id(wire_id))
+            found = super().lookup_wire_id(wire_id)
+        return found
+
+    def close(self):
+        """Stop watching the schema directory and close pooled connections."""
+        super().close()
+        with self._session_lock:
+            if self.session is not None and self._own_session:
+                self.session.close()
+                self.session = None
+
+    def _resolve(self, schema_id, version=None):
+        """Make sure a version of a subject (default: the latest) is available locally."""
+        if version is None:
+            due = self._latest.get(schema_id)
+            if due is None:
+                if schema_id in self._snapshot.schemas:
+                    return  # Defined locally
+            elif time.monotonic() < due:
+                return
+            if self._known_missing((schema_id, None)):
+                return
+            # With a cached version at hand, callers do not wait for someone else's refresh
+            self._single_flight((schema_id, None), lambda: self._fetch_version(schema_id, None),
+                                wait=due is None)
+        elif self._snapshot.entry(schema_id, version) is None \
+                and not self._known_missing((schema_id, version)):
+            self._single_flight((schema_id, version), lambda: self._fetch_version(schema_id, version))
+
+    def _known_missing(self, key):
+        until = self._missing.get(key)
+        return until is not None and time.monotonic() < until
+
+    def _single_flight(self, key, fetch, wait=True):
+        """Run ``fetch`` once for all callers asking for the same key at the same time.
+
+        Callers that find a request in flight wait for it to finish, or return
+        straight away with ``wait=False``.
+        """
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+        if not leader:
+            if wait:
+                flight.result()
+            return
+        try:
+            fetch()
+            flight.set_result(None)
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+
+    def _fetch_version(self, schema_id, version):
+        subject = quote(schema_id, safe='')
+        path = f"/subjects/{subject}/versions/{'latest' if version is None else int(version)}"
+        try:
+            body = self._get(path)
+        except Exception as e:
+            if version is None and schema_id in self._latest:
+                _throttled.warning("Schema registry unavailable, using cached %s: %s", schema_id, e)
+                self._latest[schema_id] = time.monotonic() + self.negative_ttl
+            else:
+                _throttled.error("Cannot fetch schema %s from %s: %s", schema_id, self.url, e)
+                self._missing[(schema_id, version)] = time.monotonic() + self.error_backoff
+            return
+        entry = None
+        if body is not None:
+            try:
+                entry = _to_entry(schema_id, body)
+                self._install(entry)
+            except (KeyError, ValueError) as e:
+                # Treated as missing, so the same unusable schema is not fetched over and over
+                _throttled.error("Cannot use schema %s from %s: %s", schema_id, self.url, e)
+                entry = None
+        now = time.monotonic()
+        if entry is None:
+            self._missing[(schema_id, version)] = now + self.negative_ttl
+        elif version is None:
+            self._latest[schema_id] = now + self.cache_ttl
+        else:
+            self._latest.setdefault(schema_id, 0.0)  # Remote subject, latest not checked yet
+
+    def _fetch_id(self, wire_id):
+        try:
+            owners = self._get(f"/schemas/ids/{int(wire_id)}/versions")
+        except Exception as e:
+            _throttled.error("Cannot fetch schema id %s from %s: %s", wire_id, self.url, e)
+            self._missing[('id', wire_id)] = time.monotonic() + self.error_backoff
+            return
+        if not owners:
+            self._missing[('id', wire_id)] = time.monotonic() + self.negative_ttl
+            return
+        self._resolve(owners[0]['subject'], owners[0]['version'])
+
+    def _install(self, entry):
+        """Add a fetched entry to the snapshot, keeping the current one if nothing changed."""
+        key = (entry['schema_id'], entry['version'])
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot.entry(*key) == entry:
+                return
+            registered = dict(snapshot.registered)
+            registered[key] = entry
+            self._snapshot = self._rebuild(snapshot, snapshot.files, registered)
+        logger.info(f"Resolved schema {key[0]} version {key[1]} from {self.url}")
+
+    def _get(self, path):
+        """GET a registry resource; returns the decoded body, or None if it does not exist."""
+        with self._session_lock:
+            if self.session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                self.session = requests.Session()
+                pool = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                self.session.mount("http://", pool)
+                self.session.mount("https://", pool)
+            session = self.session
+        response = session.get(self.url + path, timeout=self.timeout,
+                               headers={'Accept': 'application/vnd.schemaregistry.v1+json, application/json'})
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+def _to_entry(subject, body):
+    schema_type = body.get('schemaType', 'AVRO')
+    if schema_type not in _SCHEMA_TYPES:
+        raise ValueError(f"Unsupported schema type {schema_type}")
+    return {
+        'schema_id': subject,
+        'version': body['version'],
+        'type': _SCHEMA_TYPES[schema_type],
+        'schema': json.loads(body['schema']),
+        'wire_id': body['id'],
+    }
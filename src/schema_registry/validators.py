@@ -1,4 +1,25 @@
+import math
 from jsonschema import validate, ValidationError
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+# Keywords the generated fast path understands. Anything else sends the
+# schema down the regular jsonschema validator only.
+_FAST_OBJECT_KEYWORDS = {'type', 'properties', 'required', 'additionalProperties',
+                         'title', 'description', '$schema', '$id'}
+_FAST_PROPERTY_KEYWORDS = {'type', 'minimum', 'maximum', 'format',
+                           'title', 'description', 'default'}
+
+# The checks are deliberately stricter than jsonschema (e.g. 1.0 is not an
+# "integer" here). A record that fails them is re-checked by the full
+# validator, so the fast path can only ever speed up the valid case.
+_FAST_TYPE_CHECKS = {
+    'string': 'isinstance({v}, str)',
+    'number': '(isinstance({v}, (int, float)) and not isinstance({v}, bool))',
+    'integer': '(isinstance({v}, int) and not isinstance({v}, bool))',
+    'boolean': 'isinstance({v}, bool)',
+    'null': '{v} is None',
+}
 
 def validate_schema(data, schema):
     """Validate data against a schema."""
@@ -14,4 +35,117 @@ def validate_schema(data, schema):
 
 def validate_location_schema(data):
     from ..schemas.location_v1 import schema as location_schema
-    return validate_schema(data, location_schema)
\ No newline at end of file
+    return validate_schema(data, location_schema)
+
+def compile_validator(schema, fast_path=True):
+    """Compile a JSON schema into a reusable ``validate(data)`` callable.
+
+    The schema is checked once here instead of on every record. The returned
+    callable has the same ``(is_valid, error)`` contract as ``validate_schema``
+    and produces the same error messages as ``jsonschema.validate``.
+    """
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    validator = cls(schema)
+    fast_check = compile_fast_check(schema) if fast_path else None
+    
+    def validate_compiled(data):
+        if fast_check is not None and fast_check(data):
+            return True, None
+        error = best_match(validator.iter_errors(data))
+        if error is None:
+            return True, None
+        return False, str(error)
+        
+    validate_compiled.fast_path = fast_check is not None
+    return validate_compiled
+
+def compile_avro_validator(parsed_schema):
+    """Build a ``validate(data)`` callable for a parsed Avro schema.
+    
+    Same ``(is_valid, error)`` contract as ``compile_validator``.
+    """
+    from fastavro.validation import ValidationError as AvroValidationError, validate as validate_avro
+    
+    def validate_compiled(data):
+        try:
+            validate_avro(data, parsed_schema, raise_errors=True)
+        except AvroValidationError as e:
+            return False, '; '.join(str(error) for error in e.errors) or str(e)
+        return True, None
+        
+    validate_compiled.fast_path = False
+    return validate_compiled
+
+def compile_fast_check(schema):
+    """Generate a specialized Python check for a flat object schema.
+    
+    Returns a ``check(data) -> bool`` function, or None when the schema uses
+    anything beyond flat, typed properties (nesting, $ref, patterns, ...).
+    """
+    if not isinstance(schema, dict) or schema.get('type') != 'object':
+        return None
+    if set(schema) - _FAST_OBJECT_KEYWORDS:
+        return None
+        
+    properties = schema.get('properties', {})
+    required = schema.get('required', [])
+    additional = schema.get('additionalProperties', True)
+    if not isinstance(properties, dict) or additional not in (True, False):
+        return None
+    if not isinstance(required, list) or not all(isinstance(n, str) for n in required):
+        return None
+        
+    lines = [
+        'def check(data):',
+        '    if type(data) is not dict:',
+        '        return False',
+    ]
+    for name in required:
+        lines.append(f'    if {name!r} not in data:')
+        lines.append('        return False')
+    if additional is False:
+        lines.append('    if not _allowed.issuperset(data):')
+        lines.append('        return False')
+        
+    for name, prop in properties.items():
+        conditions = _property_conditions(prop)
+        if conditions is None:
+            return None
+        if not conditions:
+            continue
+        lines.append(f'    v = data.get({name!r}, _missing)')
+        lines.append(f'    if v is not _missing and not ({" and ".join(conditions)}):')
+        lines.append('        return False')
+    lines.append('    return True')
+    
+    namespace = {'_missing': object(), '_allowed': frozenset(properties)}
+    exec(compile('\n'.join(lines), '<schema fast path>', 'exec'), namespace)
+    return namespace['check']
+
+def _property_conditions(prop):
+    """Return the Python conditions for one property, or None if unsupported."""
+    if not isinstance(prop, dict) or set(prop) - _FAST_PROPERTY_KEYWORDS:
+        return None
+        
+    types = prop.get('type')
+    if types is None:
+        # Untyped properties accept anything, but bounds need a numeric type.
+        return None if ('minimum' in prop or 'maximum' in prop) else []
+    if isinstance(types, str):
+        types = [types]
+    if not types or any(t not in _FAST_TYPE_CHECKS for t in types):
+        return None
+        
+    type_checks = [_FAST_TYPE_CHECKS[t].format(v='v') for t in types]
+    conditions = ['(' + ' or '.join(type_checks) + ')']
+    
+    for keyword, operator in (('minimum', '>='), ('maximum', '<=')):
+        if keyword not in prop:
+            continue
+        bound = prop[keyword]
+        if set(types) - {'number', 'integer'} or isinstance(bound, bool) \
+                or not isinstance(bound, (int, float)) or not math.isfinite(bound):
+            return None
+        conditions.append(f'v {operator} {bound!r}')
+    return conditions
@@ -0,0 +1,141 @@
+"""Binary Avro records in the schema-id-prefixed wire format.
+
+Each payload is a zero magic byte, the 4-byte big-endian wire id of the
+writer schema and the schemaless Avro encoding of one record, the framing
+used by the Confluent serializers. A payload names its own schema, so
+decoding needs no side channel, and a payload that decodes cleanly against
+its schema is valid by construction. Payloads written with an older version
+of the expected schema are decoded with that version and then upcast with
+the registry's compiled projection.
+"""
+import io
+import struct
+import zlib
+
+MAGIC_BYTE = 0
+HEADER = struct.Struct('>bI')
+
+def default_wire_id(schema_id, version):
+    """Stable 31-bit wire id for a schema version that does not set one."""
+    return zlib.crc32(f"{schema_id}:{version}".encode('utf-8')) & 0x7fffffff
+
+def parse_avro_schema(schema):
+    """Parse an Avro schema with fastavro, checking it once up front."""
+    try:
+        import fastavro
+    except ImportError:
+        raise ImportError("Avro schemas require fastavro: pip install fastavro")
+    return fastavro.parse_schema(schema)
+
+class AvroCodec:
+    """Encodes and decodes wire-format payloads using the registry's Avro schemas."""
+
+    def __init__(self, schema_registry):
+        try:
+            import fastavro
+        except ImportError:
+            raise ImportError("AvroCodec requires fastavro: pip install fastavro")
+        self._writer = fastavro.schemaless_writer
+        self._reader = fastavro.schemaless_reader
+        self.schema_registry = schema_registry
+
+    def encode(self, record, schema_id, version=None):
+        """Encode one record; raises ValueError if it does not fit the schema."""
+        payloads, rejected = self.encode_batch([record], schema_id, version)
+        if rejected:
+            raise ValueError(f"Cannot encode record as {schema_id}: {rejected[0][1]}")
+        return payloads[0]
+
+    def encode_batch(self, records, schema_id, version=None):
+        """Encode records with a version of a schema (default: the current one).
+
+        Returns ``(payloads, rejected)`` where rejected holds ``(record, error)``
+        pairs. Encoding only fails on values Avro cannot represent; records
+        should already have passed ``SchemaRegistry.validate_batch``.
+        """
+        parsed = self.schema_registry.get_avro_schema(schema_id, version)
+        header = HEADER.pack(MAGIC_BYTE, self.schema_registry.wire_id(schema_id, version))
+        writer = self._writer
+        buffer = io.BytesIO()
+        payloads = []
+        rejected = []
+        for record in records:
+            buffer.seek(0)
+            buffer.truncate()
+            buffer.write(header)
+            try:
+                writer(buffer, parsed, record)
+            except Exception as e:
+                rejected.append((record, str(e)))
+                continue
+            payloads.append(buffer.getvalue())
+        return payloads, rejected
+
+    def decode(self, payload, schema_id=None, version=None):
+        """Decode one payload; raises ValueError if it is malformed."""
+        records, rejected = self.decode_batch([payload], schema_id, version)
+        if rejected:
+            raise ValueError(rejected[0][1])
+        return records[0]
+
+    def decode_batch(self, payloads, schema_id=None, version=None):
+        """Decode payloads, rejecting any that are malformed or use another schema.
+
+        Returns ``(records, rejected)`` where rejected holds ``(payload, error)``
+        pairs. With ``schema_id`` set, payloads written with a different schema
+        are rejected too, and records of other versions of it are projected
+        to ``version`` (default: the current one). Without it, records are
+        returned as written.
+        """
+        reader = self._reader
+        schemas = {}  # wire id -> (parsed schema, projection or None), or an error message
+        records = []
+        rejected = []
+        for payload in payloads:
+            if not isinstance(payload, (bytes, bytearray)) or len(payload) < HEADER.size:
+                rejected.append((payload, "Payload is shorter than the wire-format header"))
+                continue
+            magic, wire_id = HEADER.unpack_from(payload)
+            if magic != MAGIC_BYTE:
+                rejected.append((payload, f"Unknown magic byte {magic}"))
+                continue
+            found = schemas.get(wire_id)
+            if found is None:
+                found = schemas[wire_id] = self._schema_for(wire_id, schema_id, version)
+            if isinstance(found, str):
+                rejected.append((payload, found))
+                continue
+            parsed, project = found
+            buffer = io.BytesIO(payload)
+            buffer.seek(HEADER.size)
+            try:
+                record = reader(buffer, parsed)
+            except Exception as e:
+                rejected.append((payload, f"Malformed Avro body: {str(e)}"))
+                continue
+            if buffer.tell() != len(payload):
+                rejected.append((payload, "Trailing bytes after the Avro body"))
+                continue
+            records.append(record if project is None else project(record))
+        return records, rejected
+
+    def _schema_for(self, wire_id, expected_schema_id, reader_version):
+        """Parsed writer schema and projection for a wire id, or an error message."""
+        found = self.schema_registry.lookup_wire_id(wire_id)
+        if found is None:
+            return f"Unknown schema wire id {wire_id}"
+        schema_id, version = found
+        if expected_schema_id is not None and schema_id != expected_schema_id:
+            return f"Payload was written with {schema_id}, expected {expected_schema_id}"
+        try:
+            parsed = self.schema_registry.get_avro_schema(schema_id, version)
+            project = None
+            if expected_schema_id is not None:
+                reader = self.schema_registry.get_schema(schema_id, reader_version)
+                if reader is None:
+                    return f"Schema {schema_id} has no version {reader_version}"
+                if reader.get('version') != version:
+                    project = self.schema_registry.get_projection(schema_id, version, reader.get('version'))
+            return parsed, project
+        except ValueError as e:
+            return str(e)
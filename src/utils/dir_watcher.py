@@ -0,0 +1,243 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from src.utils.logging import logger
+
+# inotify(7) constants
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_DELETE = 0x00000200
+_IN_READY = _IN_CLOSE_WRITE | _IN_MOVED_TO
+_IN_GONE = _IN_MOVED_FROM | _IN_DELETE
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+def _load_inotify():
+    """Return libc if it provides inotify, else None."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+class DirectoryWatcher:
+    """Report each new file in a directory once, after it has finished being written.
+
+    Uses inotify when the platform provides it: a file is ready when its writer
+    closes it or when it is moved into the directory. Otherwise the directory is
+    polled. Polling keeps an in-memory index of names already reported and only
+    lists the directory again when its mtime changes, so files that were already
+    seen are not stat'ed on every pass. A polled file is ready once it has not
+    been modified for ``settle_time`` seconds.
+
+    With ``report_changes`` the callback also runs when a reported file is
+    rewritten, replaced or removed (the path then no longer exists). Polling
+    has to stat every file on each pass for that, so it suits small
+    directories such as configuration.
+    """
+
+    def __init__(self, path, callback, suffix='.csv', poll_interval=1.0, settle_time=2.0,
+                 use_inotify=True, report_changes=False):
+        self.path = path
+        self.callback = callback
+        self.suffix = suffix
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.report_changes = report_changes
+
+        self._seen = set()       # Names already reported
+        self._mtimes = {}        # Name -> mtime when reported, with report_changes
+        self._pending = set()    # Names of files that may still be being written
+        self._dir_mtime = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._inotify_fd = None
+        self._wakeup = None      # (read, write) ends of the pipe that interrupts select()
+        self._close_lock = threading.Lock()
+
+        libc = _load_inotify() if use_inotify else None
+        if libc is not None:
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd >= 0 and libc.inotify_add_watch(
+                    fd, os.fsencode(path), _IN_READY | _IN_GONE) >= 0:
+                self._inotify_fd = fd
+                self._wakeup = os.pipe()
+                os.set_blocking(self._wakeup[1], False)
+            elif fd >= 0:
+                os.close(fd)
+
+    @property
+    def uses_inotify(self):
+        return self._inotify_fd is not None
+
+    def start(self):
+        """Start watching in a background thread."""
+        logger.info(f"Watching {self.path} for new {self.suffix} files "
+                    f"({'inotify' if self.uses_inotify else 'polling'})")
+        self._thread = threading.Thread(target=self._run, name="dir-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching and release the inotify descriptor.
+
+        The descriptor is closed by the watching thread on its way out; if
+        the thread is still busy in a callback when the join times out, it is
+        left to close it once it gets there.
+        """
+        self._stop.set()
+        with self._close_lock:
+            if self._wakeup is not None:
+                try:
+                    os.write(self._wakeup[1], b'\0')
+                except BlockingIOError:
+                    pass  # Already woken
+        if self._thread:
+            self._thread.join(timeout=self.poll_interval + 1)
+            if self._thread.is_alive():
+                logger.warning(f"Watcher of {self.path} did not stop in time, "
+                               f"it closes its descriptors once it exits")
+                return
+        self._close()
+
+    def _close(self):
+        with self._close_lock:
+            if self._inotify_fd is not None:
+                os.close(self._inotify_fd)
+                self._inotify_fd = None
+            if self._wakeup is not None:
+                for fd in self._wakeup:
+                    os.close(fd)
+                self._wakeup = None
+
+    def scan(self):
+        """Run one polling pass and report files that are ready."""
+        for name in self._poll():
+            self._report(name)
+
+    def _run(self):
+        try:
+            self._watch()
+        finally:
+            self._close()
+
+    def _watch(self):
+        # Files that were already there are found by a first polling pass
+        self.scan()
+        while not self._stop.is_set():
+            try:
+                if self.uses_inotify:
+                    for mask, name in self._read_events(self.poll_interval):
+                        self._pending.discard(name)
+                        if mask & _IN_GONE:
+                            self._forget(name)
+                        elif mask & _IN_READY:
+                            if self.report_changes:
+                                self._seen.discard(name)
+                            self._report(name)
+                    if self._pending:
+                        self.scan()
+                else:
+                    self._stop.wait(self.poll_interval)
+                    self.scan()
+            except Exception as e:
+                logger.error(f"Error watching {self.path}: {str(e)}")
+                self._stop.wait(self.poll_interval)
+
+    def _report(self, name):
+        if name in self._seen or not name.endswith(self.suffix):
+            return
+        self._seen.add(name)
+        self._notify(name)
+
+    def _forget(self, name):
+        """Handle a file that was moved away or deleted."""
+        # A changed file waiting to settle was reported before, too
+        if name in self._seen or name in self._mtimes:
+            self._seen.discard(name)
+            self._mtimes.pop(name, None)
+            if self.report_changes:
+                self._notify(name)
+
+    def _notify(self, name):
+        try:
+            self.callback(os.path.join(self.path, name))
+        except Exception as e:
+            logger.error(f"Error handling new file {name}: {str(e)}")
+
+    def _poll(self):
+        """Return names of files that are ready, touching only new or pending files."""
+        try:
+            dir_mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return []
+
+        # In-place rewrites do not change the directory's mtime
+        if dir_mtime != self._dir_mtime or self.report_changes:
+            self._dir_mtime = dir_mtime
+            names = set()
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(self.suffix):
+                        continue
+                    names.add(entry.name)
+                    if entry.name in self._pending:
+                        continue
+                    if entry.name in self._seen:
+                        if self.report_changes \
+                                and entry.stat().st_mtime_ns != self._mtimes.get(entry.name):
+                            self._seen.discard(entry.name)
+                            self._pending.add(entry.name)
+                        continue
+                    if entry.is_file():
+                        self._pending.add(entry.name)
+            # Forget files that were moved away, so a new file with the same name is picked up
+            for name in (self._seen | set(self._mtimes)) - names:
+                self._forget(name)
+            self._pending &= names
+
+        ready = []
+        now = time.time()
+        for name in list(self._pending):
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                self._pending.discard(name)
+                continue
+            if now - stat.st_mtime >= self.settle_time:
+                self._pending.discard(name)
+                ready.append(name)
+                if self.report_changes:
+                    self._mtimes[name] = stat.st_mtime_ns
+        return ready
+
+    def _read_events(self, timeout):
+        """Wait up to timeout for inotify events and return their ``(mask, name)`` pairs."""
+        readable, _, _ = select.select([self._inotify_fd, self._wakeup[0]], [], [], timeout)
+        if self._inotify_fd not in readable:
+            return []  # Timed out, or woken by stop()
+        try:
+            data = os.read(self._inotify_fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name:
+                events.append((mask, os.fsdecode(name)))
+        return events
@@ -1,38 +1,154 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
+import threading
+import time
+from src.config.settings import LOGGING
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Listener writing records queued by the async handler; replaced on every setup
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, including ``extra`` fields."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def setup_logging(log_level=logging.INFO, log_file=None, json_format=False, async_handlers=True):
+    """Configure logging for the application.
+
+    With ``async_handlers`` the root logger only gets a QueueHandler, and a
+    QueueListener thread does the formatting and I/O, so logging never blocks
+    a hot path on the console or disk. Calling this again replaces the
+    handlers it installed before instead of adding more.
+    """
+    global _listener
 
-def setup_logging(log_level=logging.INFO, log_file=None):
-    """Configure logging for the application."""
     # Create logs directory if not exists
-    if log_file and not os.path.exists(os.path.dirname(log_file)):
+    if log_file and os.path.dirname(log_file) and not os.path.exists(os.path.dirname(log_file)):
         os.makedirs(os.path.dirname(log_file))
-    
+
     # Configure root logger
     root_logger = logging.getLogger()
     root_logger.setLevel(log_level)
-    
+    _remove_handlers(root_logger)
+
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+
     # Create console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(log_level)
-    console_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    console_handler.setFormatter(console_formatter)
-    root_logger.addHandler(console_handler)
-    
+    handlers = [logging.StreamHandler(sys.stdout)]
+
     # Create file handler if log_file is specified
     if log_file:
-        file_handler = logging.FileHandler(log_file)
-        file_handler.setLevel(log_level)
-        file_formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        file_handler.setFormatter(file_formatter)
-        root_logger.addHandler(file_handler)
-    
+        handlers.append(logging.FileHandler(log_file))
+
+    for handler in handlers:
+        handler.setLevel(log_level)
+        handler.setFormatter(formatter)
+
+    if async_handlers:
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        handlers = [logging.handlers.QueueHandler(log_queue)]
+
+    for handler in handlers:
+        handler._installed_by_setup = True
+        root_logger.addHandler(handler)
+
     # Return a named logger for the module
     return logging.getLogger('ingestion-system')
 
+def shutdown_logging():
+    """Write out queued records and close the installed handlers."""
+    _remove_handlers(logging.getLogger())
+
+def _remove_handlers(root_logger):
+    global _listener
+    if _listener is not None:
+        _listener.stop()  # Processes everything already queued
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    for handler in list(root_logger.handlers):
+        if getattr(handler, '_installed_by_setup', False):
+            root_logger.removeHandler(handler)
+            handler.close()
+
+class RateLimitedLogger:
+    """Logs each distinct message template at most once per interval.
+
+    Meant for per-record or per-batch events: the first occurrence is logged,
+    later ones within ``interval`` seconds are only counted, and the count is
+    reported with the next message that gets through. With ``sample_every``
+    set, only every Nth call is considered at all. Arguments are formatted
+    lazily, so suppressed messages cost one dictionary lookup.
+    """
+
+    def __init__(self, logger, interval=10.0, sample_every=1):
+        self.logger = logger
+        self.interval = interval
+        self.sample_every = sample_every
+        self._lock = threading.Lock()
+        self._state = {}  # template -> [last logged at, suppressed count, calls]
+
+    def log(self, level, msg, *args, **kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.get(msg)
+            if state is None:
+                state = self._state[msg] = [now - self.interval, 0, 0]
+            state[2] += 1
+            if state[2] % self.sample_every or now - state[0] < self.interval:
+                state[1] += 1
+                return
+            suppressed = state[1]
+            state[0] = now
+            state[1] = 0
+        if suppressed:
+            msg = f"{msg} (%d similar messages suppressed)"
+            args = args + (suppressed,)
+        self.logger.log(level, msg, *args, **kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.log(logging.WARNING, msg, *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self.log(logging.ERROR, msg, *args, **kwargs)
+
 # Create default logger
-logger = setup_logging(log_file='logs/ingestion.log')
\ No newline at end of file
+logger = setup_logging(
+    log_level=getattr(logging, LOGGING['level']),
+    log_file=os.path.join('logs', LOGGING['log_file']),
+    json_format=LOGGING['format'] == 'json',
+    async_handlers=LOGGING['async']
+)
+atexit.register(shutdown_logging)
@@ -0,0 +1,223 @@
+"""Lightweight process metrics exposed in the Prometheus text format.
+
+Counters and histograms keep one plain dict per thread, so recording a value
+takes no lock; the per-thread values are only summed when the metrics are
+scraped. Gauges are read from callbacks at scrape time.
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.utils.logging import logger
+
+# Seconds; suits per-batch validation and consumer calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class _PerThread:
+    """One dict of values per thread, registered the first time the thread records."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def values(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._all.append(values)
+            return values
+
+    def snapshots(self):
+        with self._lock:
+            all_values = list(self._all)
+        # Copying a dict happens under the GIL, so a concurrent insert cannot break it
+        return [dict(values) for values in all_values]
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = _PerThread()
+
+    def inc(self, labels=(), amount=1):
+        values = self._values.values()
+        values[labels] = values.get(labels, 0) + amount
+
+    def collect(self):
+        """Return ``{labels: total}`` summed over all threads."""
+        totals = {}
+        for values in self._values.snapshots():
+            for labels, value in values.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.collect().items(), key=_label_order):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = _PerThread()
+
+    def observe(self, value, labels=()):
+        values = self._values.values()
+        state = values.get(labels)
+        if state is None:
+            # Bucket counts (the last one is +Inf), then sum and count
+            state = values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def collect(self):
+        """Return ``{labels: (bucket counts, sum, count)}`` summed over all threads."""
+        totals = {}
+        for values in self._values.snapshots():
+            for labels, state in values.items():
+                state = list(state)
+                total = totals.get(labels)
+                totals[labels] = state if total is None else [a + b for a, b in zip(total, state)]
+        return {labels: (state[:-2], state[-2], state[-1]) for labels, state in totals.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ('le',)
+        for labels, (counts, total, count) in sorted(self.collect().items(), key=_label_order):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+class Gauge:
+    """Value read from a callback at scrape time, e.g. a queue depth.
+
+    The callback returns a number, or a ``{labels: value}`` dict for labelled gauges.
+    """
+
+    def __init__(self, name, help, labelnames=(), callback=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if self.callback is None:
+            return lines
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.error(f"Error reading gauge {self.name}: {str(e)}")
+            return lines
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        items = [(labels if isinstance(labels, tuple) else (labels,), v) for labels, v in items]
+        for labels, v in sorted(items, key=_label_order):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(v)}")
+        return lines
+
+class MetricsRegistry:
+    """Named metrics of the process; asking for an existing name returns it."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labelnames=()):
+        return self._get_or_create(name, lambda: Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(name, lambda: Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, labelnames=(), callback=None):
+        """Register a gauge; a new callback replaces the previous one."""
+        gauge = self._get_or_create(name, lambda: Gauge(name, help, labelnames))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def render(self):
+        """The current value of every metric in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def _get_or_create(self, name, create):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = create()
+            return metric
+
+class MetricsServer:
+    """Serves a registry at ``/metrics`` from a background thread."""
+
+    def __init__(self, registry, host='127.0.0.1', port=9100):
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] != '/metrics':
+                    handler.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+        self.thread.start()
+        logger.info(f"Serving metrics on http://{self.server.server_address[0]}:{self.port}/metrics")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def _label_order(item):
+    return tuple(str(value) for value in item[0])
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+# Process-wide registry used by the instrumented modules
+metrics = MetricsRegistry()
@@ -0,0 +1,227 @@
+"""Append-only queue of byte payloads in segment files on local disk.
+
+Payloads get consecutive offsets. Each is stored as a frame, which is its
+4-byte big-endian length and CRC-32 followed by the payload, in a segment
+file named after the offset of its first record (``<offset>.log``). Next
+to it, ``<offset>.idx`` holds the 8-byte position of every frame, so a
+read can seek straight to any offset. Readers keep their place with named
+cursors, and segments every cursor has moved past are deleted.
+"""
+import mmap
+import os
+import struct
+import threading
+import zlib
+from src.utils.logging import logger
+from src.utils.state_file import read_state, write_state
+
+_FRAME = struct.Struct('>II')  # payload length, CRC-32 of the payload
+_POSITION = struct.Struct('>Q')
+
+class SegmentQueue:
+    """A directory of segments, appended to under a lock and readable concurrently.
+
+    Appends are buffered; ``flush`` hands them to the OS and, with
+    ``fsync``, to the disk. A torn frame at the end of the last segment, left
+    by a crash, is cut off when the queue is opened again. With ``readonly``
+    the queue can be scanned while another process appends to it.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, fsync=False, readonly=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.readonly = readonly
+
+        self._lock = threading.Lock()
+        self._log = None
+        self._index = None
+        if readonly:
+            self._refresh()
+            return
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._bases = _segment_bases(directory)
+        if self._bases:
+            self._size, count = self._recover(self._bases[-1])
+            self._next_offset = self._bases[-1] + count
+            self._open(self._bases[-1], 'ab')
+        else:
+            self._next_offset = 0
+            self._start_segment()
+
+    @property
+    def start_offset(self):
+        """Offset of the oldest record still stored."""
+        return self._bases[0] if self._bases else self._next_offset
+
+    @property
+    def end_offset(self):
+        """Offset the next appended record will get."""
+        return self._next_offset
+
+    def append(self, payloads):
+        """Append payloads in order; returns the offset of the first one."""
+        if self.readonly:
+            raise ValueError(f"Queue {self.directory} is open read-only")
+        with self._lock:
+            first = self._next_offset
+            for payload in payloads:
+                if self._size >= self.segment_bytes:
+                    self._roll()
+                self._index.write(_POSITION.pack(self._size))
+                self._log.write(_FRAME.pack(len(payload), zlib.crc32(payload)))
+                self._log.write(payload)
+                self._size += _FRAME.size + len(payload)
+                self._next_offset += 1
+            return first
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def read(self, offset, max_records=1000):
+        """Return up to ``max_records`` ``(offset, payload)`` pairs starting at ``offset``."""
+        records = []
+        for item in self.scan(offset):
+            records.append(item)
+            if len(records) >= max_records:
+                break
+        return records
+
+    def scan(self, offset=None, end=None):
+        """Yield ``(offset, payload)`` from ``offset`` (default: the oldest) up to ``end``.
+
+        Segments are read through memory maps, front to back. ``end``
+        defaults to the end of the queue when the scan starts.
+        """
+        with self._lock:
+            if self.readonly:
+                self._refresh()
+            else:
+                self._flush()
+            bases = list(self._bases)
+            end = self._next_offset if end is None else min(end, self._next_offset)
+        if not bases:
+            return
+        offset = bases[0] if offset is None else max(offset, bases[0])
+        for n, base in enumerate(bases):
+            next_base = bases[n + 1] if n + 1 < len(bases) else end
+            if next_base <= offset or base >= end:
+                continue
+            try:
+                yield from self._scan_segment(base, max(offset, base), min(next_base, end))
+            except FileNotFoundError:
+                continue  # Deleted by truncate_before meanwhile
+
+    def committed(self, name):
+        """Offset a named reader has processed up to (exclusive), or the oldest offset."""
+        state = read_state(self._cursor_path(name))
+        return max(state['offset'], self.start_offset) if state else self.start_offset
+
+    def commit(self, name, offset):
+        """Durably record that a named reader has processed everything before ``offset``."""
+        write_state(self._cursor_path(name), {'offset': offset})
+
+    def truncate_before(self, offset):
+        """Delete segments whose records all lie before ``offset``; the active one is kept."""
+        with self._lock:
+            while len(self._bases) > 1 and self._bases[1] <= offset:
+                base = self._bases.pop(0)
+                for suffix in ('.log', '.idx'):
+                    os.remove(self._path(base, suffix))
+                logger.debug("Deleted segment %d of %s", base, self.directory)
+
+    def close(self):
+        if self.readonly:
+            return
+        with self._lock:
+            self._flush()
+            self._log.close()
+            self._index.close()
+
+    def _scan_segment(self, base, offset, end):
+        with open(self._path(base, '.idx'), 'rb') as f:
+            f.seek((offset - base) * _POSITION.size)
+            position = _POSITION.unpack(f.read(_POSITION.size))[0]
+        with open(self._path(base, '.log'), 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for current in range(offset, end):
+                    if position + _FRAME.size > len(data):
+                        return  # Still being written by another process
+                    length, crc = _FRAME.unpack_from(data, position)
+                    position += _FRAME.size
+                    if position + length > len(data):
+                        return
+                    payload = data[position:position + length]
+                    position += length
+                    if zlib.crc32(payload) != crc:
+                        raise ValueError(f"Corrupt record {current} in {self.directory}")
+                    yield current, payload
+
+    def _recover(self, base):
+        """Cut a torn tail off a segment and rebuild its index; returns ``(size, records)``."""
+        log_path = self._path(base, '.log')
+        positions = []
+        end = 0
+        with open(log_path, 'rb') as f:
+            data = f.read()
+        while end + _FRAME.size <= len(data):
+            length, crc = _FRAME.unpack_from(data, end)
+            payload_end = end + _FRAME.size + length
+            if payload_end > len(data) or zlib.crc32(data[end + _FRAME.size:payload_end]) != crc:
+                break
+            positions.append(end)
+            end = payload_end
+        if end != len(data):
+            logger.warning(f"Dropped {len(data) - end} bytes of a torn record from {log_path}")
+            with open(log_path, 'rb+') as f:
+                f.truncate(end)
+        with open(self._path(base, '.idx'), 'wb') as f:
+            f.write(b''.join(_POSITION.pack(p) for p in positions))
+        return end, len(positions)
+
+    def _refresh(self):
+        """Pick up segments and records another process appended. Read-only queues only."""
+        self._bases = _segment_bases(self.directory) if os.path.exists(self.directory) else []
+        self._next_offset = 0
+        if self._bases:
+            try:
+                size = os.path.getsize(self._path(self._bases[-1], '.idx'))
+            except FileNotFoundError:
+                size = 0
+            self._next_offset = self._bases[-1] + size // _POSITION.size
+
+    def _start_segment(self):
+        base = self._next_offset
+        self._bases.append(base)
+        self._size = 0
+        self._open(base, 'wb')
+
+    def _open(self, base, mode):
+        self._log = open(self._path(base, '.log'), mode)
+        self._index = open(self._path(base, '.idx'), mode)
+
+    def _roll(self):
+        self._flush()
+        self._log.close()
+        self._index.close()
+        self._start_segment()
+
+    def _flush(self):
+        if self._log is None:
+            return
+        self._log.flush()
+        self._index.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+            os.fsync(self._index.fileno())
+
+    def _path(self, base, suffix):
+        return os.path.join(self.directory, f"{base:020d}{suffix}")
+
+    def _cursor_path(self, name):
+        return os.path.join(self.directory, f"cursor-{name}.json")
+
+def _segment_bases(directory):
+    return sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith('.log'))
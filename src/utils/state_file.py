@@ -0,0 +1,26 @@
+import json
+import os
+
+def read_state(path):
+    """Read a small JSON state file, returning None if it is missing or unreadable."""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_state(path, state):
+    """Durably replace a small JSON state file (write, fsync, rename)."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def remove_state(path):
+    """Delete a state file if it exists."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
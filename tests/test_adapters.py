@@ -1,7 +1,65 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+try:
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.ioloop import IOLoop
+    from pyftpdlib.servers import FTPServer
+except ImportError:
+    FTPServer = None
 from src.adapters.batch.api_adapter import ApiAdapter
-from src.adapters.batch.ftp_adapter import FtpAdapter
+from src.adapters.batch.csv_adapter import CsvAdapter
+from src.adapters.batch.csv_parsing import compile_frame_check, iter_chunks, parse_text
+from src.adapters.batch.ftp_adapter import FtpAdapter, iter_json_records
+from src.adapters.streaming.fake_broker import InMemoryBroker
 from src.adapters.streaming.kafka_adapter import KafkaAdapter
+from src.schema_registry.registry import SchemaRegistry
+from src.utils.dir_watcher import DirectoryWatcher
+
+LOCATION_SCHEMA = {
+    "schema_id": "location_v1",
+    "version": 1,
+    "type": "json",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "vehicle_id": {"type": "string"},
+            "lat": {"type": "number"},
+            "lng": {"type": "number"},
+            "timestamp": {"type": "string"}
+        },
+        "required": ["vehicle_id", "lat", "lng", "timestamp"]
+    }
+}
+
+class RecordingDispatcher:
+    def __init__(self, schema_registry=None):
+        self.schema_registry = schema_registry
+        self.batches = []
+        self.rejected = []
+
+    def receive_batch(self, records, source_name, schema_id, on_done=None):
+        self.batches.append((list(records), source_name, schema_id))
+        if on_done is not None:
+            on_done()
+        return len(records)
+
+    def receive_validated_batch(self, accepted, rejected, source_name, schema_id, on_done=None):
+        if accepted:
+            self.batches.append((list(accepted), source_name, schema_id))
+        self.rejected.extend(rejected)
+        if on_done is not None:
+            on_done()
+        return len(accepted)
 
 class TestAdapters(unittest.TestCase):
 
@@ -34,5 +92,613 @@ class TestAdapters(unittest.TestCase):
         messages = self.kafka_adapter.consume_messages()
         self.assertIsInstance(messages, list)
 
+class TestCsvAdapter(unittest.TestCase):
+
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+        registry = SchemaRegistry(schema_dir=os.path.join(self.input_dir, "schemas"))
+        registry.register_schema("location_v1", LOCATION_SCHEMA)
+        self.dispatcher = RecordingDispatcher(registry)
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir, ignore_errors=True)
+
+    def test_rows_are_sent_in_batches(self):
+        adapter = CsvAdapter(self.dispatcher, input_dir=self.input_dir, batch_size=2)
+        adapter.ingest()
+        
+        # The sample file has three rows: one full batch and one partial batch
+        self.assertEqual([len(b[0]) for b in self.dispatcher.batches], [2, 1])
+        self.assertEqual(self.dispatcher.batches[0][0][0]["lat"], 37.7749)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.input_dir, "processed", "sample_locations.csv")))
+
+    def write_csv(self, filename, rows):
+        with open(os.path.join(self.input_dir, filename), "w") as f:
+            f.write("vehicle_id,lat,lng,timestamp\n")
+            for row in rows:
+                f.write(",".join(str(v) for v in row) + "\n")
+
+    def test_parallel_parsing_splits_large_files(self):
+        rows = [(f"VEH-{n}", 37.0 + n / 1000, -122.1, "2023-10-01T08:00:00Z") for n in range(500)]
+        rows[10] = ("VEH-BAD", "not_a_number", -122.1, "2023-10-01T08:00:00Z")
+        self.write_csv("big.csv", rows)
+        
+        adapter = CsvAdapter(self.dispatcher, input_dir=self.input_dir, batch_size=100,
+                             workers=2, chunk_bytes=2048)
+        adapter.ingest()
+        
+        vehicle_ids = [r["vehicle_id"] for batch in self.dispatcher.batches for r in batch[0]]
+        self.assertEqual(len(vehicle_ids), 499 + 3)  # plus the sample file
+        self.assertEqual(len(set(vehicle_ids)), len(vehicle_ids))
+        self.assertEqual([r[0]["vehicle_id"] for r in self.dispatcher.rejected], ["VEH-BAD"])
+        self.assertTrue(all(len(batch[0]) <= 100 for batch in self.dispatcher.batches))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.input_dir, "processed"))),
+                         ["big.csv", "sample_locations.csv"])
+
+class CrashingDispatcher(RecordingDispatcher):
+    def __init__(self, schema_registry, crash_after):
+        super().__init__(schema_registry)
+        self.crash_after = crash_after
+
+    def receive_validated_batch(self, accepted, rejected, source_name, schema_id, on_done=None):
+        if len(self.batches) >= self.crash_after:
+            raise RuntimeError("crash")
+        return super().receive_validated_batch(accepted, rejected, source_name, schema_id, on_done)
+
+class TestCsvCheckpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+        self.registry = SchemaRegistry(schema_dir=os.path.join(self.input_dir, "schemas"))
+        self.registry.register_schema("location_v1", LOCATION_SCHEMA)
+        self.filepath = os.path.join(self.input_dir, "sample_locations.csv")
+        with open(self.filepath, "w") as f:
+            f.write("vehicle_id,lat,lng,timestamp\n")
+            for n in range(10):
+                f.write(f"VEH-{n},37.5,-122.1,2023-10-01T08:00:00Z\n")
+        self.checkpoint_path = os.path.join(self.input_dir, ".sample_locations.csv.checkpoint")
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir, ignore_errors=True)
+
+    def ingest(self, dispatcher, workers=1):
+        adapter = CsvAdapter(dispatcher, input_dir=self.input_dir, batch_size=3,
+                             checkpoint_rows=3, workers=workers, chunk_bytes=100)
+        adapter.ingest()
+
+    def vehicle_ids(self, dispatcher):
+        return [r["vehicle_id"] for batch in dispatcher.batches for r in batch[0]]
+
+    def test_restart_resumes_after_last_checkpoint(self):
+        crashed = CrashingDispatcher(self.registry, crash_after=2)
+        self.ingest(crashed)
+        self.assertEqual(self.vehicle_ids(crashed), [f"VEH-{n}" for n in range(6)])
+        self.assertTrue(os.path.exists(self.checkpoint_path))
+        self.assertTrue(os.path.exists(self.filepath))
+        
+        resumed = RecordingDispatcher(self.registry)
+        self.ingest(resumed)
+        self.assertEqual(self.vehicle_ids(resumed), [f"VEH-{n}" for n in range(6, 10)])
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+        self.assertTrue(os.path.exists(os.path.join(self.input_dir, "processed", "sample_locations.csv")))
+
+    def test_parallel_restart_resumes_after_last_range(self):
+        crashed = CrashingDispatcher(self.registry, crash_after=1)
+        self.ingest(crashed, workers=2)
+        first_run = self.vehicle_ids(crashed)
+        
+        resumed = RecordingDispatcher(self.registry)
+        self.ingest(resumed, workers=2)
+        self.assertEqual(first_run + self.vehicle_ids(resumed), [f"VEH-{n}" for n in range(10)])
+
+    def test_checkpoint_waits_for_batches_to_be_delivered(self):
+        dispatcher = DeferredDispatcher()
+        dispatcher.schema_registry = self.registry
+        self.ingest(dispatcher)
+        self.assertEqual(len(dispatcher.unfinished), 4)
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+        
+        # Later batches finishing first do not move the checkpoint past earlier ones
+        for on_done in reversed(dispatcher.unfinished[1:]):
+            on_done()
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+        self.assertTrue(os.path.exists(self.filepath))
+        dispatcher.unfinished[0]()
+        self.assertFalse(os.path.exists(self.filepath))
+        self.assertTrue(os.path.exists(os.path.join(self.input_dir, "processed", "sample_locations.csv")))
+
+    def test_parallel_checkpoint_waits_for_batches_to_be_delivered(self):
+        dispatcher = DeferredDispatcher()
+        dispatcher.schema_registry = self.registry
+        self.ingest(dispatcher, workers=2)
+        self.assertTrue(os.path.exists(self.filepath))
+        for on_done in dispatcher.unfinished:
+            on_done()
+        self.assertTrue(os.path.exists(os.path.join(self.input_dir, "processed", "sample_locations.csv")))
+
+    def test_changed_file_starts_over(self):
+        self.ingest(CrashingDispatcher(self.registry, crash_after=2))
+        with open(self.filepath, "a") as f:
+            f.write("VEH-10,37.5,-122.1,2023-10-01T08:00:00Z\n")
+        
+        resumed = RecordingDispatcher(self.registry)
+        self.ingest(resumed)
+        self.assertEqual(len(self.vehicle_ids(resumed)), 11)
+
+class TestDirectoryWatching(unittest.TestCase):
+
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+        self.found = []
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir, ignore_errors=True)
+
+    def write(self, filename, text, age=0):
+        path = os.path.join(self.input_dir, filename)
+        with open(path, "w") as f:
+            f.write(text)
+        if age:
+            os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.05)
+        return condition()
+
+    def test_polling_waits_for_files_to_settle(self):
+        watcher = DirectoryWatcher(self.input_dir, self.found.append, settle_time=60,
+                                   use_inotify=False)
+        done = self.write("done.csv", "a\n", age=120)
+        self.write("writing.csv", "a\n")
+        self.write("notes.txt", "a\n", age=120)
+        watcher.scan()
+        watcher.scan()
+        self.assertEqual(self.found, [done])
+        
+        # Once the second file has been quiet long enough it is reported too
+        writing = self.write("writing.csv", "a\nb\n", age=120)
+        watcher.scan()
+        self.assertEqual(self.found, [done, writing])
+
+    def test_file_with_same_name_is_picked_up_again_after_moving_away(self):
+        watcher = DirectoryWatcher(self.input_dir, self.found.append, settle_time=0,
+                                   use_inotify=False)
+        path = self.write("drop.csv", "a\n")
+        watcher.scan()
+        os.remove(path)
+        watcher.scan()
+        time.sleep(0.01)  # Make sure the directory mtime changes
+        self.write("drop.csv", "b\n")
+        watcher.scan()
+        self.assertEqual(self.found, [path, path])
+
+    def test_report_changes_covers_rewrites_and_removals(self):
+        watcher = DirectoryWatcher(self.input_dir, self.found.append, suffix=".json", settle_time=0,
+                                   use_inotify=False, report_changes=True)
+        path = self.write("a.json", "{}")
+        watcher.scan()
+        watcher.scan()
+        self.assertEqual(self.found, [path])
+        
+        # An in-place rewrite leaves the directory mtime alone but is still reported
+        with open(path, "w") as f:
+            f.write('{"b": 1}')
+        os.utime(path, (time.time() - 10, time.time() - 10))
+        watcher.scan()
+        os.remove(path)
+        watcher.scan()
+        self.assertEqual(self.found, [path, path, path])
+        
+    def test_inotify_reports_closed_files(self):
+        watcher = DirectoryWatcher(self.input_dir, self.found.append, poll_interval=0.1)
+        if not watcher.uses_inotify:
+            self.skipTest("inotify is not available")
+        watcher.start()
+        try:
+            path = self.write("new.csv", "a\n")
+            self.assertTrue(self.wait_for(lambda: self.found == [path]))
+        finally:
+            watcher.stop()
+
+    def test_inotify_stop_wakes_the_watcher_before_closing(self):
+        watcher = DirectoryWatcher(self.input_dir, self.found.append, poll_interval=30)
+        if not watcher.uses_inotify:
+            self.skipTest("inotify is not available")
+        watcher.start()
+        time.sleep(0.1)  # Let the thread block in select()
+        started = time.time()
+        watcher.stop()
+        self.assertLess(time.time() - started, 5)
+        self.assertFalse(watcher._thread.is_alive())
+        self.assertIsNone(watcher._inotify_fd)
+        self.assertIsNone(watcher._wakeup)
+
+    def test_csv_adapter_watch_processes_new_files(self):
+        registry = SchemaRegistry(schema_dir=os.path.join(self.input_dir, "schemas"))
+        registry.register_schema("location_v1", LOCATION_SCHEMA)
+        dispatcher = RecordingDispatcher(registry)
+        adapter = CsvAdapter(dispatcher, input_dir=self.input_dir)
+        adapter.watch(poll_interval=0.05, settle_time=0.1, use_inotify=False)
+        try:
+            self.assertTrue(self.wait_for(lambda: len(dispatcher.batches) == 1))
+            self.write("later.csv", "vehicle_id,lat,lng,timestamp\n"
+                                    "VEH-9,37.1,-122.1,2023-10-01T08:00:00Z\n")
+            self.assertTrue(self.wait_for(lambda: len(dispatcher.batches) == 2))
+        finally:
+            adapter.close()
+        self.assertEqual(dispatcher.batches[1][0][0]["vehicle_id"], "VEH-9")
+        self.assertTrue(os.path.exists(os.path.join(self.input_dir, "processed", "later.csv")))
+
+class FlakyDispatcher(RecordingDispatcher):
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def receive_batch(self, records, source_name, schema_id, on_done=None):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("Dispatcher is busy.")
+        return super().receive_batch(records, source_name, schema_id, on_done)
+
+class DeferredDispatcher(RecordingDispatcher):
+    """Queues batches like the pipelined dispatcher, finishing them when told to."""
+
+    def __init__(self):
+        super().__init__()
+        self.unfinished = []
+
+    def receive_batch(self, records, source_name, schema_id, on_done=None):
+        self.unfinished.append(on_done)
+        return super().receive_batch(records, source_name, schema_id)
+
+    def receive_validated_batch(self, accepted, rejected, source_name, schema_id, on_done=None):
+        self.unfinished.append(on_done)
+        return super().receive_validated_batch(accepted, rejected, source_name, schema_id)
+
+class TestKafkaAdapter(unittest.TestCase):
+
+    def setUp(self):
+        self.broker = InMemoryBroker()
+        self.broker.create_topic("locations", partitions=3)
+        for n in range(30):
+            self.broker.produce("locations", {"vehicle_id": f"VEH-{n}"})
+
+    def consume(self, dispatcher, expected, timeout=5, **kwargs):
+        adapter = KafkaAdapter(dispatcher, topic="locations", max_poll_records=4, poll_timeout=0.05,
+                               retry_backoff=0.01, consumer=self.broker.consumer("locations", "test"),
+                               **kwargs)
+        adapter.ingest()
+        deadline = time.time() + timeout
+        while sum(len(b[0]) for b in dispatcher.batches) < expected and time.time() < deadline:
+            time.sleep(0.01)
+        adapter.close()
+
+    def committed(self):
+        return [self.broker.committed("test", "locations", p) for p in range(3)]
+
+    def test_batches_are_dispatched_per_partition_and_committed(self):
+        dispatcher = RecordingDispatcher()
+        self.consume(dispatcher, 30)
+        
+        self.assertTrue(all(len(b[0]) <= 4 for b in dispatcher.batches))
+        ids = [r["vehicle_id"] for b in dispatcher.batches for r in b[0]]
+        self.assertEqual(sorted(ids), sorted(f"VEH-{n}" for n in range(30)))
+        # Each partition is dispatched in offset order
+        partition = [r["vehicle_id"] for b in dispatcher.batches for r in b[0]
+                     if int(r["vehicle_id"][4:]) % 3 == 1]
+        self.assertEqual(partition, [f"VEH-{n}" for n in range(1, 30, 3)])
+        self.assertEqual(self.committed(), [10, 10, 10])
+
+    def test_rejected_batches_are_retried_before_committing(self):
+        dispatcher = FlakyDispatcher(failures=3)
+        self.consume(dispatcher, 30)
+        
+        self.assertEqual(sum(len(b[0]) for b in dispatcher.batches), 30)
+        self.assertEqual(self.committed(), [10, 10, 10])
+
+    def test_uncommitted_records_are_redelivered_after_restart(self):
+        dispatcher = FlakyDispatcher(failures=10 ** 6)
+        self.consume(dispatcher, 1, timeout=0.2)
+        self.assertEqual(self.committed(), [0, 0, 0])
+        
+        dispatcher = RecordingDispatcher()
+        self.consume(dispatcher, 30)
+        self.assertEqual(sum(len(b[0]) for b in dispatcher.batches), 30)
+
+    def test_offsets_wait_for_queued_batches_to_finish(self):
+        dispatcher = DeferredDispatcher()
+        adapter = KafkaAdapter(dispatcher, topic="locations", max_poll_records=4, poll_timeout=0.05,
+                               consumer=self.broker.consumer("locations", "test"))
+        adapter.ingest()
+        deadline = time.time() + 5
+        while sum(len(b[0]) for b in dispatcher.batches) < 30 and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.assertEqual(self.committed(), [0, 0, 0])
+        # Later batches finishing first do not move the offset past earlier ones
+        for on_done in reversed(dispatcher.unfinished[1:]):
+            on_done()
+        adapter.close()
+        self.assertEqual(sorted(self.committed()), [0, 10, 10])
+
+    def test_offsets_advance_past_batches_the_pipeline_failed_to_dispatch(self):
+        from src.dispatcher.pipeline import PipelinedDispatcher
+        
+        class FailingSink:
+            def write(self, stream, records, schema_id=None):
+                raise IOError("disk full")
+
+            def close(self):
+                pass
+        
+        schema_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, schema_dir, True)
+        registry = SchemaRegistry(schema_dir=schema_dir)
+        registry.register_schema("location_v1", LOCATION_SCHEMA)
+        # The records are rejected, and writing them to the rejected stream raises
+        dispatcher = PipelinedDispatcher(registry, output_dir=schema_dir, output_sink=FailingSink())
+        adapter = KafkaAdapter(dispatcher, topic="locations", max_poll_records=4, poll_timeout=0.05,
+                               consumer=self.broker.consumer("locations", "test"))
+        adapter.ingest()
+        deadline = time.time() + 5
+        while self.committed() != [10, 10, 10] and time.time() < deadline:
+            time.sleep(0.01)
+        adapter.close()
+        dispatcher.close()
+        self.assertEqual(self.committed(), [10, 10, 10])
+
+    def test_revocation_gives_up_on_a_stuck_partition(self):
+        dispatcher = FlakyDispatcher(failures=10 ** 6)
+        adapter = KafkaAdapter(dispatcher, topic="locations", max_poll_records=4, poll_timeout=0.05,
+                               retry_backoff=0.01, revoke_timeout=0.1,
+                               consumer=self.broker.consumer("locations", "test"))
+        adapter.ingest()
+        time.sleep(0.1)
+        started = time.time()
+        adapter._on_partitions_revoked([0, 1, 2])
+        self.assertLess(time.time() - started, 1)
+        adapter.close()
+        self.assertEqual(self.committed(), [0, 0, 0])
+
+    def test_avro_payloads_are_decoded_in_batches(self):
+        from src.schema_registry.wire_format import AvroCodec
+        schema_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, schema_dir, True)
+        registry = SchemaRegistry(schema_dir=schema_dir)
+        registry.register_schema("location_avro_v1", {
+            "schema_id": "location_avro_v1", "version": 1, "type": "avro",
+            "schema": {"type": "record", "name": "Location", "fields": [
+                {"name": "vehicle_id", "type": "string"}, {"name": "lat", "type": "double"}]}
+        })
+        codec = AvroCodec(registry)
+        self.broker = InMemoryBroker()
+        self.broker.create_topic("locations", partitions=3)
+        for n in range(9):
+            record = {"vehicle_id": f"VEH-{n}", "lat": n}
+            self.broker.produce("locations", codec.encode(record, "location_avro_v1"))
+        self.broker.produce("locations", b"\x00garbage")
+
+        dispatcher = RecordingDispatcher(registry)
+        self.consume(dispatcher, 9, schema_id="location_avro_v1", value_format="avro")
+        records = sorted((r for b in dispatcher.batches for r in b[0]), key=lambda r: r["lat"])
+        self.assertEqual(records, [{"vehicle_id": f"VEH-{n}", "lat": float(n)} for n in range(9)])
+        self.assertEqual(len(dispatcher.rejected), 1)
+        self.assertEqual(sum(self.committed()), 10)
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    """Serves three pages of vehicle records, each with an ETag."""
+
+    pages = 3
+    per_page = 5
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        page = int(query.get("page", ["1"])[0])
+        self.server.requests.append((page, self.headers.get("If-None-Match")))
+        if page in self.server.fail_once:
+            self.server.fail_once.discard(page)
+            self.send_response(500)
+            self.end_headers()
+            return
+        etag = f'"page-{page}-v{self.server.version}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        
+        records = [{"vehicle_id": f"VEH-{page}-{n}"} for n in range(self.per_page)]
+        body = json.dumps({"data": records, "total_pages": self.pages}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestApiAdapter(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubApiHandler)
+        self.server.requests = []
+        self.server.version = 1
+        self.server.fail_once = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/vehicles"
+        self.dispatcher = RecordingDispatcher()
+        self.adapter = ApiAdapter(self.dispatcher, endpoints=[self.url], page_workers=2)
+
+    def tearDown(self):
+        self.adapter.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def vehicle_ids(self):
+        return [r["vehicle_id"] for batch in self.dispatcher.batches for r in batch[0]]
+
+    def test_all_pages_are_dispatched_in_order(self):
+        self.assertEqual(self.adapter.poll(), 15)
+        self.assertEqual(self.vehicle_ids(),
+                         [f"VEH-{page}-{n}" for page in range(1, 4) for n in range(5)])
+
+    def test_unchanged_pages_are_skipped(self):
+        self.adapter.poll()
+        self.assertEqual(self.adapter.poll(), 0)
+        self.assertEqual(len(self.dispatcher.batches), 3)
+        # The second poll sent every page's ETag back
+        self.assertTrue(all(etag for _, etag in self.server.requests[3:]))
+        
+        self.server.version = 2
+        self.assertEqual(self.adapter.poll(), 15)
+
+    def test_pages_of_a_failed_poll_are_fetched_again(self):
+        self.server.fail_once.add(2)
+        self.assertEqual(self.adapter.poll(), 5)  # Page 1 got through before page 2 failed
+        self.assertEqual(self.adapter.poll(), 10)
+        self.assertEqual(sorted(set(self.vehicle_ids())),
+                         [f"VEH-{page}-{n}" for page in range(1, 4) for n in range(5)])
+
+    def test_polls_run_at_a_fixed_rate(self):
+        adapter = ApiAdapter(self.dispatcher, endpoints=[self.url], interval=0.1)
+        adapter.ingest()
+        time.sleep(0.55)
+        adapter.close()
+        first_pages = [r for r in self.server.requests if r[0] == 1]
+        self.assertIn(len(first_pages), (5, 6, 7))
+
+@unittest.skipIf(FTPServer is None, "pyftpdlib is not installed")
+class TestFtpAdapter(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.remote_dir = os.path.join(self.root, "remote")
+        os.makedirs(self.remote_dir)
+        authorizer = DummyAuthorizer()
+        authorizer.add_user("user", "pass", self.remote_dir, perm="elr")
+        handler = type("Handler", (FTPHandler,), {"authorizer": authorizer})
+        self.server = FTPServer(("127.0.0.1", 0), handler, ioloop=IOLoop())
+        threading.Thread(target=self.server.serve_forever, kwargs={"timeout": 0.05},
+                         daemon=True).start()
+        
+        registry = SchemaRegistry(schema_dir=os.path.join(self.root, "schemas"))
+        registry.register_schema("location_v1", LOCATION_SCHEMA)
+        self.dispatcher = RecordingDispatcher(registry)
+        self.adapter = self.make_adapter()
+
+    def tearDown(self):
+        self.adapter.close()
+        self.server.close_all()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def make_adapter(self):
+        return FtpAdapter(self.dispatcher, "127.0.0.1", port=self.server.address[1],
+                          username="user", password="pass", connections=2, batch_size=2,
+                          listing_cache=os.path.join(self.root, "state", "listing.json"))
+
+    def write(self, filename, text):
+        with open(os.path.join(self.remote_dir, filename), "w") as f:
+            f.write(text)
+
+    def vehicle_ids(self):
+        return sorted(r["vehicle_id"] for batch in self.dispatcher.batches for r in batch[0])
+
+    def test_files_are_streamed_into_the_parsers(self):
+        self.write("a.csv", "vehicle_id,lat,lng,timestamp\n"
+                            "VEH-1,37.1,-122.1,2023-10-01T08:00:00Z\n"
+                            "VEH-2,37.2,-122.2,2023-10-01T08:00:00Z\n"
+                            "VEH-BAD,north,-122.2,2023-10-01T08:00:00Z\n")
+        self.write("b.jsonl", "".join(json.dumps({"vehicle_id": f"VEH-{n}"}) + "\n"
+                                      for n in range(3, 6)))
+        self.write("c.json", json.dumps([{"vehicle_id": "VEH-6"}]))
+        self.write("notes.txt", "ignored")
+        self.adapter.ingest()
+        
+        self.assertEqual(self.vehicle_ids(), [f"VEH-{n}" for n in range(1, 7)])
+        self.assertEqual([r[0]["vehicle_id"] for r in self.dispatcher.rejected], ["VEH-BAD"])
+        self.assertTrue(all(len(batch[0]) <= 2 for batch in self.dispatcher.batches))
+
+    def test_ingested_files_are_skipped_until_they_change(self):
+        self.write("a.jsonl", json.dumps({"vehicle_id": "VEH-1"}) + "\n")
+        self.adapter.ingest()
+        self.adapter.close()
+        
+        # A new adapter reads the listing cache left by the first one
+        self.adapter = self.make_adapter()
+        self.write("b.jsonl", json.dumps({"vehicle_id": "VEH-2"}) + "\n")
+        self.adapter.ingest()
+        self.assertEqual(self.vehicle_ids(), ["VEH-1", "VEH-2"])
+        
+        self.write("a.jsonl", json.dumps({"vehicle_id": "VEH-1"}) + "\n"
+                              + json.dumps({"vehicle_id": "VEH-3"}) + "\n")
+        self.adapter.ingest()
+        self.assertEqual(self.vehicle_ids(), ["VEH-1", "VEH-1", "VEH-2", "VEH-3"])
+
+class TestJsonStreaming(unittest.TestCase):
+
+    def test_array_elements_are_decoded_across_chunk_boundaries(self):
+        records = [{"vehicle_id": f"VEH-{n}", "lat": 37.123456 + n} for n in range(20)] + [12345, "x"]
+        data = json.dumps(records, indent=2).encode('utf-8')
+        for chunk_size in (1, 7, 64):
+            self.assertEqual(list(iter_json_records(io.BytesIO(data), chunk_size)), records)
+        self.assertEqual(list(iter_json_records(io.BytesIO(b" [ ] "))), [])
+
+    def test_a_single_object_is_one_record(self):
+        self.assertEqual(list(iter_json_records(io.BytesIO(b'{"vehicle_id": "VEH-1"}'))),
+                         [{"vehicle_id": "VEH-1"}])
+
+    def test_truncated_array_raises(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_records(io.BytesIO(b'[{"vehicle_id": "VEH-1"}, {"vehi'), 4))
+
+class TestCsvParsing(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = dict(LOCATION_SCHEMA["schema"])
+        self.schema["properties"] = dict(self.schema["properties"], lat={"type": "number", "maximum": 90})
+        self.fieldnames = ["vehicle_id", "lat", "lng", "timestamp"]
+        self.text = (
+            'VEH-1,37.5,-122.1,2023-10-01T08:00:00Z\n'
+            'VEH-2,not_a_number,-122.1,2023-10-01T08:00:00Z\n'
+            'VEH-3,120,-122.1,2023-10-01T08:00:00Z\n'
+            '"VEH-4, quoted",1_0,-122.1,2023-10-01T08:00:00Z\n'
+            'VEH-5,37.5\n'
+            '\n'
+            'VEH-6,37.5,-122.1,2023-10-01T08:00:00Z,extra\n'
+        )
+
+    def test_vectorized_matches_per_row_path(self):
+        if compile_frame_check(self.schema) is None:
+            self.skipTest("pandas is not installed")
+        fast = parse_text(self.text, self.fieldnames, self.schema, vectorized=True)
+        slow = parse_text(self.text, self.fieldnames, self.schema, vectorized=False)
+        
+        key = lambda row: row["vehicle_id"]
+        self.assertEqual(sorted(fast[0], key=key), sorted(slow[0], key=key))
+        self.assertEqual(sorted(fast[1], key=lambda r: key(r[0])), sorted(slow[1], key=lambda r: key(r[0])))
+        self.assertEqual(sorted(key(r) for r in fast[0]), ["VEH-1", "VEH-4, quoted", "VEH-6"])
+        self.assertIs(type(fast[0][0]["lat"]), float)
+
+    def test_complex_schema_is_not_vectorized(self):
+        schema = dict(self.schema, properties={"tags": {"type": "array"}})
+        self.assertIsNone(compile_frame_check(schema))
+
+    def test_chunks_keep_quoted_newlines_together(self):
+        filepath = os.path.join(tempfile.mkdtemp(), "multi.csv")
+        with open(filepath, "w") as f:
+            f.write('vehicle_id,lat,lng,timestamp\n"VEH\n1",1,2,t\nVEH-2,1,2,t\nVEH-3,1,2,t\n')
+        chunks = list(iter_chunks(filepath, 2))
+        resumed = list(iter_chunks(filepath, 2, start_offset=chunks[0][3]))
+        shutil.rmtree(os.path.dirname(filepath))
+        
+        self.assertEqual([rows for _, _, rows, _ in chunks], [2, 1])
+        self.assertEqual(resumed[0][1], 'VEH-3,1,2,t\n')
+        self.assertEqual(chunks[0][1], '"VEH\n1",1,2,t\nVEH-2,1,2,t\n')
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,5 +1,53 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from src.dispatcher.admission import AdmissionController, TokenBucket
 from src.dispatcher.core import Dispatcher
+from src.dispatcher.dead_letter import DeadLetterStore
+from src.dispatcher.dedup import Deduplicator, RotatingBloomFilter, TimeWindowIndex
+from src.dispatcher.pipeline import PipelinedDispatcher
+from src.dispatcher.routing import Route, RoutingTable, compile_predicate
+from src.replay import replay
+from src.schema_registry.registry import SchemaRegistry
+from src.utils.segment_queue import SegmentQueue
+
+LOCATION_SCHEMA = {
+    "schema_id": "location_v1",
+    "version": 1,
+    "type": "json",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "vehicle_id": {"type": "string"},
+            "lat": {"type": "number"},
+            "lng": {"type": "number"},
+            "timestamp": {"type": "string"}
+        },
+        "required": ["vehicle_id", "lat", "lng", "timestamp"]
+    }
+}
+
+def make_record(vehicle_id="123", lat=40.7128):
+    return {"vehicle_id": vehicle_id, "lat": lat, "lng": -74.0060, "timestamp": "2023-10-01T12:00:00Z"}
+
+class RecordingConsumer:
+    def __init__(self):
+        self.records = []
+
+    def process(self, data):
+        self.records.append(data)
+
+class RecordingBatchConsumer(RecordingConsumer):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def process_batch(self, records, source_name, schema_id):
+        self.batches.append((list(records), source_name, schema_id))
 
 class TestDispatcher(unittest.TestCase):
 
@@ -23,5 +71,568 @@ class TestDispatcher(unittest.TestCase):
         output = self.dispatcher.route_data(test_data)
         self.assertIn('output_destination', output)
 
+class TestBatchDispatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.registry = SchemaRegistry(schema_dir=os.path.join(self.tmp_dir, 'schemas'))
+        self.registry.register_schema("location_v1", LOCATION_SCHEMA)
+        self.output_dir = os.path.join(self.tmp_dir, 'output')
+        self.dispatcher = Dispatcher(self.registry, output_dir=self.output_dir)
+
+    def tearDown(self):
+        self.dispatcher.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_receive_batch_splits_accepted_and_rejected(self):
+        consumer = RecordingBatchConsumer()
+        self.dispatcher.register_consumer(consumer)
+        records = [make_record("A"), make_record("B", lat="bad"), make_record("C")]
+        
+        self.assertEqual(self.dispatcher.receive_batch(records, "csv", "location_v1"), 2)
+        self.assertEqual(len(consumer.batches), 1)
+        batch, source_name, schema_id = consumer.batches[0]
+        self.assertEqual([r["vehicle_id"] for r in batch], ["A", "C"])
+        self.assertEqual((source_name, schema_id), ("csv", "location_v1"))
+
+    def test_process_only_consumer_falls_back_to_per_record(self):
+        consumer = RecordingConsumer()
+        self.dispatcher.register_consumer(consumer)
+        self.dispatcher.receive_batch([make_record("A"), make_record("B")], "api", "location_v1")
+        self.assertEqual([r["vehicle_id"] for r in consumer.records], ["A", "B"])
+
+    def test_single_record_path_uses_process_batch(self):
+        consumer = RecordingBatchConsumer()
+        self.dispatcher.register_consumer(consumer)
+        self.assertTrue(self.dispatcher.receive_data(make_record("A"), "kafka", "location_v1"))
+        self.assertEqual(len(consumer.batches), 1)
+
+    def test_failing_consumer_does_not_block_others(self):
+        class Broken:
+            def process(self, data):
+                raise RuntimeError("boom")
+        consumer = RecordingConsumer()
+        self.dispatcher.register_consumer(Broken())
+        self.dispatcher.register_consumer(consumer)
+        self.dispatcher.receive_batch([make_record("A")], "api", "location_v1")
+        self.assertEqual(len(consumer.records), 1)
+
+    def test_batch_without_consumers_goes_to_output_sink(self):
+        records = [make_record("A"), make_record("B", lat="bad"), make_record("C")]
+        self.dispatcher.receive_batch(records, "csv", "location_v1")
+        self.dispatcher.close()
+        
+        files = sorted(os.listdir(self.output_dir))
+        self.assertEqual(len(files), 2)
+        self.assertTrue(files[0].startswith("csv_") and files[1].startswith("rejected_csv_"))
+        with open(os.path.join(self.output_dir, files[0])) as f:
+            self.assertEqual([json.loads(line)["vehicle_id"] for line in f], ["A", "C"])
+        with open(os.path.join(self.output_dir, files[1])) as f:
+            self.assertEqual(json.loads(f.readline())["data"]["vehicle_id"], "B")
+
+    def test_older_versions_are_validated_and_upcast(self):
+        location_v2 = json.loads(json.dumps(LOCATION_SCHEMA))
+        location_v2["version"] = 2
+        location_v2["schema"]["properties"]["speed"] = {"type": "number", "default": 0}
+        self.registry.register_schema("location_v1", location_v2)
+        consumer = RecordingBatchConsumer()
+        self.dispatcher.register_consumer(consumer)
+
+        records = [make_record("A"), make_record("B", lat="bad")]
+        self.assertEqual(self.dispatcher.receive_batch(records, "csv", "location_v1", version=1), 1)
+        self.assertEqual(consumer.batches[0][0], [dict(make_record("A"), speed=0)])
+
+class BlockingConsumer(RecordingBatchConsumer):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def process_batch(self, records, source_name, schema_id):
+        self.release.wait()
+        super().process_batch(records, source_name, schema_id)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestDeduplication(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.registry = SchemaRegistry(schema_dir=os.path.join(self.tmp_dir, 'schemas'))
+        self.registry.register_schema("location_v1", LOCATION_SCHEMA)
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_dispatcher_drops_duplicates_and_counts_them(self):
+        deduplicator = Deduplicator({"location_v1": ["vehicle_id", "timestamp"]})
+        dispatcher = Dispatcher(self.registry, output_dir=os.path.join(self.tmp_dir, 'output'),
+                                deduplicator=deduplicator)
+        consumer = RecordingBatchConsumer()
+        dispatcher.register_consumer(consumer)
+        
+        dispatcher.receive_batch([make_record("A"), make_record("B"), make_record("A")], "kafka", "location_v1")
+        dispatcher.receive_batch([make_record("B"), make_record("C")], "csv", "location_v1")
+        dispatcher.receive_data(make_record("C"), "api", "location_v1")
+        dispatcher.close()
+        
+        self.assertEqual([[r["vehicle_id"] for r in b[0]] for b in consumer.batches], [["A", "B"], ["C"]])
+        self.assertEqual(deduplicator.stats(), {"location_v1": {"hits": 3, "misses": 3}})
+
+    def test_other_schemas_pass_through(self):
+        deduplicator = Deduplicator({"location_v1": ["vehicle_id"]})
+        records = [{"id": 1}, {"id": 1}]
+        self.assertEqual(deduplicator.filter(records, "trip_v1"), records)
+
+    def test_window_index_forgets_expired_keys(self):
+        index = TimeWindowIndex(window=10, clock=self.clock)
+        self.assertFalse(index.add(("A", 1)))
+        self.clock.now = 5
+        self.assertTrue(index.add(("A", 1)))
+        self.assertFalse(index.add(("B", 1)))
+        self.clock.now = 12
+        self.assertFalse(index.add(("A", 1)))  # Expired at 10
+        self.assertEqual(len(index), 2)  # B is still within its window
+
+    def test_window_index_is_bounded(self):
+        index = TimeWindowIndex(window=10, max_keys=3, clock=self.clock)
+        for n in range(5):
+            index.add(n)
+        self.assertEqual(len(index), 3)
+        self.assertTrue(index.add(4))
+        self.assertFalse(index.add(0))
+
+    def test_bloom_filter_remembers_keys_for_the_window(self):
+        bloom = RotatingBloomFilter(window=10, capacity=2000, error_rate=0.001, clock=self.clock)
+        self.assertFalse(bloom.add(("A", 1)))
+        self.clock.now = 9.9
+        self.assertTrue(bloom.add(("A", 1)))
+        self.clock.now = 20
+        self.assertFalse(bloom.add(("A", 1)))
+        
+        misses = sum(not bloom.add(n) for n in range(1000))
+        self.assertGreater(misses, 990)
+
+    def test_bloom_filter_batches_match_single_adds(self):
+        deduplicator = Deduplicator({"location_v1": ["vehicle_id"]},
+                                    lambda: RotatingBloomFilter(window=10, capacity=1000))
+        records = [make_record(v) for v in ["A", "B", "A", "C", "B"]]
+        unique = deduplicator.filter(records, "location_v1")
+        self.assertEqual([r["vehicle_id"] for r in unique], ["A", "B", "C"])
+        self.assertEqual(deduplicator.filter([make_record("C"), make_record("D")], "location_v1"),
+                         [make_record("D")])
+
+class RecordingSink:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, stream, records, schema_id=None):
+        self.writes.append((stream, list(records)))
+
+    def close(self):
+        pass
+
+class TestRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.registry = SchemaRegistry(schema_dir=os.path.join(self.tmp_dir, 'schemas'))
+        self.registry.register_schema("location_v1", LOCATION_SCHEMA)
+        self.sink = RecordingSink()
+        self.dispatcher = Dispatcher(self.registry, output_dir=os.path.join(self.tmp_dir, 'output'),
+                                     output_sink=self.sink)
+
+    def tearDown(self):
+        self.dispatcher.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def vehicle_ids(self, records):
+        return [r["vehicle_id"] for r in records]
+
+    def test_routes_filter_by_source_schema_and_fields(self):
+        everything, kafka_only, geofence = (RecordingBatchConsumer() for _ in range(3))
+        self.dispatcher.register_consumer(everything)
+        self.dispatcher.register_consumer(kafka_only, sources=["kafka"], schemas=["location_v1"])
+        self.dispatcher.register_consumer(geofence, where={
+            "lat": {"between": [40.0, 41.0]}, "lng": {"ge": -75, "lt": -73}})
+        
+        records = [make_record("in", lat=40.7), make_record("north", lat=45.0), make_record("edge", lat=41.0)]
+        self.dispatcher.receive_batch(records, "csv", "location_v1")
+        self.dispatcher.receive_batch([make_record("k", lat=0.0)], "kafka", "location_v1")
+        
+        self.assertEqual([self.vehicle_ids(b[0]) for b in everything.batches], [["in", "north", "edge"], ["k"]])
+        self.assertEqual([self.vehicle_ids(b[0]) for b in kafka_only.batches], [["k"]])
+        self.assertEqual([self.vehicle_ids(b[0]) for b in geofence.batches], [["in", "edge"]])
+        self.assertEqual(self.sink.writes, [])
+
+    def test_unmatched_records_go_to_the_output_sink(self):
+        consumer = RecordingConsumer()
+        self.dispatcher.register_consumer(consumer, where={"vehicle_id": {"in": ["A", "B"]}})
+        self.dispatcher.receive_batch([make_record("A"), make_record("C")], "api", "location_v1")
+        self.dispatcher.route_batch([make_record("D")], "api", "other_v1")
+        self.assertEqual(self.vehicle_ids(consumer.records), ["A"])
+        self.assertEqual([(stream, self.vehicle_ids(records)) for stream, records in self.sink.writes],
+                         [("api", ["C"]), ("api", ["D"])])
+
+    def test_predicates_handle_missing_fields_and_odd_types(self):
+        match = compile_predicate({"speed": {"gt": 10}, "driver": {"ne": "x"}})
+        self.assertEqual(match([{"speed": 20}, {"speed": 5}, {}, {"speed": None}, {"speed": 30, "driver": "x"}]),
+                         [{"speed": 20}])
+        route = Route(None, where={"speed": {"gt": 10}, "tag": {"exists": False}})
+        self.assertEqual(route.select([{"speed": "fast"}, {"speed": 11}, {"speed": 12, "tag": 1}]),
+                         [{"speed": 11}])
+        with self.assertRaises(ValueError):
+            compile_predicate({"lat": {"near": 1}})
+
+    def test_index_only_holds_routes_that_apply(self):
+        table = RoutingTable()
+        for n in range(50):
+            table.add(RecordingConsumer(), sources=[f"source{n}"])
+        wanted = table.add(RecordingConsumer(), sources=["source7"], schemas=["location_v1"])
+        self.assertEqual(len(table.routes_for("source7", "location_v1")), 2)
+        self.assertIs(table.routes_for("source7", "location_v1")[1], wanted)
+        self.assertEqual(table.routes_for("source7", "other"), (table.routes[7],))
+        table.remove(wanted)
+        self.assertEqual(len(table.routes_for("source7", "location_v1")), 1)
+
+class TestAdmission(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.registry = SchemaRegistry(schema_dir=os.path.join(self.tmp_dir, 'schemas'))
+        self.registry.register_schema("location_v1", LOCATION_SCHEMA)
+        self.sink = RecordingSink()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def make_dispatcher(self, admission):
+        return Dispatcher(self.registry, output_dir=os.path.join(self.tmp_dir, 'output'),
+                          output_sink=self.sink, admission=admission)
+
+    def test_token_bucket_allows_bursts_then_the_rate(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=100, burst=50, clock=lambda: now[0])
+        self.assertEqual(bucket.reserve(50), 0)
+        self.assertIsNone(bucket.reserve(10, max_wait=0.05))
+        self.assertAlmostEqual(bucket.reserve(10), 0.1)
+        now[0] = 1.0
+        # Larger than the burst: admitted once enough tokens have accrued
+        self.assertAlmostEqual(bucket.reserve(100), 0.5)
+
+    def test_over_limit_sources_are_dropped_or_spilled(self):
+        admission = AdmissionController({
+            "ftp": {"rate": 10, "burst": 10, "overload": "spill", "max_wait": 0},
+            "api": {"rate": 10, "burst": 10, "overload": "drop", "max_wait": 0},
+        })
+        dispatcher = self.make_dispatcher(admission)
+        consumer = RecordingBatchConsumer()
+        dispatcher.register_consumer(consumer)
+        
+        self.assertEqual(dispatcher.receive_batch([make_record("A")] * 10, "ftp", "location_v1"), 10)
+        self.assertEqual(dispatcher.receive_batch([make_record("B")] * 5, "ftp", "location_v1"), 0)
+        self.assertEqual(dispatcher.receive_validated_batch([make_record("C")] * 10, [], "api", "location_v1"), 10)
+        self.assertFalse(dispatcher.receive_data(make_record("D"), "api", "location_v1"))
+        self.assertTrue(dispatcher.receive_data(make_record("E"), "kafka", "location_v1"))
+        
+        self.assertEqual(sum(len(b[0]) for b in consumer.batches), 21)
+        self.assertEqual([(stream, len(records)) for stream, records in self.sink.writes], [("spill_ftp", 5)])
+        self.assertEqual(self.sink.writes[0][1][0]["schema_id"], "location_v1")
+        self.assertEqual(admission.in_flight(), {"ftp": 0, "api": 0, "kafka": 0})
+
+    def test_shed_batches_give_their_tokens_back(self):
+        admission = AdmissionController({
+            "csv": {"rate": 10, "burst": 10, "max_concurrent": 1, "overload": "drop", "max_wait": 0},
+        })
+        self.assertTrue(admission.admit("csv", 5))
+        self.assertFalse(admission.admit("csv", 5))  # Tokens were there, the slot was not
+        admission.release("csv")
+        self.assertTrue(admission.admit("csv", 5))
+        admission.release("csv")
+
+    def test_concurrency_caps_and_weighted_sharing(self):
+        admission = AdmissionController({
+            "kafka": {"weight": 4},
+            "csv": {"weight": 1, "max_concurrent": 1, "overload": "drop", "max_wait": 0},
+        }, capacity=1)
+        self.assertTrue(admission.admit("csv", 100))
+        self.assertFalse(admission.admit("csv", 100))  # Its only slot is taken
+        
+        # With the slot busy, a csv batch and a kafka batch queue up; kafka goes first
+        admission.limits("csv").max_wait = 5
+        order = []
+        def admit(source):
+            admission.admit(source, 100)
+            order.append(source)
+            admission.release(source)
+        threads = [threading.Thread(target=admit, args=(source,)) for source in ("csv", "kafka")]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        admission.release("csv")
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ["kafka", "csv"])
+
+class FailingConsumer(RecordingBatchConsumer):
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def process_batch(self, records, source_name, schema_id):
+        if self.failures:
+            self.failures -= 1
+            raise IOError("disk full")
+        super().process_batch(records, source_name, schema_id)
+
+class FailingSink(RecordingSink):
+    def write(self, stream, records, schema_id=None):
+        raise IOError("disk full")
+
+class TestDeadLetters(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.registry = SchemaRegistry(schema_dir=os.path.join(self.tmp_dir, 'schemas'))
+        self.registry.register_schema("location_v1", LOCATION_SCHEMA)
+        self.store_dir = os.path.join(self.tmp_dir, 'dead_letters')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_segment_queue_rolls_recovers_and_truncates(self):
+        path = os.path.join(self.tmp_dir, 'queue')
+        queue = SegmentQueue(path, segment_bytes=100)
+        self.assertEqual(queue.append([b"record %d" % n for n in range(30)]), 0)
+        self.assertEqual(queue.read(25, max_records=2), [(25, b"record 25"), (26, b"record 26")])
+        self.assertGreater(len(os.listdir(path)), 4)
+        reader = SegmentQueue(path, readonly=True)
+        self.assertEqual([offset for offset, _ in reader.scan(28)], [28, 29])
+        queue.commit("reader", 20)
+        queue.truncate_before(queue.committed("reader"))
+        self.assertLessEqual(queue.start_offset, 20)
+        self.assertGreater(queue.start_offset, 0)
+        queue.close()
+        
+        # A crash in the middle of a write leaves a torn frame, which is cut off on open
+        last = sorted(name for name in os.listdir(path) if name.endswith('.log'))[-1]
+        with open(os.path.join(path, last), 'ab') as f:
+            f.write(b"\x00\x00\x00\x20torn")
+        queue = SegmentQueue(path, segment_bytes=100)
+        self.assertEqual(queue.end_offset, 30)
+        self.assertEqual(queue.append([b"after"]), 30)
+        self.assertEqual(queue.read(29), [(29, b"record 29"), (30, b"after")])
+        self.assertEqual(queue.committed("reader"), 20)
+        queue.close()
+
+    def test_rejected_and_undeliverable_records_are_stored_and_retried(self):
+        store = DeadLetterStore(self.store_dir, retry_delay=1.0, max_retries=2)
+        dispatcher = Dispatcher(self.registry, output_dir=os.path.join(self.tmp_dir, 'output'),
+                                output_sink=RecordingSink(), dead_letters=store)
+        consumer = FailingConsumer(failures=2)
+        dispatcher.register_consumer(consumer)
+        
+        dispatcher.receive_batch([make_record("A"), {"vehicle_id": "bad"}], "csv", "location_v1")
+        [(_, rejected)] = store.entries("rejected")
+        self.assertEqual(rejected["records"], [{"vehicle_id": "bad"}])
+        self.assertEqual(rejected["source"], "csv")
+        [(_, entry)] = store.entries("retry-0")
+        self.assertEqual((entry["consumer"], entry["error"]), ("FailingConsumer", "disk full"))
+        
+        # Retries back off: 1s after the failure, then 2s after the first retry fails
+        now = entry["timestamp"]
+        self.assertAlmostEqual(store.retry_due(dispatcher.redeliver, now + 0.5), 0.5)
+        store.retry_due(dispatcher.redeliver, now + 1.0)
+        [(_, entry)] = store.entries("retry-1")
+        self.assertEqual(consumer.batches, [])
+        store.retry_due(dispatcher.redeliver, entry["timestamp"] + 2.0)
+        self.assertEqual(consumer.batches, [([make_record("A")], "csv", "location_v1")])
+        self.assertEqual(list(store.entries("failed")), [])
+        dispatcher.close()
+
+    def test_replay_validates_rejected_records_again(self):
+        store = DeadLetterStore(self.store_dir)
+        store.reject([({"vehicle_id": "A"}, "missing lat"), (make_record("B"), "unknown schema")],
+                     "ftp", "location_v1")
+        store.close()
+        
+        dispatcher = Dispatcher(self.registry, output_dir=os.path.join(self.tmp_dir, 'output'),
+                                output_sink=RecordingSink())
+        consumer = RecordingBatchConsumer()
+        dispatcher.register_consumer(consumer)
+        reader = DeadLetterStore(self.store_dir, readonly=True)
+        self.assertEqual(replay(reader, "rejected", dispatcher), (2, 0))
+        self.assertEqual(consumer.batches, [([make_record("B")], "ftp", "location_v1")])
+        # The cursor remembers the replay; --from-start replays again
+        self.assertEqual(replay(reader, "rejected", dispatcher), (0, 0))
+        self.assertEqual(replay(reader, "rejected", dispatcher, from_start=True), (2, 0))
+        dispatcher.close()
+
+    def test_replay_of_failed_batches_stops_at_one_that_fails_again(self):
+        store = DeadLetterStore(self.store_dir, max_retries=0)
+        for vehicle_id in "ABC":
+            store.undeliverable([make_record(vehicle_id)], "FailingConsumer", "csv", "location_v1",
+                                "disk full")
+        store.close()
+        
+        dispatcher = Dispatcher(self.registry, output_dir=os.path.join(self.tmp_dir, 'output'),
+                                output_sink=RecordingSink())
+        consumer = FailingConsumer(failures=0)
+        dispatcher.register_consumer(consumer)
+        reader = DeadLetterStore(self.store_dir, readonly=True)
+        # Fails on B, after A went through
+        deliver = dispatcher.redeliver
+        dispatcher.redeliver = lambda name, records, *args: (
+            (records, "still full") if records[0]["vehicle_id"] == "B" else deliver(name, records, *args))
+        self.assertEqual(replay(reader, "failed", dispatcher, commit_every=1), (1, 1))
+        
+        # B was not skipped: the next run starts with it
+        dispatcher.redeliver = deliver
+        self.assertEqual(replay(reader, "failed", dispatcher, commit_every=1), (2, 0))
+        self.assertEqual([batch[0][0]["vehicle_id"] for batch in consumer.batches], ["A", "B", "C"])
+        dispatcher.close()
+
+    def test_running_store_truncates_behind_replay_cursors(self):
+        store = DeadLetterStore(self.store_dir, segment_bytes=100)
+        for n in range(10):
+            store.spill([make_record(f"V{n}")], "ftp", "location_v1")
+        queue = store.queue("spill")
+        store.truncate_replayed()
+        self.assertEqual(queue.start_offset, 0)  # Never replayed
+        
+        dispatcher = Dispatcher(self.registry, output_dir=os.path.join(self.tmp_dir, 'output'),
+                                output_sink=RecordingSink())
+        reader = DeadLetterStore(self.store_dir, readonly=True)
+        self.assertEqual(replay(reader, "spill", dispatcher), (10, 0))
+        store.truncate_replayed()
+        self.assertEqual(queue.start_offset, 9)  # Only the segment being written is left
+        self.assertEqual(replay(reader, "spill", dispatcher, from_start=True), (1, 0))
+        dispatcher.close()
+        store.close()
+
+class TestPipelinedDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.registry = SchemaRegistry(schema_dir=os.path.join(self.tmp_dir, 'schemas'))
+        self.registry.register_schema("location_v1", LOCATION_SCHEMA)
+        self.output_dir = os.path.join(self.tmp_dir, 'output')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def make_dispatcher(self, **kwargs):
+        return PipelinedDispatcher(self.registry, output_dir=self.output_dir, **kwargs)
+
+    def test_slow_consumer_does_not_block_adapter(self):
+        dispatcher = self.make_dispatcher()
+        slow, fast = BlockingConsumer(), RecordingBatchConsumer()
+        dispatcher.register_consumer(slow)
+        dispatcher.register_consumer(fast)
+        
+        for n in range(5):
+            dispatcher.receive_batch([make_record(str(n))], "kafka", "location_v1")
+        self.assertEqual(slow.batches, [])
+        
+        slow.release.set()
+        dispatcher.close()
+        self.assertEqual(len(slow.batches), 5)
+        self.assertEqual(len(fast.batches), 5)
+
+    def test_records_are_queued_only_for_matching_consumers(self):
+        sink = RecordingSink()
+        dispatcher = self.make_dispatcher(output_sink=sink)
+        south, north = RecordingBatchConsumer(), RecordingBatchConsumer()
+        dispatcher.register_consumer(south, where={"lat": {"lt": 0}})
+        dispatcher.register_consumer(north, where={"lat": {"gt": 0}})
+        dispatcher.receive_batch([make_record("S", lat=-10.0), make_record("N", lat=10.0),
+                                  make_record("E", lat=0.0)], "csv", "location_v1")
+        dispatcher.close()
+        self.assertEqual([r["vehicle_id"] for b in south.batches for r in b[0]], ["S"])
+        self.assertEqual([r["vehicle_id"] for b in north.batches for r in b[0]], ["N"])
+        self.assertEqual([r["vehicle_id"] for _, records in sink.writes for r in records], ["E"])
+
+    def test_admitted_batches_hold_their_slot_until_routed(self):
+        admission = AdmissionController({"csv": {"max_concurrent": 1, "overload": "drop", "max_wait": 0}})
+        dispatcher = self.make_dispatcher(admission=admission, output_sink=RecordingSink())
+        consumer = BlockingConsumer()
+        dispatcher.register_consumer(consumer)
+        self.assertEqual(dispatcher.receive_batch([make_record("A")], "csv", "location_v1"), 1)
+        self.assertEqual(dispatcher.receive_batch([make_record("B")], "csv", "location_v1"), 0)
+        consumer.release.set()
+        dispatcher.close()
+        self.assertEqual(admission.in_flight(), {"csv": 0})
+
+    def test_close_drains_in_flight_records(self):
+        dispatcher = self.make_dispatcher(validation_workers=3)
+        consumer = RecordingConsumer()
+        dispatcher.register_consumer(consumer)
+        for n in range(100):
+            dispatcher.receive_batch([make_record(str(n)), make_record(lat="bad")], "csv", "location_v1")
+        dispatcher.close()
+        
+        self.assertEqual(len(consumer.records), 100)
+        with self.assertRaises(RuntimeError):
+            dispatcher.receive_data(make_record(), "csv", "location_v1")
+
+    def test_on_done_waits_for_every_consumer(self):
+        dispatcher = self.make_dispatcher()
+        slow, fast = BlockingConsumer(), RecordingBatchConsumer()
+        dispatcher.register_consumer(slow)
+        dispatcher.register_consumer(fast)
+        done = threading.Event()
+        dispatcher.receive_batch([make_record()], "kafka", "location_v1", on_done=done.set)
+        self.assertFalse(done.wait(0.1))
+        slow.release.set()
+        self.assertTrue(done.wait(5))
+        dispatcher.close()
+
+    def test_batches_that_fail_to_dispatch_are_set_aside_and_finished(self):
+        store = DeadLetterStore(os.path.join(self.tmp_dir, 'dead_letters'))
+        dispatcher = self.make_dispatcher(output_sink=FailingSink(), dead_letters=store)
+        done = threading.Event()
+        # Without consumers the records go to the output sink, which fails
+        dispatcher.receive_batch([make_record("A")], "kafka", "location_v1", on_done=done.set)
+        self.assertTrue(done.wait(5))
+        dispatcher.close()
+        [(_, entry)] = DeadLetterStore(store.directory, readonly=True).entries("rejected")
+        self.assertEqual(entry["records"], [make_record("A")])
+        self.assertEqual(entry["errors"], ["Dispatch failed: disk full"])
+
+    def test_batches_of_a_source_stay_in_order(self):
+        dispatcher = self.make_dispatcher(validation_workers=4)
+        consumer = RecordingBatchConsumer()
+        dispatcher.register_consumer(consumer)
+        for n in range(50):
+            for source in ("kafka", "api", "csv"):
+                dispatcher.receive_batch([make_record(str(n))], source, "location_v1")
+        dispatcher.close()
+        for source in ("kafka", "api", "csv"):
+            self.assertEqual([b[0][0]["vehicle_id"] for b in consumer.batches if b[1] == source],
+                             [str(n) for n in range(50)])
+
+    def test_full_queues_block_the_adapter(self):
+        dispatcher = self.make_dispatcher(queue_size=1, validation_workers=1, consumer_queue_size=1)
+        consumer = BlockingConsumer()
+        dispatcher.register_consumer(consumer)
+        
+        done = threading.Event()
+        def produce():
+            for n in range(10):
+                dispatcher.receive_batch([make_record(str(n))], "api", "location_v1")
+            done.set()
+        threading.Thread(target=produce, daemon=True).start()
+        
+        self.assertFalse(done.wait(0.3))
+        consumer.release.set()
+        self.assertTrue(done.wait(5))
+        dispatcher.close()
+        self.assertEqual(len(consumer.batches), 10)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
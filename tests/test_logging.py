@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from src.utils.logging import JsonFormatter, RateLimitedLogger, setup_logging, shutdown_logging
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+class Exploding:
+    def __str__(self):
+        raise AssertionError("formatted although the level is disabled")
+
+class TestLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root_handlers = list(logging.getLogger().handlers)
+        self.logger = logging.getLogger("test-logging")
+        self.logger.propagate = False
+        self.handler = ListHandler()
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.propagate = True
+        setup_logging(log_file=os.path.join("logs", "ingestion.log"))
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_setup_twice_does_not_duplicate_handlers(self):
+        log_file = os.path.join(self.tmp_dir, "logs", "app.log")
+        setup_logging(log_file=log_file)
+        count = len(logging.getLogger().handlers)
+        setup_logging(log_file=log_file)
+        self.assertEqual(len(logging.getLogger().handlers), count)
+
+    def test_async_json_output_reaches_the_file(self):
+        log_file = os.path.join(self.tmp_dir, "app.log")
+        logger = setup_logging(log_file=log_file, json_format=True)
+        logger.warning("Slow batch from %s", "kafka", extra={"records": 500})
+        shutdown_logging()
+
+        with open(log_file) as f:
+            entry = json.loads(f.readline())
+        self.assertEqual(entry["message"], "Slow batch from kafka")
+        self.assertEqual(entry["level"], "WARNING")
+        self.assertEqual(entry["records"], 500)
+
+    def test_json_formatter_includes_exceptions(self):
+        try:
+            raise ValueError("bad row")
+        except ValueError:
+            record = logging.LogRecord("x", logging.ERROR, "f.py", 1, "failed", (), sys.exc_info())
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertIn("ValueError: bad row", entry["exception"])
+
+    def test_disabled_levels_are_not_formatted(self):
+        self.logger.setLevel(logging.INFO)
+        self.logger.debug("Record %s", Exploding())
+        RateLimitedLogger(self.logger).debug("Record %s", Exploding())
+        self.assertEqual(self.handler.records, [])
+
+    def test_rate_limited_logger_reports_suppressed_messages(self):
+        self.logger.setLevel(logging.INFO)
+        throttled = RateLimitedLogger(self.logger, interval=3600)
+        for n in range(5):
+            throttled.error("Validation failed for record %d", n)
+        throttled.interval = 0
+        throttled.error("Validation failed for record %d", 5)
+
+        messages = [record.getMessage() for record in self.handler.records]
+        self.assertEqual(messages, ["Validation failed for record 0",
+                                    "Validation failed for record 5 (4 similar messages suppressed)"])
+
+    def test_sampling_logs_every_nth_call(self):
+        self.logger.setLevel(logging.INFO)
+        sampled = RateLimitedLogger(self.logger, interval=0, sample_every=10)
+        for n in range(1, 31):
+            sampled.info("Batch %d", n)
+        self.assertEqual(len(self.handler.records), 3)
+
+if __name__ == '__main__':
+    unittest.main()
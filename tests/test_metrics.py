@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from urllib.request import urlopen
+from src.dispatcher.core import Dispatcher
+from src.schema_registry.registry import SchemaRegistry
+from src.utils.metrics import MetricsRegistry, MetricsServer, metrics
+
+LOCATION_SCHEMA = {
+    "schema_id": "location_v1",
+    "version": 1,
+    "type": "json",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "vehicle_id": {"type": "string"},
+            "lat": {"type": "number"},
+            "lng": {"type": "number"},
+            "timestamp": {"type": "string"}
+        },
+        "required": ["vehicle_id", "lat", "lng", "timestamp"]
+    }
+}
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counters_are_summed_across_threads(self):
+        counter = self.registry.counter("records_total", "Records.", ("source",))
+
+        def work():
+            for _ in range(1000):
+                counter.inc(("kafka",))
+            counter.inc(("csv",), 5)
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(counter.collect(), {("kafka",): 4000, ("csv",): 20})
+        self.assertIs(self.registry.counter("records_total", "Records.", ("source",)), counter)
+
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = self.registry.histogram("latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 3):
+            histogram.observe(value, ("validate",))
+
+        text = self.registry.render()
+        self.assertIn('latency_seconds_bucket{stage="validate",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{stage="validate",le="1"} 3', text)
+        self.assertIn('latency_seconds_bucket{stage="validate",le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_count{stage="validate"} 4', text)
+        self.assertIn('latency_seconds_sum{stage="validate"} 4.05', text)
+
+    def test_gauges_are_read_at_scrape_time(self):
+        depths = {"ingress": 3}
+        self.registry.gauge("queue_depth", "Depth.", ("queue",), callback=lambda: depths)
+        depths["ingress"] = 7
+        self.assertIn('queue_depth{queue="ingress"} 7', self.registry.render())
+
+    def test_server_exposes_prometheus_text(self):
+        self.registry.counter("up_total", "Up.").inc()
+        server = MetricsServer(self.registry, port=0)
+        server.start()
+        try:
+            with urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+                self.assertIn("text/plain", response.headers["Content-Type"])
+                self.assertIn("up_total 1", response.read().decode())
+        finally:
+            server.stop()
+
+    def test_dispatcher_counts_records_per_source_and_schema(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            registry = SchemaRegistry(schema_dir=os.path.join(tmp_dir, "schemas"))
+            registry.register_schema("location_v1", LOCATION_SCHEMA)
+            dispatcher = Dispatcher(registry, output_dir=os.path.join(tmp_dir, "output"))
+            record = {"vehicle_id": "A", "lat": 1.0, "lng": 2.0, "timestamp": "t"}
+            dispatcher.receive_batch([record, dict(record, lat="bad")], "metrics-test", "location_v1")
+            dispatcher.close()
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        text = metrics.render()
+        self.assertIn('ingest_records_received_total{source="metrics-test",schema="location_v1"} 2', text)
+        self.assertIn('ingest_records_accepted_total{source="metrics-test",schema="location_v1"} 1', text)
+        self.assertIn('ingest_records_rejected_total{source="metrics-test",schema="location_v1"} 1', text)
+        self.assertIn('output_bytes_written_total{format="jsonl",stream="metrics-test"}', text)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,401 @@
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from src.dispatcher.dead_letter import DeadLetterStore
+from src.output.database_writer import DatabaseWriter
+from src.output.geo_aggregator import GeoAggregator
+from src.output.sinks import JsonLinesSink, WireFormatSink, read_wire_segment
+from src.schema_registry.registry import SchemaRegistry
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+LOCATION_SCHEMA = {
+    "schema_id": "location_v1",
+    "version": 1,
+    "type": "json",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "vehicle_id": {"type": "string"},
+            "lat": {"type": "number"},
+            "lng": {"type": "number"},
+            "timestamp": {"type": "string"}
+        },
+        "required": ["vehicle_id", "lat", "lng", "timestamp"]
+    }
+}
+
+def dead_pid():
+    """The pid of a process that has exited."""
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+def make_records(count):
+    return [{"vehicle_id": f"VEH-{n % 3}", "lat": 37.0 + n, "lng": -122, "timestamp": "2023-10-01T12:00:00Z"}
+            for n in range(count)]
+
+class TestJsonLinesSink(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def read_stream(self, prefix):
+        records = []
+        for filename in sorted(os.listdir(self.output_dir)):
+            if filename.startswith(prefix) and filename.endswith('.jsonl'):
+                with open(os.path.join(self.output_dir, filename)) as f:
+                    records.extend(json.loads(line) for line in f)
+        return records
+
+    def test_records_are_buffered_until_flush(self):
+        sink = JsonLinesSink(self.output_dir, flush_records=10, flush_interval=60)
+        sink.write('csv', [{'n': 1}, {'n': 2}])
+        self.assertEqual(os.listdir(self.output_dir), [])
+        
+        sink.close()
+        self.assertEqual(self.read_stream('csv_'), [{'n': 1}, {'n': 2}])
+
+    def test_segments_roll_by_size(self):
+        sink = JsonLinesSink(self.output_dir, segment_bytes=16, flush_records=1, flush_interval=60)
+        for n in range(5):
+            sink.write('api', [{'n': n}, {'n': n}])
+        sink.close()
+        
+        files = os.listdir(self.output_dir)
+        self.assertEqual(len(files), 5)
+        self.assertFalse([f for f in files if f.endswith('.open')])
+        self.assertEqual(len(self.read_stream('api_')), 10)
+
+    def test_write_after_close_raises(self):
+        sink = JsonLinesSink(self.output_dir)
+        sink.close()
+        with self.assertRaises(RuntimeError):
+            sink.write('kafka', [{'n': 1}])
+        self.assertFalse([f for f in os.listdir(self.output_dir) if f.endswith('.open')])
+
+    def test_same_second_writes_are_not_lost(self):
+        sink = JsonLinesSink(self.output_dir, segment_bytes=1, flush_records=1, flush_interval=60)
+        for n in range(50):
+            sink.write('kafka', [{'n': n}])
+        sink.close()
+        self.assertEqual([r['n'] for r in self.read_stream('kafka_')], list(range(50)))
+
+    def test_unfinished_segment_is_recovered(self):
+        path = os.path.join(self.output_dir, f'csv_20231001T000000_{dead_pid()}_000001.jsonl.open')
+        with open(path, 'wb') as f:
+            f.write(b'{"n":1}\n{"n":2}\n{"n":')
+        
+        JsonLinesSink(self.output_dir).close()
+        self.assertEqual(self.read_stream('csv_'), [{'n': 1}, {'n': 2}])
+
+    def test_segments_of_running_writers_are_left_alone(self):
+        live = JsonLinesSink(self.output_dir, flush_records=1, flush_interval=60)
+        live.write('kafka', [{'n': 1}])
+        other = os.path.join(self.output_dir, f'api_20231001T000000_{os.getppid()}_000001.jsonl.open')
+        with open(other, 'wb') as f:
+            f.write(b'{"n":2}\n')
+        
+        JsonLinesSink(self.output_dir).close()
+        self.assertEqual(len([f for f in os.listdir(self.output_dir) if f.endswith('.open')]), 2)
+        live.write('kafka', [{'n': 3}])
+        live.close()
+        self.assertEqual(self.read_stream('kafka_'), [{'n': 1}, {'n': 3}])
+
+class TestWireFormatSink(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.registry = SchemaRegistry(schema_dir=os.path.join(self.output_dir, 'schemas'))
+        self.registry.register_schema('location_avro_v1', {
+            "schema_id": "location_avro_v1",
+            "version": 1,
+            "type": "avro",
+            "schema": {"type": "record", "name": "Location", "fields": [
+                {"name": "vehicle_id", "type": "string"},
+                {"name": "lat", "type": "double"},
+                {"name": "lng", "type": "double"},
+                {"name": "timestamp", "type": "string"}
+            ]}
+        })
+        self.sink = WireFormatSink(self.registry, self.output_dir, flush_interval=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def segments(self, suffix):
+        return [os.path.join(self.output_dir, f) for f in sorted(os.listdir(self.output_dir))
+                if f.endswith(suffix)]
+
+    def test_records_are_written_in_wire_format(self):
+        records = make_records(5)
+        for record in records:
+            record['lng'] = -122.0
+        self.sink.write('kafka', records, 'location_avro_v1')
+        self.sink.write('rejected_kafka', [{'data': 'x', 'error': 'bad'}])
+        self.sink.close()
+
+        [segment] = self.segments('.wire')
+        payloads = list(read_wire_segment(segment))
+        self.assertEqual([self.sink.codec.decode(p) for p in payloads], records)
+        self.assertLess(os.path.getsize(segment), 0.7 * sum(len(json.dumps(r)) + 1 for r in records))
+        self.assertEqual(len(self.segments('.jsonl')), 1)
+
+    def test_unfinished_segment_is_recovered(self):
+        self.sink.close()
+        payload = self.sink.codec.encode(make_records(1)[0], 'location_avro_v1')
+        framed = len(payload).to_bytes(4, 'big') + payload
+        path = os.path.join(self.output_dir, f'kafka_20231001T000000_{dead_pid()}_000001.wire.open')
+        with open(path, 'wb') as f:
+            f.write(framed * 2 + framed[:7])
+
+        WireFormatSink(self.registry, self.output_dir).close()
+        self.assertEqual(len(list(read_wire_segment(path[:-len('.open')]))), 2)
+
+@unittest.skipIf(pq is None, "pyarrow is not installed")
+class TestParquetWriter(unittest.TestCase):
+
+    def setUp(self):
+        from src.output.parquet_writer import ParquetWriter
+        self.output_dir = tempfile.mkdtemp()
+        self.registry = SchemaRegistry(schema_dir=os.path.join(self.output_dir, 'schemas'))
+        self.registry.register_schema("location_v1", LOCATION_SCHEMA)
+        self.writer = ParquetWriter(self.registry, output_dir=self.output_dir,
+                                    row_group_size=4, flush_interval=60, file_row_groups=2)
+
+    def tearDown(self):
+        self.writer.close()
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def parquet_files(self):
+        directory = os.path.join(self.output_dir, "location_v1")
+        return sorted(os.path.join(directory, f) for f in os.listdir(directory))
+
+    def test_row_groups_and_types(self):
+        self.writer.process_batch(make_records(10), "csv", "location_v1")
+        self.writer.close()
+        
+        files = self.parquet_files()
+        self.assertEqual(len(files), 2)
+        self.assertTrue(all(f.endswith(".parquet") for f in files))
+        self.assertEqual(pq.ParquetFile(files[0]).num_row_groups, 2)
+        
+        table = pq.read_table(files[0])
+        self.assertEqual(str(table.schema.field("lat").type), "double")
+        self.assertEqual(str(table.schema.field("vehicle_id").type), "dictionary<values=string, indices=int32, ordered=0>")
+        self.assertEqual(table.num_rows + pq.read_table(files[1]).num_rows, 10)
+
+    def test_rows_stay_buffered_below_thresholds(self):
+        self.writer.process(make_records(1)[0])
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, "location_v1")))
+        self.writer.flush_interval = 0
+        self.writer.flush()
+        self.assertEqual(len(self.parquet_files()), 1)
+        self.assertTrue(self.parquet_files()[0].endswith(".tmp"))
+
+    def test_nullable_types_and_badly_typed_rows(self):
+        self.registry.register_schema("reading_v1", {
+            "schema_id": "reading_v1", "version": 1, "type": "json",
+            "schema": {"type": "object", "properties": {
+                "sensor": {"type": "string"}, "value": {"type": ["number", "null"]}}}
+        })
+        self.writer.process_batch([{"sensor": "a", "value": 1.5}, {"sensor": "b", "value": "high"},
+                                   {"sensor": "c", "value": None}], "api", "reading_v1")
+        self.writer.close()
+        directory = os.path.join(self.output_dir, "reading_v1")
+        table = pq.read_table(os.path.join(directory, os.listdir(directory)[0]))
+        self.assertEqual(str(table.schema.field("value").type), "double")
+        self.assertEqual(table.column("sensor").to_pylist(), ["a", "c"])
+
+class TestDatabaseWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.registry = SchemaRegistry(schema_dir=os.path.join(self.output_dir, 'schemas'))
+        self.registry.register_schema("location_v1", LOCATION_SCHEMA)
+        self.path = os.path.join(self.output_dir, "ingest.db")
+        self.writer = DatabaseWriter(self.registry, path=self.path, batch_size=4, flush_interval=60)
+
+    def tearDown(self):
+        self.writer.close()
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def query(self, sql):
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute(sql).fetchall()
+        finally:
+            connection.close()
+
+    def test_rows_are_written_in_transactions(self):
+        self.writer.process_batch(make_records(3), "csv", "location_v1")
+        # Below batch_size and flush_interval nothing is committed yet
+        self.assertEqual(self.query("SELECT name FROM sqlite_master WHERE type = 'table'"), [])
+        self.writer.process_batch(make_records(3), "api", "location_v1")
+        self.writer.flush()
+        
+        self.assertEqual(self.query("PRAGMA journal_mode"), [("wal",)])
+        self.assertEqual(self.query("SELECT _source, COUNT(*) FROM location_v1 GROUP BY _source"),
+                         [("api", 3), ("csv", 3)])
+        self.assertEqual(self.query("SELECT name, type FROM pragma_table_info('location_v1')"),
+                         [("vehicle_id", "TEXT"), ("lat", "REAL"), ("lng", "REAL"),
+                          ("timestamp", "TEXT"), ("_source", "TEXT")])
+
+    def test_latest_table_keeps_newest_row_per_key(self):
+        records = make_records(6)
+        records[5]["timestamp"] = "2023-10-01T11:00:00Z"  # Arrives late for VEH-2
+        self.writer.process_batch(records, "csv", "location_v1")
+        self.writer.flush()
+        self.assertEqual(self.query("SELECT vehicle_id, lat FROM location_v1_latest ORDER BY vehicle_id"),
+                         [("VEH-0", 40.0), ("VEH-1", 41.0), ("VEH-2", 39.0)])
+
+    def test_new_schema_versions_add_columns(self):
+        self.writer.process_batch(make_records(1), "csv", "location_v1")
+        self.writer.flush()
+        v2 = json.loads(json.dumps(LOCATION_SCHEMA))
+        v2["version"] = 2
+        v2["schema"]["properties"]["tags"] = {"type": "array"}
+        self.registry.register_schema("location_v1", v2)
+        self.writer.process_batch([dict(make_records(1)[0], tags=["a"])], "csv", "location_v1")
+        self.writer.close()
+        self.assertEqual(self.query("SELECT tags FROM location_v1 ORDER BY rowid"), [(None,), ('["a"]',)])
+
+    def test_nullable_types_and_failed_writes(self):
+        self.writer.close()
+        store = DeadLetterStore(os.path.join(self.output_dir, "dead_letters"))
+        self.writer = DatabaseWriter(self.registry, path=self.path, flush_interval=60, dead_letters=store)
+        self.registry.register_schema("reading_v1", {
+            "schema_id": "reading_v1", "version": 1, "type": "json",
+            "schema": {"type": "object", "properties": {"value": {"type": ["integer", "null"]}}}
+        })
+        self.writer.process_batch([{"value": 1}], "api", "reading_v1")
+        self.writer.process_batch(make_records(2), "csv", "unknown_v1")
+        self.writer.close()
+        self.assertEqual(self.query("SELECT name, type FROM pragma_table_info('reading_v1')"),
+                         [("value", "INTEGER"), ("_source", "TEXT")])
+        [(_, entry)] = store.entries("retry-0")
+        self.assertEqual((entry["consumer"], entry["source"], entry["schema_id"], len(entry["records"])),
+                         ("DatabaseWriter", "csv", "unknown_v1", 2))
+        store.close()
+        with self.assertRaises(RuntimeError):
+            self.writer.flush()
+
+    def test_failing_row_rolls_back_its_whole_schema_batch(self):
+        self.writer.close()
+        store = DeadLetterStore(os.path.join(self.output_dir, "dead_letters"))
+        self.writer = DatabaseWriter(self.registry, path=self.path, flush_interval=60, dead_letters=store)
+        self.registry.register_schema("reading_v1", {
+            "schema_id": "reading_v1", "version": 1, "type": "json",
+            "schema": {"type": "object", "properties": {"value": {"type": "integer"}}}
+        })
+        self.writer.process_batch(make_records(1), "csv", "location_v1")
+        self.writer.flush()
+        records = make_records(3)
+        records[2]["lat"] = {"not": "bindable"}  # Fails after two rows went in
+        self.writer.process_batch(records, "csv", "location_v1")
+        self.writer.process_batch([{"value": 1}], "api", "reading_v1")
+        self.writer.close()
+        
+        self.assertEqual(self.query("SELECT COUNT(*) FROM location_v1"), [(1,)])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM location_v1_latest"), [(1,)])
+        self.assertEqual(self.query("SELECT value FROM reading_v1"), [(1,)])
+        [(_, entry)] = store.entries("retry-0")
+        self.assertEqual((entry["schema_id"], len(entry["records"])), ("location_v1", 3))
+        store.close()
+
+class RecordingSink:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, stream, records, schema_id=None):
+        self.writes.append((stream, list(records)))
+
+class TestGeoAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.sink = RecordingSink()
+        self.aggregator = GeoAggregator(sink=self.sink, cell_degrees=0.1, window_seconds=60,
+                                        clock=lambda: self.now)
+
+    def tearDown(self):
+        self.aggregator.close()
+
+    def point(self, vehicle_id, lat, lng, timestamp):
+        return {"vehicle_id": vehicle_id, "lat": lat, "lng": lng, "timestamp": f"2023-10-01T12:00:{timestamp:02d}Z"}
+
+    def test_latest_positions_and_bounding_boxes(self):
+        self.aggregator.process_batch([
+            self.point("A", 40.71, -74.00, 0),
+            self.point("B", 40.75, -73.95, 0),
+            self.point("C", 51.50, -0.12, 0),
+            self.point("A", 40.80, -74.05, 10),
+            self.point("A", 10.0, 10.0, 5),  # Late; A has moved on
+        ], "kafka", "location_v1")
+        self.assertEqual(self.aggregator.position("A"),
+                         {"vehicle_id": "A", "lat": 40.80, "lng": -74.05, "timestamp": "2023-10-01T12:00:10Z"})
+        self.assertIsNone(self.aggregator.position("Z"))
+        ids = lambda positions: sorted(p["vehicle_id"] for p in positions)
+        self.assertEqual(ids(self.aggregator.within(40.7, -74.02, 40.76, -73.9)), ["B"])
+        self.assertEqual(ids(self.aggregator.within(40.0, -75.0, 41.0, -73.0)), ["A", "B"])
+        self.assertEqual(ids(self.aggregator.within(-90, -180, 90, 180)), ["A", "B", "C"])
+        self.assertEqual(ids(self.aggregator.within(51.0, 179.0, 52.0, 0.0)), ["C"])  # Across the antimeridian
+        self.assertEqual(self.aggregator.cell_counts()[(40.7, -74.1)], 1)
+
+    def test_windows_roll_up_cell_counts_and_distances(self):
+        self.aggregator.process_batch([self.point("A", 0.0, 0.0, 0), self.point("A", 0.0, 0.05, 1),
+                                       self.point("B", 0.05, 0.05, 0)], "kafka", "location_v1")
+        self.assertIsNone(self.aggregator.roll())  # The window runs until 1020
+        self.now = 1020.0
+        cells, distances = self.aggregator.roll()
+        self.assertEqual([(c["lat"], c["lng"], c["count"]) for c in cells], [(0.0, 0.0, 3)])
+        self.assertEqual(cells[0]["window_start"], "1970-01-01T00:16:00Z")
+        by_vehicle = {d["vehicle_id"]: (d["distance_m"], d["points"]) for d in distances}
+        self.assertAlmostEqual(by_vehicle["A"][0], 5559.7, delta=1)
+        self.assertEqual(by_vehicle["B"], (0.0, 1))
+        self.assertEqual([stream for stream, _ in self.sink.writes], ["geo_cells", "geo_distance"])
+        
+        # Moving between cells files the vehicle under the new one
+        self.aggregator.process_batch([self.point("A", 0.15, 0.05, 2)], "kafka", "location_v1")
+        self.assertEqual(self.aggregator.within(0.1, 0.0, 0.2, 0.1)[0]["vehicle_id"], "A")
+        self.assertEqual(self.aggregator.within(0.0, 0.0, 0.099, 0.1)[0]["vehicle_id"], "B")
+        self.aggregator.close()
+        self.assertEqual(self.sink.writes[-1][1], [
+            {"window_start": "1970-01-01T00:17:00Z", "window_end": "1970-01-01T00:18:00Z",
+             "vehicle_id": "A", "distance_m": 16679.3, "points": 1}])
+
+    def test_quiet_vehicles_expire_when_a_window_closes(self):
+        self.aggregator.close()
+        self.aggregator = GeoAggregator(sink=self.sink, cell_degrees=0.1, window_seconds=60,
+                                        clock=lambda: self.now, position_ttl=100)
+        self.aggregator.process_batch([self.point(v, 0.05 * n, 0.0, 0) for n, v in enumerate("ABCD")],
+                                      "kafka", "location_v1")
+        self.now = 1100.0
+        self.aggregator.process_batch([self.point("B", 0.35, 0.0, 1), self.point("D", 0.05, 0.0, 1)],
+                                      "kafka", "location_v1")
+        self.now = 1150.0
+        _, distances = self.aggregator.roll()
+        self.assertEqual(sorted(d["vehicle_id"] for d in distances), ["A", "B", "C", "D"])
+        
+        # A and C were last seen at 1000; the remaining slots are compacted
+        self.assertIsNone(self.aggregator.position("A"))
+        self.assertIsNone(self.aggregator.position("C"))
+        self.assertEqual(self.aggregator.position("D")["lat"], 0.05)
+        self.assertEqual(sorted(self.aggregator._slots.values()), [0, 1])
+        self.assertEqual(sorted(p["vehicle_id"] for p in self.aggregator.within(-1, -1, 1, 1)), ["B", "D"])
+        self.assertEqual(self.aggregator.within(-0.01, -1, 0.01, 1), [])  # Where A was
+        self.assertEqual(sorted(self.aggregator._grid), [(0, 0), (3, 0)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,37 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from src.schema_registry.registry import SchemaRegistry
-from src.schema_registry.validators import validate_schema
+from src.schema_registry.remote import RemoteSchemaRegistry
+from src.schema_registry.validators import validate_schema, compile_validator, compile_fast_check
+from src.schema_registry.wire_format import HEADER
+
+try:
+    from src.schema_registry.wire_format import AvroCodec
+    import fastavro
+except ImportError:
+    fastavro = None
+
+AVRO_LOCATION = {
+    "schema_id": "location_avro_v1",
+    "version": 1,
+    "type": "avro",
+    "schema": {
+        "type": "record",
+        "name": "Location",
+        "fields": [
+            {"name": "vehicle_id", "type": "string"},
+            {"name": "lat", "type": "double"},
+            {"name": "lng", "type": "double"},
+            {"name": "timestamp", "type": "string"}
+        ]
+    }
+}
 
 class TestSchemaRegistry(unittest.TestCase):
 
@@ -47,5 +78,423 @@ class TestSchemaRegistry(unittest.TestCase):
         result = validate_schema(invalid_data, self.schema)
         self.assertFalse(result)
 
+class TestCompiledValidators(unittest.TestCase):
+
+    def setUp(self):
+        self.schema_dir = tempfile.mkdtemp()
+        self.registry = SchemaRegistry(schema_dir=self.schema_dir)
+        self.entry = {
+            "schema_id": "location_v1",
+            "version": 1,
+            "type": "json",
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "vehicle_id": {"type": "string"},
+                    "lat": {"type": "number", "minimum": -90, "maximum": 90},
+                    "lng": {"type": "number"},
+                    "timestamp": {"type": "string"}
+                },
+                "required": ["vehicle_id", "lat", "lng", "timestamp"]
+            }
+        }
+        self.registry.register_schema("location_v1", self.entry)
+        self.valid_data = {"vehicle_id": "123ABC", "lat": 37.7749, "lng": -122.4194,
+                           "timestamp": "2023-10-01T12:00:00Z"}
+
+    def tearDown(self):
+        shutil.rmtree(self.schema_dir, ignore_errors=True)
+
+    def test_validator_is_cached(self):
+        validator = self.registry.get_validator("location_v1")
+        self.assertIs(validator, self.registry.get_validator("location_v1"))
+        self.assertTrue(validator.fast_path)
+
+    def test_cache_keeps_validators_in_use(self):
+        self.registry.validator_cache_size = 2
+        for n in range(2, 5):
+            self.registry.register_schema("location_v1", dict(self.entry, version=n))
+        self.registry.get_validator("location_v1", 1)
+        self.registry.get_validator("location_v1", 2)
+        self.registry.get_validator("location_v1", 1)  # Hit: version 1 is in use
+        self.registry.get_validator("location_v1", 3)
+        self.assertEqual(sorted(self.registry._validators), [("location_v1", 1), ("location_v1", 3)])
+        # Version 1 had its second chance; only version 3 was used since
+        self.registry.get_validator("location_v1", 3)
+        self.registry.get_validator("location_v1", 4)
+        self.assertEqual(sorted(self.registry._validators), [("location_v1", 3), ("location_v1", 4)])
+
+    def test_valid_and_invalid_records(self):
+        self.assertEqual(self.registry.validate_data(self.valid_data, "location_v1"), (True, None))
+        
+        invalid_data = dict(self.valid_data, lat="not_a_number")
+        is_valid, error = self.registry.validate_data(invalid_data, "location_v1")
+        self.assertFalse(is_valid)
+        self.assertIn("not_a_number", error)
+        
+        out_of_range = dict(self.valid_data, lat=120.0)
+        self.assertFalse(self.registry.validate_data(out_of_range, "location_v1")[0])
+
+    def test_fast_path_falls_back_to_full_validator(self):
+        # 1.0 is an integer for jsonschema but not for the generated check
+        schema = {"type": "object", "properties": {"n": {"type": "integer"}}}
+        validator = compile_validator(schema)
+        self.assertEqual(validator({"n": 1.0}), (True, None))
+        self.assertFalse(validator({"n": True})[0])
+
+    def test_complex_schema_has_no_fast_path(self):
+        schema = {"type": "object", "properties": {"tags": {"type": "array"}}}
+        self.assertIsNone(compile_fast_check(schema))
+        self.assertFalse(compile_validator(schema).fast_path)
+
+    def test_register_invalidates_cache(self):
+        self.registry.get_validator("location_v1")
+        entry = dict(self.entry, schema_id="other_v1")
+        self.registry.register_schema("other_v1", entry)
+        self.registry.get_validator("other_v1")
+        self.assertEqual(len(self.registry._validators), 2)
+        self.registry.schemas.pop("location_v1")
+        self.registry.register_schema("location_v1", self.entry)
+        self.assertNotIn(("location_v1", 1), self.registry._validators)
+
+    def test_unknown_schema_raises(self):
+        with self.assertRaises(ValueError):
+            self.registry.validate_data(self.valid_data, "missing_v1")
+
+@unittest.skipIf(fastavro is None, "fastavro is not installed")
+class TestAvroWireFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.schema_dir = tempfile.mkdtemp()
+        self.registry = SchemaRegistry(schema_dir=self.schema_dir)
+        self.registry.register_schema("location_avro_v1", AVRO_LOCATION)
+        self.codec = AvroCodec(self.registry)
+        self.records = [{"vehicle_id": f"VEH-{n}", "lat": 37.0 + n, "lng": -122.5,
+                         "timestamp": "2023-10-01T12:00:00Z"} for n in range(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.schema_dir, ignore_errors=True)
+
+    def test_avro_schemas_validate_records(self):
+        self.assertEqual(self.registry.validate_data(self.records[0], "location_avro_v1"), (True, None))
+        is_valid, error = self.registry.validate_data(dict(self.records[0], lat="north"), "location_avro_v1")
+        self.assertFalse(is_valid)
+        self.assertIn("Location.lat", error)
+
+    def test_round_trip_with_schema_id_header(self):
+        payloads, rejected = self.codec.encode_batch(self.records, "location_avro_v1")
+        self.assertEqual(rejected, [])
+        self.assertEqual(HEADER.unpack_from(payloads[0]), (0, self.registry.wire_id("location_avro_v1")))
+        self.assertLess(len(payloads[0]), 0.6 * len(json.dumps(self.records[0])))
+        self.assertEqual(self.codec.decode_batch(payloads, "location_avro_v1"), (self.records, []))
+
+    def test_malformed_payloads_are_rejected(self):
+        payload = self.codec.encode(self.records[0], "location_avro_v1")
+        unknown = HEADER.pack(0, 12345) + payload[HEADER.size:]
+        records, rejected = self.codec.decode_batch(
+            [payload, payload[:-4], payload + b"x", unknown, b"{}", "text"])
+        self.assertEqual(records, [self.records[0]])
+        errors = [error for _, error in rejected]
+        self.assertIn("Malformed Avro body", errors[0])
+        self.assertIn("Trailing bytes", errors[1])
+        self.assertIn("Unknown schema wire id 12345", errors[2])
+        self.assertEqual(len(errors), 5)
+
+    def test_payloads_of_another_schema_are_rejected(self):
+        self.registry.register_schema("other_avro_v1", dict(AVRO_LOCATION, schema_id="other_avro_v1"))
+        payload = self.codec.encode(self.records[0], "other_avro_v1")
+        with self.assertRaises(ValueError):
+            self.codec.decode(payload, "location_avro_v1")
+        self.assertEqual(self.codec.decode(payload), self.records[0])
+
+    def test_wire_ids_are_stable_and_unique(self):
+        reloaded = SchemaRegistry(schema_dir=self.schema_dir)
+        reloaded.register_schema("location_avro_v1", AVRO_LOCATION)
+        self.assertEqual(reloaded.wire_id("location_avro_v1"), self.registry.wire_id("location_avro_v1"))
+        clash = dict(AVRO_LOCATION, schema_id="clash_v1", wire_id=self.registry.wire_id("location_avro_v1"))
+        with self.assertRaises(ValueError):
+            self.registry.register_schema("clash_v1", clash)
+
+class TestSchemaEvolution(unittest.TestCase):
+
+    def setUp(self):
+        self.schema_dir = tempfile.mkdtemp()
+        self.registry = SchemaRegistry(schema_dir=self.schema_dir)
+        self.v1 = {
+            "schema_id": "location",
+            "version": 1,
+            "type": "json",
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "vehicle_id": {"type": "string"},
+                    "lat": {"type": "integer"},
+                    "lng": {"type": "number"},
+                    "note": {"type": "string"}
+                },
+                "required": ["vehicle_id", "lat", "lng"]
+            }
+        }
+        self.registry.register_schema("location", self.v1)
+
+    def tearDown(self):
+        shutil.rmtree(self.schema_dir, ignore_errors=True)
+
+    def version(self, version, properties, required, **entry):
+        return dict({"schema_id": "location", "version": version, "type": "json",
+                     "schema": {"type": "object", "properties": properties, "required": required}}, **entry)
+
+    def v2(self, **entry):
+        return self.version(2, {
+            "vehicle": {"type": "string", "aliases": ["vehicle_id"]},
+            "lat": {"type": "number"},
+            "lng": {"type": "number"},
+            "speed": {"type": "number", "default": 0},
+            "tags": {"type": "array", "default": []}
+        }, ["vehicle", "lat", "lng", "speed"], **entry)
+
+    def test_versions_are_kept_side_by_side(self):
+        self.registry.register_schema("location", self.v2())
+        self.assertEqual(self.registry.list_versions("location"), [1, 2])
+        self.assertEqual(self.registry.get_schema("location")["version"], 2)
+        self.assertIs(self.registry.get_schema("location", 1), self.v1)
+        record = {"vehicle_id": "A", "lat": 37, "lng": -122.0}
+        self.assertTrue(self.registry.validate_data(record, "location", version=1)[0])
+        self.assertFalse(self.registry.validate_data(record, "location")[0])
+
+    def test_incompatible_versions_are_refused(self):
+        new_required = self.version(2, {"vehicle_id": {"type": "string"}, "lat": {"type": "integer"},
+                                        "lng": {"type": "number"}, "heading": {"type": "number"}},
+                                    ["vehicle_id", "lat", "lng", "heading"])
+        with self.assertRaisesRegex(ValueError, "heading"):
+            self.registry.register_schema("location", new_required)
+        narrowed = self.version(2, {"vehicle_id": {"type": "string"}, "lat": {"type": "integer"},
+                                    "lng": {"type": "integer"}}, ["vehicle_id", "lat", "lng"])
+        with self.assertRaisesRegex(ValueError, "lng"):
+            self.registry.register_schema("location", narrowed)
+        with self.assertRaises(ValueError):
+            self.registry.register_schema("location", dict(self.v1))
+        self.assertEqual(self.registry.list_versions("location"), [1])
+
+    def test_forward_compatibility_checks_old_readers(self):
+        # Old readers need vehicle_id, which v2 only has under another name
+        with self.assertRaisesRegex(ValueError, "forward"):
+            self.registry.register_schema("location", self.v2(compatibility="full"))
+        self.registry.register_schema("location", self.v2(compatibility="none"))
+
+    def test_projection_renames_defaults_and_drops_fields(self):
+        self.registry.register_schema("location", self.v2())
+        project = self.registry.get_projection("location", 1)
+        self.assertIs(project, self.registry.get_projection("location", 1, 2))
+
+        projected = project({"vehicle_id": "A", "lat": 37, "lng": -122.0, "note": "x"})
+        self.assertEqual(projected, {"vehicle": "A", "lat": 37, "lng": -122.0, "speed": 0, "tags": []})
+        self.assertIsNot(projected["tags"], project({"vehicle_id": "B", "lat": 1, "lng": 2})["tags"])
+        self.assertTrue(self.registry.validate_data(projected, "location")[0])
+        self.assertEqual(self.registry.project_batch([projected], "location", 2), [projected])
+
+    @unittest.skipIf(fastavro is None, "fastavro is not installed")
+    def test_old_wire_payloads_are_upcast(self):
+        self.registry.register_schema("location_avro_v1", AVRO_LOCATION)
+        v2 = json.loads(json.dumps(AVRO_LOCATION))
+        v2["version"] = 2
+        v2["schema"]["fields"].append({"name": "speed", "type": "double", "default": 0.0})
+        self.registry.register_schema("location_avro_v1", v2)
+        codec = AvroCodec(self.registry)
+
+        record = {"vehicle_id": "A", "lat": 1.0, "lng": 2.0, "timestamp": "t"}
+        old = codec.encode(record, "location_avro_v1", version=1)
+        self.assertEqual(codec.decode(old, "location_avro_v1"), dict(record, speed=0.0))
+        self.assertEqual(codec.decode(old), record)
+
+class TestSchemaReload(unittest.TestCase):
+
+    def setUp(self):
+        self.schema_dir = tempfile.mkdtemp()
+        self.write("location_v1.json", {
+            "schema_id": "location", "version": 1, "type": "json",
+            "schema": {"type": "object", "properties": {"lat": {"type": "number"}}, "required": ["lat"]}
+        })
+        self.registry = SchemaRegistry(schema_dir=self.schema_dir)
+
+    def tearDown(self):
+        self.registry.close()
+        shutil.rmtree(self.schema_dir, ignore_errors=True)
+
+    def write(self, filename, entry, mtime=None):
+        path = os.path.join(self.schema_dir, filename)
+        with open(path, "w") as f:
+            f.write(entry if isinstance(entry, str) else json.dumps(entry))
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.05)
+        return condition()
+
+    def test_reload_only_reparses_changed_files(self):
+        validator = self.registry.get_validator("location")
+        self.assertFalse(self.registry.reload())
+        self.write("speed_v1.json", {"schema_id": "speed", "version": 1, "type": "json", "schema": {}})
+        self.assertTrue(self.registry.reload())
+        self.assertEqual(self.registry.list_schemas(), ["location", "speed"])
+        # The unchanged schema keeps its compiled validator
+        self.assertIs(self.registry.get_validator("location"), validator)
+
+        self.write("location_v2.json", {
+            "schema_id": "location", "version": 2, "type": "json",
+            "schema": {"type": "object", "properties": {"lat": {"type": "number"},
+                                                        "lng": {"type": "number", "default": 0}}}
+        })
+        self.assertTrue(self.registry.reload())
+        self.assertEqual(self.registry.list_versions("location"), [1, 2])
+        self.assertIs(self.registry.get_validator("location", 1), validator)
+
+    def test_broken_files_keep_the_previous_schema(self):
+        snapshot = self.registry._snapshot
+        self.write("location_v1.json", "{not json", mtime=time.time() + 10)
+        self.write("other.json", {"version": 1})
+        with self.assertLogs(level="ERROR") as logs:
+            self.assertTrue(self.registry.reload())
+        self.assertEqual(len(logs.output), 2)
+        self.assertIs(self.registry.get_schema("location"), snapshot.schemas["location"])
+        self.assertTrue(self.registry.validate_data({"lat": 1.0}, "location")[0])
+        # Broken files are only reported once
+        self.assertFalse(self.registry.reload())
+
+        incompatible = {"schema_id": "location", "version": 2, "type": "json",
+                        "schema": {"type": "object", "properties": {"id": {"type": "string"}},
+                                   "required": ["id"]}}
+        self.write("location_v2.json", incompatible)
+        with self.assertLogs(level="ERROR"):
+            self.registry.reload()
+        self.assertEqual(self.registry.list_versions("location"), [1])
+
+    def test_watch_picks_up_new_files(self):
+        self.registry.watch(poll_interval=0.05, use_inotify=False)
+        self.write("speed_v1.json", {"schema_id": "speed", "version": 1, "type": "json", "schema": {}})
+        self.assertTrue(self.wait_for(lambda: "speed" in self.registry.schemas))
+        os.remove(os.path.join(self.schema_dir, "speed_v1.json"))
+        self.assertTrue(self.wait_for(lambda: "speed" not in self.registry.schemas))
+
+class StubRegistryHandler(BaseHTTPRequestHandler):
+    """Serves subjects and ids like a Confluent schema registry."""
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        time.sleep(self.server.delay)
+        if self.server.failing:
+            self.send_response(500)
+            self.end_headers()
+            return
+        parts = self.path.strip("/").split("/")
+        body = None
+        if parts[0] == "subjects" and parts[1] in self.server.subjects:
+            versions = self.server.subjects[parts[1]]
+            version = max(versions) if parts[3] == "latest" else int(parts[3])
+            if version in versions:
+                schema_id, schema = versions[version]
+                body = {"subject": parts[1], "version": version, "id": schema_id,
+                        "schemaType": "JSON", "schema": json.dumps(schema)}
+        elif parts[0] == "schemas":
+            body = [{"subject": subject, "version": version}
+                    for subject, versions in self.server.subjects.items()
+                    for version, (schema_id, _) in versions.items() if schema_id == int(parts[2])] or None
+        if body is None:
+            body = {"error_code": 40401, "message": "Subject not found."}
+            self.send_response(404)
+        else:
+            self.send_response(200)
+        data = json.dumps(body).encode()
+        self.send_header("Content-Type", "application/vnd.schemaregistry.v1+json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestRemoteSchemaRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubRegistryHandler)
+        self.server.requests = []
+        self.server.delay = 0
+        self.server.failing = False
+        self.server.subjects = {"location": {1: (7, {"type": "object", "required": ["lat"]})}}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.registry = RemoteSchemaRegistry(f"http://127.0.0.1:{self.server.server_port}",
+                                             cache_ttl=60, negative_ttl=60)
+
+    def tearDown(self):
+        self.registry.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_schemas_are_fetched_once_and_cached(self):
+        self.assertTrue(self.registry.validate_data({"lat": 1}, "location")[0])
+        self.assertFalse(self.registry.validate_data({}, "location")[0])
+        self.assertEqual(self.server.requests, ["/subjects/location/versions/latest"])
+        self.assertEqual(self.registry.wire_id("location"), 7)
+        self.assertEqual(self.registry.lookup_wire_id(7), ("location", 1))
+
+        # Specific versions and ids are looked up by id too, through the same cache
+        self.server.subjects["location"][2] = (8, {"type": "object"})
+        self.assertEqual(self.registry.lookup_wire_id(8), ("location", 2))
+        self.assertEqual(self.registry.get_schema("location", 2)["wire_id"], 8)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_concurrent_misses_share_one_request(self):
+        self.server.delay = 0.2
+        threads = [threading.Thread(target=self.registry.get_validator, args=("location",))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_unknown_schemas_are_cached_as_missing(self):
+        self.assertIsNone(self.registry.get_schema("nope"))
+        self.assertIsNone(self.registry.get_schema("location", 5))
+        with self.assertRaises(ValueError):
+            self.registry.validate_data({}, "nope")
+        self.assertIsNone(self.registry.lookup_wire_id(99))
+        self.assertIsNone(self.registry.lookup_wire_id(99))
+        self.assertEqual(len(self.server.requests), 3)
+
+        self.registry.negative_ttl = 0
+        self.registry._missing.clear()
+        self.server.subjects["nope"] = {1: (9, {})}
+        self.assertEqual(self.registry.get_schema("nope")["version"], 1)
+
+    def test_unreachable_registry_is_not_asked_on_every_call(self):
+        self.server.failing = True
+        for _ in range(5):
+            with self.assertRaises(ValueError):
+                self.registry.validate_data({"lat": 1}, "location")
+        self.assertEqual(len(self.server.requests), 1)
+        
+        self.server.failing = False
+        self.registry.error_backoff = 0
+        self.registry._missing.clear()
+        self.assertTrue(self.registry.validate_data({"lat": 1}, "location")[0])
+
+    def test_cached_schemas_survive_outages_and_refresh_later(self):
+        self.registry.cache_ttl = 0
+        self.registry.negative_ttl = 0
+        self.assertTrue(self.registry.validate_data({"lat": 1}, "location")[0])
+        self.server.failing = True
+        self.assertTrue(self.registry.validate_data({"lat": 1}, "location")[0])
+        self.assertGreater(len(self.server.requests), 1)
+
+        self.server.failing = False
+        self.server.subjects["location"][2] = (8, {"type": "object", "required": ["lat", "lng"]})
+        self.assertFalse(self.registry.validate_data({"lat": 1}, "location")[0])
+        self.assertEqual(self.registry.list_versions("location"), [1, 2])
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()